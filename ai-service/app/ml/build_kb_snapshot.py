@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+import time
+
+# Allow running as `python app/ml/build_kb_snapshot.py` from the ai-service root
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
+
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(__file__), '../../../backend/.env'))
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../data')
+
+
+def build(source_path: str, snapshot_dir: str):
+    from app.services.med_rag_service import MedRagService
+    from app.services.kb_snapshot import sync_snapshot
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise SystemExit("GEMINI_API_KEY is not set")
+
+    # Same embedding settings as the service, without loading the knowledge base
+    service = MedRagService(api_key, data_path=source_path, snapshot_dir=snapshot_dir, autoload=False)
+
+    start = time.time()
+    records, matrix, embedded = sync_snapshot(source_path, snapshot_dir, service.embed_documents, service.embedding_model)
+    print(f"Snapshot written to: {os.path.abspath(snapshot_dir)}")
+    print(f"Records: {len(records)} (embedded {embedded}, reused {len(records) - embedded})")
+    print(f"Matrix: {matrix.shape} float32, {matrix.nbytes / 1e6:.1f} MB")
+    print(f"Took {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the MedQuAD embedding snapshot used by MedRagService.")
+    parser.add_argument("--source", default=os.path.join(DATA_DIR, 'medquad_sample.json'), help="MedQuAD JSON file")
+    parser.add_argument("--out", default=os.path.join(DATA_DIR, 'medquad_snapshot'), help="Snapshot directory")
+    args = parser.parse_args()
+    build(args.source, args.out)
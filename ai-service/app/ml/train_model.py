@@ -1,12 +1,12 @@
-import pandas as pd
+import argparse
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score
 import joblib
 import json
 import os
-import random
+import time
+from contextlib import contextmanager
 
 # 1. Define Knowledge Base (Disease -> Symptoms)
 # We map diseases to their common symptoms.
@@ -24,72 +24,255 @@ disease_symptoms = {
 }
 
 # 2. Generate Synthetic Dataset
-def generate_synthetic_data(num_samples=2000):
-    data = []
-    
-    # Get all unique symptoms
-    all_symptoms = sorted(list(set([s for symptoms in disease_symptoms.values() for s in symptoms])))
-    
-    print(f"Generating {num_samples} samples across {len(disease_symptoms)} diseases...")
+# Logic: If it's a symptom of the disease, high chance (90%) it's present.
+# Else, low chance (5%) it's present (noise).
+SYMPTOM_PRESENT_PROB = 0.9
+SYMPTOM_NOISE_PROB = 0.05
+
+def load_knowledge_base(path=None):
+    """Disease -> symptoms mapping; the built-in one unless a JSON file is given."""
+    if not path:
+        return disease_symptoms
+    with open(path) as f:
+        return json.load(f)
+
+def symptom_probabilities(knowledge_base, all_symptoms):
+    """(n_diseases, n_symptoms) probability of each symptom being present."""
+    column = {symptom: i for i, symptom in enumerate(all_symptoms)}
+    probs = np.full((len(knowledge_base), len(all_symptoms)), SYMPTOM_NOISE_PROB, dtype=np.float32)
+    for row, symptoms in enumerate(knowledge_base.values()):
+        probs[row, [column[s] for s in symptoms]] = SYMPTOM_PRESENT_PROB
+    return probs
+
+def iter_synthetic_chunks(num_samples, knowledge_base, all_symptoms, seed=42, chunk_size=100_000):
+    """
+    Yields (X, labels) blocks of at most `chunk_size` rows: X is a uint8 0/1
+    matrix in `all_symptoms` column order, labels index into the diseases.
+    Every block has its own seed derived from `seed`, so a given seed and chunk
+    size always produce the same dataset.
+    """
+    probs = symptom_probabilities(knowledge_base, all_symptoms)
+    for block, start in enumerate(range(0, num_samples, chunk_size)):
+        rows = min(chunk_size, num_samples - start)
+        rng = np.random.default_rng([seed, block])
+        labels = rng.integers(0, len(knowledge_base), rows, dtype=np.int32)
+        X = (rng.random((rows, len(all_symptoms)), dtype=np.float32) < probs[labels]).view(np.uint8)
+        yield X, labels
+
+def generate_synthetic_data(num_samples=2000, knowledge_base=None, seed=42, chunk_size=100_000):
+    """In-memory dataset: (X uint8 matrix, disease name per row, symptom columns)."""
+    knowledge_base = knowledge_base or disease_symptoms
+    all_symptoms = sorted(set(s for symptoms in knowledge_base.values() for s in symptoms))
+
+    print(f"Generating {num_samples} samples across {len(knowledge_base)} diseases...")
     print(f"Total identifying symptoms: {len(all_symptoms)}")
-    
-    for _ in range(num_samples):
-        # Pick a random disease
-        disease = random.choice(list(disease_symptoms.keys()))
-        true_symptoms = disease_symptoms[disease]
-        
-        # Create a sample vector
-        sample = {}
-        for symptom in all_symptoms:
-            # Logic: If it's a symptom of the disease, high chance (90%) it's present.
-            # Else, low chance (5%) it's present (noise).
-            if symptom in true_symptoms:
-                sample[symptom] = 1 if random.random() < 0.9 else 0
-            else:
-                sample[symptom] = 1 if random.random() < 0.05 else 0
-                
-        sample['Disease'] = disease
-        data.append(sample)
-        
-    return pd.DataFrame(data), all_symptoms
 
-# 3. Train Model
-def train():
-    df, all_symptoms = generate_synthetic_data()
-    
-    X = df[all_symptoms]
-    y = df['Disease']
-    
-    # Split
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    
+    X = np.empty((num_samples, len(all_symptoms)), dtype=np.uint8)
+    labels = np.empty(num_samples, dtype=np.int32)
+    start = 0
+    for X_chunk, label_chunk in iter_synthetic_chunks(num_samples, knowledge_base, all_symptoms, seed, chunk_size):
+        X[start:start + len(X_chunk)] = X_chunk
+        labels[start:start + len(X_chunk)] = label_chunk
+        start += len(X_chunk)
+
+    diseases = np.array(list(knowledge_base.keys()))
+    return X, diseases[labels], all_symptoms
+
+def write_dataset(prefix, num_samples, knowledge_base=None, seed=42, chunk_size=100_000, packed=False):
+    """
+    Streams the dataset to disk chunk by chunk, so it can be larger than
+    memory: `<prefix>_X.npy` (uint8, or np.packbits rows with `packed`),
+    `<prefix>_y.npy` (disease index) and `<prefix>_meta.json`.
+    """
+    knowledge_base = knowledge_base or disease_symptoms
+    all_symptoms = sorted(set(s for symptoms in knowledge_base.values() for s in symptoms))
+    width = (len(all_symptoms) + 7) // 8 if packed else len(all_symptoms)
+
+    X_out = np.lib.format.open_memmap(f"{prefix}_X.npy", mode='w+', dtype=np.uint8, shape=(num_samples, width))
+    y_out = np.lib.format.open_memmap(f"{prefix}_y.npy", mode='w+', dtype=np.int32, shape=(num_samples,))
+    start = 0
+    for X_chunk, label_chunk in iter_synthetic_chunks(num_samples, knowledge_base, all_symptoms, seed, chunk_size):
+        stop = start + len(X_chunk)
+        X_out[start:stop] = np.packbits(X_chunk, axis=1) if packed else X_chunk
+        y_out[start:stop] = label_chunk
+        start = stop
+    X_out.flush()
+    y_out.flush()
+    del X_out, y_out
+
+    with open(f"{prefix}_meta.json", 'w') as f:
+        json.dump({"symptoms": all_symptoms, "diseases": list(knowledge_base.keys()), "packed": packed, "seed": seed}, f)
+    return all_symptoms
+
+def load_dataset(prefix, max_rows=None):
+    """Memory-maps a dataset written by `write_dataset` (packed rows are unpacked)."""
+    with open(f"{prefix}_meta.json") as f:
+        meta = json.load(f)
+    X = np.load(f"{prefix}_X.npy", mmap_mode='r')[:max_rows]
+    labels = np.load(f"{prefix}_y.npy", mmap_mode='r')[:max_rows]
+    if meta["packed"]:
+        X = np.unpackbits(X, axis=1, count=len(meta["symptoms"]))
+    return X, np.array(meta["diseases"])[labels], meta["symptoms"]
+
+# 3. Export for sklearn-free serving (see app/services/forest_inference.py)
+def export_forest(clf, path):
+    """
+    Flattens every tree of the forest into shared node arrays. Child indices
+    are made absolute and leaves point to themselves, so inference can walk
+    all trees with plain array indexing.
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in clf.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        node_ids = np.arange(n_nodes)
+        is_leaf = tree.children_left == -1
+
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(np.where(is_leaf, 0.0, tree.threshold).astype(np.float64))
+        lefts.append((np.where(is_leaf, node_ids, tree.children_left) + offset).astype(np.int32))
+        rights.append((np.where(is_leaf, node_ids, tree.children_right) + offset).astype(np.int32))
+
+        # Leaf class fractions, exactly as DecisionTreeClassifier.predict_proba returns them
+        value = tree.value[:, 0, :clf.n_classes_].astype(np.float64)
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        if not np.allclose(normalizer[is_leaf], 1.0):
+            # sklearn < 1.4 stores class counts and normalizes at predict time
+            normalizer[normalizer == 0.0] = 1.0
+            value = value / normalizer
+        values.append(value)
+
+        roots.append(offset)
+        offset += n_nodes
+        max_depth = max(max_depth, tree.max_depth)
+
+    np.savez(
+        path,
+        feature=np.concatenate(features),
+        threshold=np.concatenate(thresholds),
+        left=np.concatenate(lefts),
+        right=np.concatenate(rights),
+        value=np.concatenate(values),
+        roots=np.array(roots, dtype=np.int32),
+        classes=np.asarray(clf.classes_).astype(str),
+        n_features=clf.n_features_in_,
+        max_depth=max_depth
+    )
+
+# 4. Train Model
+class PhaseTimer:
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.phases.append((name, elapsed))
+        print(f"[{name}] {elapsed:.2f}s")
+
+    def report(self):
+        total = sum(elapsed for _, elapsed in self.phases)
+        print("-" * 30)
+        for name, elapsed in self.phases:
+            print(f"{name:<12} {elapsed:8.2f}s  {elapsed / total * 100:5.1f}%")
+        print(f"{'total':<12} {total:8.2f}s")
+
+def train(
+    num_samples=2000,
+    seed=42,
+    n_estimators=100,
+    n_jobs=-1,
+    test_size=0.2,
+    model_dir=None,
+    knowledge_base_path=None,
+    dataset_prefix=None,
+    packed=False,
+    chunk_size=100_000,
+    max_rows=None,
+    report=False
+):
+    timer = PhaseTimer()
+    knowledge_base = load_knowledge_base(knowledge_base_path)
+
+    with timer.phase("generate"):
+        if dataset_prefix:
+            write_dataset(dataset_prefix, num_samples, knowledge_base, seed, chunk_size, packed)
+            X, y, all_symptoms = load_dataset(dataset_prefix, max_rows)
+        else:
+            X, y, all_symptoms = generate_synthetic_data(num_samples, knowledge_base, seed, chunk_size)
+
+    # Split (rows are i.i.d., so the last rows are as good a test set as a shuffled one)
+    split = int(len(X) * (1 - test_size))
+    X_train, X_test, y_train, y_test = X[:split], X[split:], y[:split], y[split:]
+
     # Model
-    print("Training Random Forest Classifier...")
-    clf = RandomForestClassifier(n_estimators=100, random_state=42)
-    clf.fit(X_train, y_train)
-    
+    print(f"Training Random Forest Classifier on {len(X_train)} rows ({n_jobs} jobs)...")
+    with timer.phase("train"):
+        clf = RandomForestClassifier(n_estimators=n_estimators, random_state=seed, n_jobs=n_jobs)
+        clf.fit(X_train, y_train)
+
     # Evaluate
-    y_pred = clf.predict(X_test)
-    accuracy = accuracy_score(y_test, y_pred)
-    
+    with timer.phase("evaluate"):
+        y_pred = clf.predict(X_test)
+        accuracy = accuracy_score(y_test, y_pred)
+
     print("-" * 30)
     print(f"Model Accuracy: {accuracy * 100:.2f}%")
     print("-" * 30)
-    # print(classification_report(y_test, y_pred))
-    
-    # 4. Save Artifacts
-    model_dir = os.path.join(os.path.dirname(__file__), '../models')
+    if report:
+        print(classification_report(y_test, y_pred))
+
+    # 5. Save Artifacts
+    # Serve single-threaded; the fitted trees are the same for any n_jobs
+    clf.n_jobs = None
+    model_dir = model_dir or os.path.join(os.path.dirname(__file__), '../models')
     os.makedirs(model_dir, exist_ok=True)
     
     model_path = os.path.join(model_dir, 'disease_model.pkl')
     symptoms_path = os.path.join(model_dir, 'symptoms.json')
+    forest_path = os.path.join(model_dir, 'disease_forest.npz')
     
-    joblib.dump(clf, model_path)
-    with open(symptoms_path, 'w') as f:
-        json.dump(all_symptoms, f)
+    with timer.phase("save"):
+        joblib.dump(clf, model_path)
+        export_forest(clf, forest_path)
+        with open(symptoms_path, 'w') as f:
+            json.dump(all_symptoms, f)
         
     print(f"Model saved to: {model_path}")
     print(f"Symptoms saved to: {symptoms_path}")
+    print(f"Compiled forest saved to: {forest_path}")
+    timer.report()
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="Train the symptom -> disease RandomForest on synthetic data.")
+    parser.add_argument("--samples", type=int, default=2000, help="Number of synthetic patients")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--trees", type=int, default=100, help="n_estimators")
+    parser.add_argument("--jobs", type=int, default=-1, help="Training processes/threads (-1 = all cores)")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--model-dir", default=None, help="Where the model artifacts go (default: app/models)")
+    parser.add_argument("--knowledge-base", default=None, help="JSON file mapping disease -> list of symptoms")
+    parser.add_argument("--dataset", default=None, help="Stream the dataset to <prefix>_X.npy/_y.npy/_meta.json and train from the memory map")
+    parser.add_argument("--packed", action="store_true", help="Store dataset rows bit-packed (8 symptoms per byte)")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="Rows generated per block")
+    parser.add_argument("--max-rows", type=int, default=None, help="Train/evaluate on only the first rows of --dataset")
+    parser.add_argument("--report", action="store_true", help="Print the per-class classification report")
+    args = parser.parse_args()
+    train(
+        num_samples=args.samples,
+        seed=args.seed,
+        n_estimators=args.trees,
+        n_jobs=args.jobs,
+        test_size=args.test_size,
+        model_dir=args.model_dir,
+        knowledge_base_path=args.knowledge_base,
+        dataset_prefix=args.dataset,
+        packed=args.packed,
+        chunk_size=args.chunk_size,
+        max_rows=args.max_rows,
+        report=args.report
+    )
@@ -0,0 +1,200 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Allow running as `python app/ml/train_no_show.py` from the ai-service root
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
+
+from app.services.no_show_model import (
+    AGE_BANDS, APPOINTMENT_TYPES, GENDERS, MODEL_FORMAT, NUMERIC_FEATURES,
+    CategoricalLookup, age_band, numeric_features
+)
+
+COLUMNS = ('age', 'gender', 'appointment_type', 'lead_time_days', 'prior_appointments', 'prior_no_shows', 'no_show')
+
+# 1. Synthetic appointment history
+# Effects follow the no-show literature: long lead times, young adults and a
+# history of missed visits raise the risk; emergencies are almost always kept.
+TYPE_MIX = {
+    'checkup': (0.30, 14.0, 0.0), 'follow-up': (0.25, 10.0, -0.2), 'consultation': (0.20, 7.0, 0.1),
+    'emergency': (0.05, 0.0, -2.0), 'lab-test': (0.10, 3.0, 0.2), 'procedure': (0.05, 21.0, -0.6),
+    'vaccination': (0.05, 5.0, 0.3),
+}  # type -> (share, mean lead time in days, effect on the log-odds)
+AGE_EFFECT = (-0.1, 0.5, 0.3, 0.0, -0.3, -0.1)  # Per age band
+
+
+def generate_synthetic_data(num_samples=200_000, seed=42) -> dict:
+    """Columns as in COLUMNS (category strings as clients send them), one row per past appointment."""
+    rng = np.random.default_rng(seed)
+    types = np.array(list(TYPE_MIX))
+    shares, mean_leads, type_effects = (np.array(v) for v in zip(*TYPE_MIX.values()))
+
+    type_idx = rng.choice(len(types), num_samples, p=shares / shares.sum())
+    age = np.clip(rng.normal(45, 20, num_samples), 0, 95).round()
+    gender = rng.choice(np.array(['Male', 'Female', 'Other']), num_samples, p=[0.48, 0.5, 0.02])
+    lead = rng.exponential(np.maximum(mean_leads[type_idx], 0.01)).round()
+    prior = rng.poisson(1 + age / 15)
+    propensity = rng.beta(1.2, 8, num_samples)  # The patient's own no-show tendency
+    prior_no_shows = rng.binomial(prior, propensity)
+
+    logit = (
+        -2.6 + 0.35 * np.log1p(lead) + type_effects[type_idx] + np.array(AGE_EFFECT)[age_band(age)]
+        + 5.0 * (propensity - 0.13) + 0.1 * (gender == 'Male')
+    )
+    no_show = rng.random(num_samples) < 1 / (1 + np.exp(-logit))
+    return {
+        'age': age, 'gender': gender, 'appointment_type': types[type_idx], 'lead_time_days': lead,
+        'prior_appointments': prior, 'prior_no_shows': prior_no_shows, 'no_show': no_show.astype(np.float64)
+    }
+
+
+def load_csv(path: str) -> dict:
+    """Historical appointments with the COLUMNS header (no_show is 0/1)."""
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    data = {name: [row.get(name) for row in rows] for name in COLUMNS}
+    for name in ('age', 'lead_time_days', 'prior_appointments', 'prior_no_shows', 'no_show'):
+        data[name] = np.array([float(v) if v not in (None, '') else np.nan for v in data[name]])
+    return data
+
+
+# 2. Design matrix: standardized numeric features + one-hot categories
+def design_matrix(data: dict, mean=None, std=None):
+    numeric = numeric_features(data['lead_time_days'], data['prior_appointments'], data['prior_no_shows'])
+    if mean is None:
+        mean, std = numeric.mean(axis=0), numeric.std(axis=0)
+        std[std == 0] = 1.0
+    blocks = [(numeric - mean) / std, np.eye(len(AGE_BANDS) + 1)[age_band(data['age'])]]
+    for lookup, values in ((CategoricalLookup(GENDERS), data['gender']), (CategoricalLookup(APPOINTMENT_TYPES), data['appointment_type'])):
+        # The unknown category has no column: its weight stays 0
+        blocks.append(np.eye(lookup.unknown + 1)[lookup.encode(values)][:, :-1])
+    return np.hstack(blocks), mean, std
+
+
+# 3. L2-regularized logistic regression by Newton's method (IRLS)
+def fit_logistic(X: np.ndarray, y: np.ndarray, l2: float = 1.0, max_iter: int = 25, tol: float = 1e-8):
+    """Returns (bias, weights). The bias is not penalized."""
+    n, k = X.shape
+    Xb = np.hstack([np.ones((n, 1)), X])
+    theta = np.zeros(k + 1)
+    theta[0] = np.log(y.mean() / (1 - y.mean()))
+    penalty = np.full(k + 1, l2)
+    penalty[0] = 0.0
+    for i in range(max_iter):
+        p = 1 / (1 + np.exp(-(Xb @ theta)))
+        gradient = Xb.T @ (p - y) + penalty * theta
+        hessian = (Xb * (p * (1 - p))[:, None]).T @ Xb + np.diag(penalty)
+        step = np.linalg.solve(hessian, gradient)
+        theta -= step
+        if np.abs(step).max() < tol:
+            break
+    print(f"Converged after {i + 1} Newton steps")
+    return theta[0], theta[1:]
+
+
+def auc(y: np.ndarray, scores: np.ndarray) -> float:
+    """Rank-based ROC AUC (ties get average ranks)."""
+    order = np.argsort(scores, kind='mergesort')
+    ranks = np.empty(len(scores))
+    sorted_scores = scores[order]
+    _, first, counts = np.unique(sorted_scores, return_index=True, return_counts=True)
+    ranks[order] = np.repeat(first + (counts + 1) / 2.0, counts)
+    positives = y == 1
+    n_pos, n_neg = positives.sum(), (~positives).sum()
+    return float((ranks[positives].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg))
+
+
+def export(path: str, bias: float, weights: np.ndarray, mean: np.ndarray, std: np.ndarray, defaults: dict, metrics: dict):
+    """Folds the standardization into the numeric weights and writes the JSON read by NoShowModel."""
+    k = len(NUMERIC_FEATURES)
+    numeric = weights[:k] / std
+    bias = bias - float(numeric @ mean)
+    offsets = np.cumsum([k, len(AGE_BANDS) + 1, len(GENDERS)])
+    model = {
+        'format': MODEL_FORMAT,
+        'numeric_features': list(NUMERIC_FEATURES),
+        'age_bands': list(AGE_BANDS),
+        'genders': list(GENDERS),
+        'appointment_types': list(APPOINTMENT_TYPES),
+        'bias': bias,
+        'numeric_weights': numeric.tolist(),
+        'age_weights': weights[offsets[0]:offsets[1]].tolist(),
+        'gender_weights': weights[offsets[1]:offsets[2]].tolist(),
+        'appointment_type_weights': weights[offsets[2]:].tolist(),
+        'defaults': defaults,
+        'metrics': metrics,
+        'trained_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    with open(path, 'w') as f:
+        json.dump(model, f, indent=2)
+
+
+def train(num_samples=200_000, seed=42, data_path=None, test_size=0.2, l2=1.0, model_dir=None):
+    start = time.perf_counter()
+    data = load_csv(data_path) if data_path else generate_synthetic_data(num_samples, seed)
+    n = len(data['age'])
+    defaults = {
+        'lead_time_days': float(np.nanmedian(data['lead_time_days'])),
+        'prior_appointments': 0.0,
+        'prior_no_shows': 0.0,
+    }
+    for name in ('lead_time_days', 'prior_appointments', 'prior_no_shows'):
+        values = np.asarray(data[name], dtype=np.float64)
+        data[name] = np.where(np.isnan(values), defaults[name], values)
+    print(f"Loaded {n} appointments ({np.mean(data['no_show']):.1%} no-shows) in {time.perf_counter() - start:.2f}s")
+
+    # Rows are shuffled by a fixed permutation before the split
+    order = np.random.default_rng(seed).permutation(n)
+    split = int(n * (1 - test_size))
+    train_rows, test_rows = order[:split], order[split:]
+    take = lambda rows: {name: np.asarray(values)[rows] for name, values in data.items()}
+    train_data, test_data = take(train_rows), take(test_rows)
+
+    start = time.perf_counter()
+    X_train, mean, std = design_matrix(train_data)
+    bias, weights = fit_logistic(X_train, train_data['no_show'], l2=l2)
+    print(f"Trained on {len(train_rows)} rows, {X_train.shape[1]} features in {time.perf_counter() - start:.2f}s")
+
+    X_test, _, _ = design_matrix(test_data, mean, std)
+    y_test = test_data['no_show']
+    p = np.clip(1 / (1 + np.exp(-(bias + X_test @ weights))), 1e-12, 1 - 1e-12)
+    metrics = {
+        'rows': int(n),
+        'no_show_rate': float(np.mean(data['no_show'])),
+        'test_auc': auc(y_test, p),
+        'test_log_loss': float(-np.mean(y_test * np.log(p) + (1 - y_test) * np.log(1 - p))),
+        'test_brier': float(np.mean((p - y_test) ** 2)),
+    }
+    print("-" * 30)
+    print(f"Test AUC: {metrics['test_auc']:.3f}  log loss: {metrics['test_log_loss']:.4f}  Brier: {metrics['test_brier']:.4f}")
+    print("-" * 30)
+
+    model_dir = model_dir or os.path.join(os.path.dirname(__file__), '../models')
+    os.makedirs(model_dir, exist_ok=True)
+    model_path = os.path.join(model_dir, 'no_show_model.json')
+    export(model_path, bias, weights, mean, std, defaults, metrics)
+    print(f"Model saved to: {model_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the appointment no-show logistic regression.")
+    parser.add_argument("--samples", type=int, default=200_000, help="Synthetic appointments (without --data)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data", default=None, help=f"CSV of past appointments with columns {', '.join(COLUMNS)}")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--l2", type=float, default=1.0, help="L2 penalty on the weights")
+    parser.add_argument("--model-dir", default=None, help="Where the model goes (default: app/models)")
+    args = parser.parse_args()
+    train(
+        num_samples=args.samples,
+        seed=args.seed,
+        data_path=args.data,
+        test_size=args.test_size,
+        l2=args.l2,
+        model_dir=args.model_dir
+    )
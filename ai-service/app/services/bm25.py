@@ -0,0 +1,148 @@
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.vector_search import top_k_indices
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# dense: embeddings only; hybrid: dense + BM25 fused by rank; lexical: BM25 only
+# (no embedding calls); auto: BM25 when its hits cover the query keywords, else hybrid
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical", "auto")
+RRF_K = 60
+
+# Small English stop list; medical terms and units are kept
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers him his how i
+if in into is it its just me more most my no nor not now of off on once only or other our out over own same she should
+so some such than that the their them then there these they this those through to too under until up very was we were
+what when where which while who whom why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased alphanumeric terms without stopwords; a trailing plural 's' is dropped."""
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+
+class BM25Index:
+    """
+    In-process Okapi BM25 inverted index.
+
+    Documents are appended with `add()` (rows are numbered in insertion order),
+    so the index can grow as documents are processed. Postings are kept as
+    Python lists while appending and frozen into NumPy arrays on the first
+    search after a change, so a query costs one vectorized scatter-add per
+    query term over that term's postings only.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Tuple[list, list]] = {}  # term -> (rows, term frequencies)
+        self._lengths: List[int] = []
+        self._frozen: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._length_array = np.zeros(0, dtype=np.float32)
+        self._dirty = False
+
+    @property
+    def size(self) -> int:
+        return len(self._lengths)
+
+    def add(self, texts: Sequence[str]) -> List[int]:
+        """Indexes texts and returns their row ids."""
+        tokenized = [Counter(tokenize(text)) for text in texts]
+        with self._lock:
+            first = len(self._lengths)
+            for offset, counts in enumerate(tokenized):
+                row = first + offset
+                for term, tf in counts.items():
+                    rows, tfs = self._postings.setdefault(term, ([], []))
+                    rows.append(row)
+                    tfs.append(tf)
+                self._lengths.append(sum(counts.values()))
+            self._dirty = True
+        return list(range(first, first + len(tokenized)))
+
+    def _freeze(self):
+        # Call with the lock held
+        if not self._dirty:
+            return
+        self._frozen = {
+            term: (np.asarray(rows, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+            for term, (rows, tfs) in self._postings.items()
+        }
+        self._length_array = np.asarray(self._lengths, dtype=np.float32)
+        self._dirty = False
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row (0 for rows sharing no term with the query)."""
+        terms = set(tokenize(query))
+        with self._lock:
+            self._freeze()
+            frozen, lengths = self._frozen, self._length_array
+        scores = np.zeros(lengths.shape[0], dtype=np.float32)
+        if not terms or lengths.shape[0] == 0:
+            return scores
+        n = lengths.shape[0]
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(float(lengths.mean()), 1.0))
+        for term in terms:
+            posting = frozen.get(term)
+            if posting is None:
+                continue
+            rows, tfs = posting
+            idf = np.log(1 + (n - rows.shape[0] + 0.5) / (rows.shape[0] + 0.5))
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm[rows])
+        return scores
+
+    def search(self, query: str, k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (row ids, scores) of the k best rows with a positive score, best first."""
+        scores = self.scores(query)
+        best = top_k_indices(scores, k)
+        best = best[scores[best] > 0]
+        return best, scores[best]
+
+    def keywords_suffice(self, query: str, rows: np.ndarray, min_known: float = 0.5) -> bool:
+        """
+        True when a lexical result is good enough to skip the dense embedding:
+        at least `min_known` of the query's terms occur in the corpus and every
+        returned row contains all of them. Paraphrases with vocabulary the
+        corpus lacks ("sugar" for "glucose") fail the first test.
+        """
+        terms = set(tokenize(query))
+        if not terms or rows.shape[0] == 0:
+            return False
+        with self._lock:
+            self._freeze()
+            frozen = self._frozen
+        known = [term for term in terms if term in frozen]
+        if len(known) < min_known * len(terms):
+            return False
+        return all(np.any(frozen[term][0] == row) for term in known for row in rows)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], weights: Optional[Sequence[float]] = None, k: int = RRF_K) -> List[Tuple[int, float]]:
+    """
+    Fuses ranked id lists with weighted Reciprocal Rank Fusion
+    (score = sum of weight / (k + rank)); returns (id, score) best first.
+    Rank-based, so BM25 and cosine scores need no calibration against each
+    other.
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = Counter()
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking):
+            fused[int(item)] += weight / (k + rank + 1)
+    return fused.most_common()
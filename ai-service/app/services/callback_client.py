@@ -0,0 +1,251 @@
+import logging
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class BackendCallbackClient:
+    """
+    Delivers document status updates to the Node backend.
+
+    All requests share one keep-alive session with a bounded connection pool
+    and explicit timeouts. Transient failures (connection errors, timeouts,
+    5xx) are retried with jittered exponential backoff; updates that still
+    cannot be delivered are written to a SQLite outbox and replayed in the
+    background, newest update per document winning.
+
+    With `batch_size > 1` every update goes through the outbox and is sent to
+    the backend's batch route, up to `batch_size` updates per request.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        outbox_path: str,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 30.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 300.0,
+        replay_interval: float = 15.0,
+        batch_size: int = 0,
+        batch_max_bytes: int = 5_000_000,
+        batch_linger: float = 0.5,
+        pool_size: int = 10,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.replay_interval = replay_interval
+        self.batch_size = batch_size
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_linger = batch_linger
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._has_work = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(outbox_path)), exist_ok=True)
+        self._conn = sqlite3.connect(outbox_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                document_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+
+    @property
+    def batch_mode(self) -> bool:
+        return self.batch_size > 1
+
+    # --- Lifecycle ---
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._replay_loop, name="callback-outbox", daemon=True)
+        self._thread.start()
+        pending = self.pending()
+        if pending:
+            logger.warning(f"Callback outbox has {pending} undelivered status updates, replaying")
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        self._has_work.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.session.close()
+
+    # --- Sending ---
+
+    def send_status(self, document_id: str, payload: dict) -> bool:
+        """
+        Sends one status update. Returns True once the backend has accepted it,
+        False if it was queued in the outbox for later delivery instead.
+        """
+        if self.batch_mode:
+            self._enqueue(document_id, payload)
+            self._has_work.set()
+            return False
+
+        started = time.time()
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self._backoff(attempt))
+            try:
+                delivered = self._patch_one(document_id, payload)
+                # Accepted or rejected (4xx, retrying won't help): either way an older
+                # queued update must not be replayed over this one later
+                self._superseded(document_id, started)
+                return delivered
+            except (requests.ConnectionError, requests.Timeout, _ServerError) as e:
+                logger.warning(f"Callback for {document_id} failed (attempt {attempt + 1}/{self.max_retries + 1}): {e}")
+
+        self._enqueue(document_id, payload)
+        logger.warning(f"Callback for {document_id} queued in outbox")
+        return False
+
+    def _patch_one(self, document_id: str, payload: dict) -> bool:
+        response = self.session.patch(
+            f"{self.base_url}/patient-documents/{document_id}/status",
+            json=payload,
+            timeout=self.timeout
+        )
+        if response.status_code >= 500:
+            raise _ServerError(f"{response.status_code} from backend")
+        if response.status_code >= 400:
+            logger.warning(f"Callback for {document_id} rejected with {response.status_code}, dropping: {response.text[:200]}")
+            return False
+        return True
+
+    def _patch_batch(self, updates: List[Tuple[str, dict]]):
+        response = self.session.patch(
+            f"{self.base_url}/patient-documents/status/batch",
+            json={"updates": [{"id": document_id, **payload} for document_id, payload in updates]},
+            timeout=self.timeout
+        )
+        if response.status_code >= 500:
+            raise _ServerError(f"{response.status_code} from backend")
+        if response.status_code >= 400:
+            logger.warning(f"Batch callback rejected with {response.status_code}, dropping {len(updates)} updates: {response.text[:200]}")
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, delay)  # Full jitter
+
+    # --- Outbox ---
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _enqueue(self, document_id: str, payload: dict):
+        now = time.time()
+        with self._lock:
+            # A newer update for the same document replaces the undelivered one
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outbox (document_id, payload, attempts, next_attempt_at, created_at) VALUES (?, ?, 0, ?, ?)",
+                (document_id, json.dumps(payload), now, now),
+            )
+
+    def _superseded(self, document_id: str, before: float):
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE document_id = ? AND created_at <= ?", (document_id, before))
+
+    def _due(self, limit: int) -> List[Tuple[str, str, int]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT document_id, payload, attempts FROM outbox WHERE next_attempt_at <= ? ORDER BY created_at LIMIT ?",
+                (time.time(), limit),
+            ).fetchall()
+
+    def _delivered(self, rows):
+        with self._lock:
+            # Only delete rows that were not replaced by a newer update meanwhile
+            self._conn.executemany(
+                "DELETE FROM outbox WHERE document_id = ? AND payload = ?",
+                [(document_id, payload) for document_id, payload, _ in rows],
+            )
+
+    def _deferred(self, rows):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET attempts = ?, next_attempt_at = ? WHERE document_id = ? AND payload = ?",
+                [(attempts + 1, now + self._backoff(attempts + 1), document_id, payload) for document_id, payload, attempts in rows],
+            )
+
+    def _flush(self) -> int:
+        """Sends due outbox rows; returns how many were taken off the outbox."""
+        rows = self._due(max(self.batch_size, 1) if self.batch_mode else 100)
+        if not rows:
+            return 0
+
+        if self.batch_mode:
+            batch, size = [], 0
+            for row in rows:
+                size += len(row[1])
+                if batch and size > self.batch_max_bytes:
+                    break
+                batch.append(row)
+            try:
+                self._patch_batch([(document_id, json.loads(payload)) for document_id, payload, _ in batch])
+                self._delivered(batch)
+                return len(batch)
+            except (requests.ConnectionError, requests.Timeout, _ServerError) as e:
+                logger.warning(f"Batch callback of {len(batch)} updates failed, will retry: {e}")
+                self._deferred(batch)
+                return 0
+
+        sent = 0
+        for row in rows:
+            document_id, payload, _ = row
+            try:
+                self._patch_one(document_id, json.loads(payload))
+                self._delivered([row])
+                sent += 1
+            except (requests.ConnectionError, requests.Timeout, _ServerError) as e:
+                logger.warning(f"Outbox replay for {document_id} failed, will retry: {e}")
+                self._deferred([row])
+        return sent
+
+    def _replay_loop(self):
+        while not self._stopping.is_set():
+            self._has_work.wait(self.replay_interval)
+            self._has_work.clear()
+            if self._stopping.is_set():
+                break
+            if self.batch_mode:
+                # Give concurrent updates a moment to join the batch
+                time.sleep(self.batch_linger)
+            try:
+                if self._flush():
+                    self._has_work.set()  # More may be due, go again right away
+            except Exception as e:
+                logger.warning(f"Callback outbox flush failed: {e}")
+
+
+class _ServerError(Exception):
+    """5xx response from the backend (retryable)."""
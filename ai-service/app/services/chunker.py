@@ -0,0 +1,288 @@
+import re
+import math
+import hashlib
+from collections import Counter
+from typing import List, Set
+
+# Page break written between pages by PDFTextExtractor
+PAGE_BREAK = "\f"
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"(\[])')
+_WORD = re.compile(r"\w+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+# Page numbers ("Page 3 of 10", "3 / 10", "- 3 -"): the only digits ignored when matching headers
+_PAGE_NUMBER = re.compile(r"\bpage\s*\d+(\s*(of|/)\s*\d+)?\b|^[\s\-–]*\d+(\s*(of|/)\s*\d+)?[\s\-–]*$")
+
+
+class ChunkResult:
+    """Chunks of one document plus counters on what was saved."""
+
+    def __init__(self, chunks: List[str], stats: dict):
+        self.chunks = chunks
+        self.stats = stats
+
+
+def fixed_window_count(text_len: int, chunk_size: int = 1000, overlap: int = 200) -> int:
+    """Number of chunks the old fixed 1000/200 sliding window produces."""
+    if text_len <= 0:
+        return 0
+    step = chunk_size - overlap
+    return (text_len + step - 1) // step
+
+
+class FixedWindowChunker:
+    """The original fixed-size sliding window (kept for comparison)."""
+
+    version = "w1"
+
+    def __init__(self, chunk_size: int = 1000, overlap: int = 200):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    def chunk(self, text: str) -> ChunkResult:
+        chunks = []
+        start = 0
+        while start < len(text):
+            chunks.append(text[start:start + self.chunk_size])
+            start += self.chunk_size - self.overlap
+        return ChunkResult(chunks, {"chunks": len(chunks), "baseline_chunks": len(chunks), "embeddings_avoided": 0})
+
+
+class StructuredChunker:
+    """
+    Packs whole sentences, lines and paragraphs into chunks of at most
+    `max_chars`, without overlap:
+
+    1. The text is split into pages at form feeds (the extractor's page break).
+       Header and footer lines repeated on at least half of the pages
+       ("Page 3 of 10", hospital name, disclaimers) and on at least three
+       pages are kept once. Lines
+       must match exactly except for page numbers, so lab rows and dates
+       that differ in their values are never merged.
+    2. Wrapped lines are re-joined into sentences; short table-like rows
+       (lab values) stay one unit each, so they are never cut in half.
+    3. Whole paragraphs are packed together while they fit. A paragraph that
+       does not fit ends the chunk if it is at least half full, and is then
+       packed unit by unit. Page breaks count as paragraph breaks, so no unit
+       spans two pages.
+    4. Chunks whose word shingles overlap an earlier chunk by at least
+       `near_duplicate_threshold` (Jaccard) and whose numbers are identical
+       are dropped; lab panels of two visits differing in one value are not
+       near duplicates.
+
+    `stats` compares the result with the old fixed 1000/200 window.
+    """
+
+    version = "s3"  # s1/s2 dropped rows and panels that differed only in their values
+
+    def __init__(self, max_chars: int = 1000, near_duplicate_threshold: float = 0.9, shingle_words: int = 5, edge_lines: int = 3):
+        self.max_chars = max_chars
+        self.edge_lines = edge_lines
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.shingle_words = shingle_words
+
+    # --- Public API ---
+
+    def chunk(self, text: str) -> ChunkResult:
+        pages = [page for page in text.split(PAGE_BREAK) if page.strip()]
+        pages, boilerplate_lines = self._strip_boilerplate(pages)
+
+        packed = []
+        current = ""
+        for page in pages:
+            # A page break is a paragraph break: units never span two pages
+            for paragraph in self._paragraphs(page):
+                current = self._add_paragraph(packed, current, paragraph)
+        if current.strip():
+            packed.append(current)
+
+        chunks, duplicates = self._drop_near_duplicates(packed)
+        baseline = fixed_window_count(len(text))
+        stats = {
+            "pages": len(pages),
+            "chunks": len(chunks),
+            "baseline_chunks": baseline,
+            "embeddings_avoided": max(baseline - len(chunks), 0),
+            "boilerplate_lines_removed": boilerplate_lines,
+            "duplicate_chunks_dropped": duplicates,
+        }
+        return ChunkResult(chunks, stats)
+
+    # --- Structure ---
+
+    @staticmethod
+    def _line_key(line: str) -> str:
+        return _PAGE_NUMBER.sub("#", re.sub(r"\s+", " ", line.strip().lower()))
+
+    def _strip_boilerplate(self, pages: List[str]):
+        """
+        Header/footer lines (up to `edge_lines` lines at the top and bottom of
+        a page, and at most a third of its lines on each side, so a short
+        page's body is not treated as its header) that repeat on at least
+        half of the pages, and on three or more, are kept only where they
+        first appear; a row repeated on both pages of a two-page report is
+        content, not a header. A line that
+        also occurs in the body of any page is not boilerplate, and body
+        lines are never touched.
+        """
+        if len(pages) < 3:
+            return pages, 0
+        page_lines = [page.split("\n") for page in pages]
+
+        def edge_indices(lines):
+            filled = [i for i, line in enumerate(lines) if line.strip()]
+            n = min(self.edge_lines, len(filled) // 3)
+            return set(filled[:n] + filled[len(filled) - n:])
+
+        edges = [edge_indices(lines) for lines in page_lines]
+        seen_on = Counter()
+        body_keys: Set[str] = set()
+        for lines, indices in zip(page_lines, edges):
+            seen_on.update({self._line_key(lines[i]) for i in indices})
+            body_keys.update(self._line_key(line) for i, line in enumerate(lines) if i not in indices and line.strip())
+        threshold = max(3, (len(pages) + 1) // 2)
+        repeated = {key for key, count in seen_on.items() if count >= threshold and key not in body_keys}
+        if not repeated:
+            return pages, 0
+
+        kept_once: Set[str] = set()
+        removed = 0
+        cleaned = []
+        for lines, indices in zip(page_lines, edges):
+            out = []
+            for i, line in enumerate(lines):
+                key = self._line_key(line) if i in indices else None
+                if key in repeated:
+                    if key in kept_once:
+                        removed += 1
+                        continue
+                    kept_once.add(key)
+                out.append(line)
+            cleaned.append("\n".join(out))
+        return cleaned, removed
+
+    def _paragraphs(self, page: str) -> List[List[str]]:
+        """Paragraphs of a page, each a list of units (sentences or table rows)."""
+        paragraphs = []
+        for block in re.split(r"\n\s*\n", page):
+            lines = [line.strip() for line in block.split("\n") if line.strip()]
+            if not lines:
+                continue
+            units = []
+            for line in self._join_wrapped(lines):
+                units.extend(sentence for sentence in _SENTENCE_END.split(line) if sentence)
+            paragraphs.append(units)
+        return paragraphs
+
+    @staticmethod
+    def _join_wrapped(lines: List[str]) -> List[str]:
+        """Re-joins prose that the PDF wrapped mid-sentence; table rows stay separate."""
+        joined = [lines[0]]
+        for line in lines[1:]:
+            previous = joined[-1]
+            wrapped = (
+                not previous.endswith((".", "!", "?", ":", ";"))
+                and line[:1].islower()
+            )
+            if wrapped:
+                joined[-1] = f"{previous} {line}"
+            else:
+                joined.append(line)
+        return joined
+
+    # --- Packing ---
+
+    def _add_paragraph(self, packed: List[str], current: str, units: List[str]) -> str:
+        paragraph = " ".join(units) if all(u.endswith((".", "!", "?")) for u in units) else "\n".join(units)
+        separator = "\n\n" if current else ""
+        if len(current) + len(separator) + len(paragraph) <= self.max_chars:
+            return current + separator + paragraph
+
+        # Does not fit: end a mostly full chunk at this paragraph break, then
+        # pack the paragraph unit by unit
+        if len(current) >= self.max_chars // 2:
+            packed.append(current)
+            current = ""
+        for i, unit in enumerate(units):
+            for piece in self._split_long(unit):
+                separator = ("\n\n" if i == 0 else "\n") if current else ""
+                if len(current) + len(separator) + len(piece) > self.max_chars:
+                    packed.append(current)
+                    current = piece
+                else:
+                    current = current + separator + piece
+        return current
+
+    def _split_long(self, unit: str) -> List[str]:
+        """A single unit longer than max_chars is cut at word boundaries."""
+        if len(unit) <= self.max_chars:
+            return [unit]
+        pieces, current = [], ""
+        for word in unit.split(" "):
+            while len(word) > self.max_chars:
+                if current:
+                    pieces.append(current)
+                    current = ""
+                pieces.append(word[:self.max_chars])
+                word = word[self.max_chars:]
+            if current and len(current) + 1 + len(word) > self.max_chars:
+                pieces.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        if current:
+            pieces.append(current)
+        return pieces
+
+    # --- Deduplication ---
+
+    def _shingles(self, chunk: str) -> Set[int]:
+        words = _WORD.findall(chunk.lower())
+        n = self.shingle_words
+        if len(words) < n:
+            return {hash(" ".join(words))}
+        return {hash(" ".join(words[i:i + n])) for i in range(len(words) - n + 1)}
+
+    def _drop_near_duplicates(self, chunks: List[str]):
+        """
+        Exact duplicates by hash; near duplicates by shingle Jaccard, among
+        chunks with exactly the same numbers (values, dates, doses). Candidate
+        pairs come from prefix filtering: sets with Jaccard >= t must share one
+        of their first len - ceil(t * len) + 1 shingles in a fixed order, so
+        only those prefixes are indexed instead of comparing every pair.
+        """
+        threshold = self.near_duplicate_threshold
+        kept, kept_shingles, kept_numbers, exact = [], [], [], set()
+        prefix_index = {}  # shingle -> indices of kept chunks with it in their prefix
+        dropped = 0
+        for chunk in chunks:
+            digest = hashlib.sha1(re.sub(r"\s+", " ", chunk.strip().lower()).encode("utf-8")).digest()
+            if digest in exact:
+                dropped += 1
+                continue
+            shingles = self._shingles(chunk)
+            numbers = _NUMBER.findall(chunk)
+            ordered = sorted(shingles)
+            prefix = ordered[:len(ordered) - math.ceil(threshold * len(ordered)) + 1]
+            candidates = {index for shingle in prefix for index in prefix_index.get(shingle, ())}
+            duplicate = False
+            for index in candidates:
+                other = kept_shingles[index]
+                if kept_numbers[index] != numbers:
+                    continue
+                if min(len(other), len(shingles)) < threshold * max(len(other), len(shingles)):
+                    continue
+                overlap = len(shingles & other)
+                if overlap / (len(shingles) + len(other) - overlap) >= threshold:
+                    duplicate = True
+                    break
+            if duplicate:
+                dropped += 1
+                continue
+            exact.add(digest)
+            for shingle in prefix:
+                prefix_index.setdefault(shingle, []).append(len(kept))
+            kept.append(chunk)
+            kept_shingles.append(shingles)
+            kept_numbers.append(numbers)
+        return kept, dropped
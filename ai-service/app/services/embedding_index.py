@@ -0,0 +1,250 @@
+import logging
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.services.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+REFS_DIR = 'refs'
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalizes every row so cosine similarity becomes a plain dot product."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+class DocumentEmbeddingIndex:
+    """
+    On-disk store of chunk embeddings, one entry per (document id, content hash).
+
+    Each entry is a pre-normalized float32 matrix (`<doc>_<hash>.npy`) next to its
+    chunk texts (`<doc>_<hash>.json`). Matrices are memory-mapped on first use and
+    kept in an LRU of `max_loaded` entries; the directory itself holds at most
+    `max_documents` entries, least recently used first out.
+
+    Documents with identical text share one entry. `refs/<doc>` records the
+    entry each document uses; an entry is deleted once the last document
+    referencing it is replaced (new text) or removed (`remove_document`).
+    """
+
+    def __init__(self, index_dir: str, max_loaded: int = 64, max_documents: int = 5000):
+        self.index_dir = index_dir
+        self.max_loaded = max_loaded
+        self.max_documents = max_documents
+
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()  # hash -> (chunks, matrix)
+        self._entries = {}            # hash -> base path (without extension)
+        self._refs = {}               # doc key -> hash, as last written by this process
+
+        self._refs_dir = os.path.join(self.index_dir, REFS_DIR)
+        self._refs_lock = os.path.join(self.index_dir, 'refs.lock')
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._scan()
+        self._migrate_refs()
+
+    def _scan(self):
+        for name in os.listdir(self.index_dir):
+            if not name.endswith('.npy'):
+                continue
+            stem = name[:-4]
+            if '_' not in stem:
+                continue
+            text_hash = stem.rsplit('_', 1)[1]
+            self._entries[text_hash] = os.path.join(self.index_dir, stem)
+
+    def _migrate_refs(self):
+        """Indexes written before refs existed: each entry is referenced by the document in its name."""
+        if os.path.isdir(self._refs_dir):
+            return
+        with file_lock(self._refs_lock):
+            if os.path.isdir(self._refs_dir):
+                return
+            tmp_dir = f"{self._refs_dir}.{os.getpid()}.tmp"
+            os.makedirs(tmp_dir, exist_ok=True)
+            newest = {}
+            for text_hash, base in self._entries.items():
+                doc_key = os.path.basename(base).rsplit('_', 1)[0]
+                mtime = os.path.getmtime(base + '.npy') if os.path.exists(base + '.npy') else 0.0
+                if doc_key != 'adhoc' and mtime >= newest.get(doc_key, (-1.0, None))[0]:
+                    newest[doc_key] = (mtime, text_hash)
+            for doc_key, (_, text_hash) in newest.items():
+                with open(os.path.join(tmp_dir, doc_key), 'w') as f:
+                    f.write(text_hash)
+            os.rename(tmp_dir, self._refs_dir)
+
+    @staticmethod
+    def _safe_id(document_id: str) -> str:
+        return re.sub(r'[^A-Za-z0-9.-]', '-', document_id)
+
+    def __contains__(self, text_hash: str) -> bool:
+        with self._lock:
+            return text_hash in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, text_hash: str) -> Optional[Tuple[List[str], np.ndarray]]:
+        """Returns (chunks, normalized embedding matrix) or None if not indexed."""
+        with self._lock:
+            entry = self._loaded.get(text_hash)
+            if entry is not None:
+                self._loaded.move_to_end(text_hash)
+                return entry
+            base = self._entries.get(text_hash)
+
+        if base is None:
+            return None
+
+        try:
+            matrix = np.load(base + '.npy', mmap_mode='r')
+            with open(base + '.json', 'r') as f:
+                chunks = json.load(f)
+            os.utime(base + '.npy')  # Disk LRU is ordered by mtime
+        except (OSError, ValueError) as e:
+            logger.warning(f"Embedding index entry {base} unreadable, dropping: {e}")
+            self._remove(text_hash)
+            return None
+
+        entry = (chunks, matrix)
+        with self._lock:
+            self._loaded[text_hash] = entry
+            self._loaded.move_to_end(text_hash)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+        return entry
+
+    def put(self, document_id: Optional[str], text_hash: str, chunks: List[str], embeddings) -> Tuple[List[str], np.ndarray]:
+        """
+        Stores the chunk embeddings of a document. A new content hash for a known
+        document id replaces the previous entry of that document.
+        """
+        matrix = normalize_rows(embeddings)
+        if matrix.shape[0] != len(chunks):
+            raise ValueError(f"Got {matrix.shape[0]} embeddings for {len(chunks)} chunks")
+
+        doc_key = self._safe_id(document_id or 'adhoc')
+        base = os.path.join(self.index_dir, f"{doc_key}_{text_hash}")
+
+        # Write-then-rename so concurrent readers never see a partial file
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(base + '.npy' + tmp_suffix, 'wb') as f:
+            np.save(f, matrix)
+        with open(base + '.json' + tmp_suffix, 'w') as f:
+            json.dump(chunks, f)
+        os.replace(base + '.json' + tmp_suffix, base + '.json')
+        os.replace(base + '.npy' + tmp_suffix, base + '.npy')
+
+        with self._lock:
+            self._entries[text_hash] = base
+            self._loaded[text_hash] = (chunks, matrix)
+            self._loaded.move_to_end(text_hash)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+
+        self.reference(document_id, text_hash)
+        self._evict_disk()
+        return chunks, matrix
+
+    # --- Document references ---
+
+    def reference(self, document_id: Optional[str], text_hash: str):
+        """
+        Records that `document_id` now uses the entry `text_hash`. Its previous
+        entry (older text) is deleted unless another document still uses it.
+        """
+        if not document_id:
+            return
+        doc_key = self._safe_id(document_id)
+        with self._lock:
+            if self._refs.get(doc_key) == text_hash:
+                return
+        with file_lock(self._refs_lock):
+            previous = self._read_ref(doc_key)
+            if previous != text_hash:
+                os.makedirs(self._refs_dir, exist_ok=True)
+                tmp_path = os.path.join(self._refs_dir, f".{doc_key}.{os.getpid()}.{threading.get_ident()}.tmp")
+                with open(tmp_path, 'w') as f:
+                    f.write(text_hash)
+                os.replace(tmp_path, os.path.join(self._refs_dir, doc_key))
+                if previous:
+                    self._release(previous)
+        with self._lock:
+            self._refs[doc_key] = text_hash
+
+    def remove_document(self, document_id: str) -> bool:
+        """Drops a deleted document's reference; its entry goes once no other document uses it."""
+        doc_key = self._safe_id(document_id)
+        with self._lock:
+            self._refs.pop(doc_key, None)
+        with file_lock(self._refs_lock):
+            previous = self._read_ref(doc_key)
+            if previous is None:
+                return False
+            os.remove(os.path.join(self._refs_dir, doc_key))
+            self._release(previous)
+        return True
+
+    def _read_ref(self, doc_key: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self._refs_dir, doc_key), 'r') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _release(self, text_hash: str):
+        """Deletes the entry if no document references it (call under the refs lock)."""
+        try:
+            names = [name for name in os.listdir(self._refs_dir) if not name.startswith('.')]
+        except FileNotFoundError:
+            names = []
+        if any(self._read_ref(name) == text_hash for name in names):
+            return
+        self._remove(text_hash)
+
+    def _remove(self, text_hash: str):
+        with self._lock:
+            base = self._entries.pop(text_hash, None)
+            self._loaded.pop(text_hash, None)
+        if base is None:
+            # Possibly written by another worker process after our scan
+            suffix = f"_{text_hash}.npy"
+            base = next((os.path.join(self.index_dir, name[:-4]) for name in os.listdir(self.index_dir) if name.endswith(suffix)), None)
+        if base is None:
+            return
+        for ext in ('.npy', '.json'):
+            try:
+                os.remove(base + ext)
+            except FileNotFoundError:
+                pass
+
+    def _evict_disk(self):
+        with self._lock:
+            overflow = len(self._entries) - self.max_documents
+            if overflow <= 0:
+                return
+            by_age = []
+            for text_hash, base in self._entries.items():
+                try:
+                    by_age.append((os.path.getmtime(base + '.npy'), text_hash))
+                except OSError:
+                    by_age.append((0.0, text_hash))
+        by_age.sort()
+        for _, text_hash in by_age[:overflow]:
+            self._remove(text_hash)
@@ -0,0 +1,43 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class ServiceExecutor:
+    """
+    Runs blocking service calls (Gemini, pypdf, sklearn) off the event loop.
+
+    All work shares one bounded thread pool. Each service additionally has its own
+    concurrency limit, so a backlog of slow calls to one dependency (e.g. Gemini
+    generations) queues up on its semaphore instead of occupying every thread
+    and delaying the other endpoints.
+    """
+
+    def __init__(self, max_workers: int, limits: Dict[str, int], default_limit: int = 4):
+        self.max_workers = max_workers
+        self.limits = dict(limits)
+        self.default_limit = default_limit
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-service")
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore(self, service: str) -> asyncio.Semaphore:
+        # Created on first use so they belong to the running event loop
+        sem = self._semaphores.get(service)
+        if sem is None:
+            sem = asyncio.Semaphore(self.limits.get(service, self.default_limit))
+            self._semaphores[service] = sem
+        return sem
+
+    async def run(self, service: str, func: Callable, *args, **kwargs) -> Any:
+        """Awaits `func(*args, **kwargs)` on the pool, within the service's limit."""
+        async with self._semaphore(service):
+            loop = asyncio.get_running_loop()
+            # Copy the context so contextvars set by the request are visible in the worker
+            ctx = contextvars.copy_context()
+            call = functools.partial(ctx.run, func, *args, **kwargs)
+            return await loop.run_in_executor(self._pool, call)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+from app.services.shared_arrays import shared_arrays, source_key
+
+
+class CompiledForest:
+    """
+    Dependency-free inference for a RandomForestClassifier exported by
+    `app/ml/train_model.py` (see `export_forest`).
+
+    All trees live in flat node arrays (leaves point to themselves). Every
+    (sample, tree) pair descends one level per vectorized step, and pairs that
+    reached a leaf drop out of the active set.
+    Probabilities are accumulated tree by tree in the same order and precision
+    as sklearn's `predict_proba`, which makes the results bit-identical.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, classes, n_features: int, max_depth: int, is_leaf=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.n_features = int(n_features)
+        self.max_depth = int(max_depth)
+        self.is_leaf = is_leaf if is_leaf is not None else self.left == np.arange(len(self.left))
+
+    @classmethod
+    def load(cls, path: str, shared_dir: Optional[str] = None) -> "CompiledForest":
+        """
+        Loads the exported .npz. With `shared_dir` the arrays are unpacked
+        there once (per export) and memory-mapped read-only, so every worker
+        process serves from the same physical pages.
+        """
+        if shared_dir:
+            def unpack():
+                with np.load(path, allow_pickle=False) as data:
+                    arrays = {name: data[name] for name in data.files}
+                arrays['is_leaf'] = arrays['left'] == np.arange(len(arrays['left']))
+                return arrays
+            directory = os.path.join(shared_dir, f"forest-{source_key(path)}")
+            return cls(**shared_arrays(directory, unpack, prune_prefix="forest-"))
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    @property
+    def n_estimators(self) -> int:
+        return len(self.roots)
+
+    def apply(self, X) -> np.ndarray:
+        """Leaf node index for every (sample, tree) pair."""
+        X = np.asarray(X, dtype=np.float32)  # sklearn trees also compare float32 inputs
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected input of shape (n, {self.n_features}), got {X.shape}")
+
+        n_samples, n_trees = X.shape[0], len(self.roots)
+        nodes = np.tile(self.roots, n_samples)
+        flat_X = X.ravel()
+        row_offsets = np.repeat(np.arange(n_samples) * self.n_features, n_trees)
+
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while active.size:
+            current = nodes[active]
+            go_left = flat_X[row_offsets[active] + self.feature[current]] <= self.threshold[current]
+            current = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = current
+            active = active[~self.is_leaf[current]]
+        return nodes.reshape(n_samples, n_trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 2 and X.shape[0] > 1:
+            # Symptom batches repeat heavily; walk each distinct row only once
+            # (rows compared as raw bytes, much faster than np.unique(axis=0))
+            row_keys = X.view(np.dtype((np.void, X.itemsize * X.shape[1]))).ravel()
+            _, first, inverse = np.unique(row_keys, return_index=True, return_inverse=True)
+            if len(first) < X.shape[0]:
+                return self._predict_proba(X[first])[inverse.reshape(-1)]
+        return self._predict_proba(X)
+
+    def _predict_proba(self, X) -> np.ndarray:
+        leaves = self.apply(X)
+        proba = np.zeros((leaves.shape[0], len(self.classes_)), dtype=np.float64)
+        # Same summation order as sklearn: tree by tree, then divide by the count
+        for t in range(leaves.shape[1]):
+            proba += self.value[leaves[:, t]]
+        proba /= self.n_estimators
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
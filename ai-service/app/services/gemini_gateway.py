@@ -0,0 +1,396 @@
+import heapq
+import logging
+import random
+import threading
+import time
+import contextvars
+from contextlib import contextmanager
+from itertools import count
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+from app.services.metrics import (
+    GEMINI_QUEUE_SECONDS, GEMINI_RETRIES, GEMINI_THROTTLED, gemini_call
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Priority lanes, lower is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = ('interactive', 'background')
+
+# Priority of the Gemini calls made by the current request or job
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("gemini_priority", default=INTERACTIVE)
+
+# Errors worth retrying: quota (429) and transient server-side failures
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Errors that mean the API is overloaded: the concurrency limit backs off
+OVERLOAD_STATUS = {429, 503}
+_STATUS_BY_NAME = {
+    'ResourceExhausted': 429, 'TooManyRequests': 429, 'InternalServerError': 500, 'BadGateway': 502,
+    'ServiceUnavailable': 503, 'DeadlineExceeded': 504, 'GatewayTimeout': 504,
+}
+
+
+class GeminiBusyError(Exception):
+    """No Gemini capacity became free within the caller's wait budget."""
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Runs the enclosed Gemini calls (in this context) at `level`."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def background() -> Iterator[None]:
+    """Marks bulk work (document jobs, index builds) so interactive calls go first."""
+    return priority(BACKGROUND)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """HTTP status of a google.api_core error (or a look-alike), if any."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code
+    return _STATUS_BY_NAME.get(type(error).__name__)
+
+
+class TokenBucket:
+    """`rate_per_minute` requests on average, bursts of up to `capacity`."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, self.rate * 2)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float, reserve: float = 0.0) -> float:
+        """Seconds until one token is available above `reserve` (0 if it is now)."""
+        self._refill(now)
+        missing = 1.0 + reserve - self.tokens
+        return max(missing, 0.0) / self.rate
+
+    def take(self):
+        self.tokens -= 1.0
+
+    def drain(self):
+        """After a 429 the quota is spent for now, whatever the local count says."""
+        self.tokens = min(self.tokens, 0.0)
+
+
+class AIMDLimit:
+    """
+    Adaptive concurrency limit: +1 per `limit` successful calls (additive
+    increase), x`backoff` on a 429/503 and x0.9 when latency exceeds
+    `latency_tolerance` times its running baseline (multiplicative decrease,
+    at most once per `cooldown` seconds so one burst of failures from calls
+    already in flight counts once).
+    """
+
+    def __init__(self, initial: float, minimum: float = 1.0, maximum: float = 64.0, backoff: float = 0.5, latency_tolerance: float = 3.0, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.baseline = None  # EWMA of uncongested latency
+        self._last_decrease = 0.0
+
+    def on_success(self, latency: float):
+        if self.baseline is None:
+            self.baseline = latency
+        if latency > self.latency_tolerance * self.baseline:
+            self._decrease(0.9)
+        else:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        self.baseline += 0.05 * (min(latency, self.latency_tolerance * self.baseline) - self.baseline)
+
+    def on_throttle(self):
+        self._decrease(self.backoff)
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit * factor)
+            self._last_decrease = now
+
+
+class _Lane:
+    """Admission control for one (model, call type): a token bucket, an AIMD limit and a priority queue."""
+
+    def __init__(self, bucket: Optional[TokenBucket], limit: AIMDLimit, background_share: float, background_reserve: float):
+        self.bucket = bucket
+        self.limit = limit
+        self.background_share = background_share
+        self.background_reserve = background_reserve
+        self.cond = threading.Condition()
+        self.in_flight = [0, 0]   # Per priority
+        self.waiting = []         # Heap of (priority, sequence)
+        self._sequence = count()
+
+    def acquire(self, level: int, max_wait: Optional[float]):
+        with self.cond:
+            ticket = (level, next(self._sequence))
+            heapq.heappush(self.waiting, ticket)
+            deadline = time.monotonic() + max_wait if max_wait is not None else None
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._admission_wait(ticket, now)
+                    if wait == 0.0:
+                        heapq.heappop(self.waiting)
+                        self.in_flight[level] += 1
+                        if self.bucket:
+                            self.bucket.take()
+                        self.cond.notify_all()  # The next waiter is now at the head
+                        return
+                    if deadline is not None:
+                        if now >= deadline:
+                            raise GeminiBusyError("Gemini capacity exhausted, retry later")
+                        wait = min(wait, deadline - now) if wait is not None else deadline - now
+                    self.cond.wait(wait)
+            except BaseException:
+                if ticket in self.waiting:
+                    self.waiting.remove(ticket)
+                    heapq.heapify(self.waiting)
+                    self.cond.notify_all()
+                raise
+
+    def _admission_wait(self, ticket, now: float) -> Optional[float]:
+        """0 if `ticket` may go now, else seconds to wait (None: until notified)."""
+        if self.waiting[0] != ticket:
+            return None  # Higher priority or earlier callers first
+        limit = max(1, int(self.limit.limit))
+        if sum(self.in_flight) >= limit:
+            return None
+        background = ticket[0] == BACKGROUND
+        if background and self.in_flight[BACKGROUND] >= max(1, int(limit * self.background_share)):
+            return None  # Keep slots free for interactive calls
+        if self.bucket:
+            # Never more than capacity - 1, or a small bucket would starve background calls
+            reserve = min(self.bucket.capacity * self.background_reserve, self.bucket.capacity - 1.0) if background else 0.0
+            wait = self.bucket.wait_time(now, reserve)
+            if wait > 0:
+                return wait
+        return 0.0
+
+    def release(self, level: int, latency: float, status: Optional[int]):
+        with self.cond:
+            self.in_flight[level] -= 1
+            if status in OVERLOAD_STATUS:
+                self.limit.on_throttle()
+                if self.bucket:
+                    self.bucket.drain()
+            elif status is None:
+                self.limit.on_success(latency)
+            self.cond.notify_all()
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                'limit': round(self.limit.limit, 2),
+                'in_flight': {name: self.in_flight[i] for i, name in enumerate(PRIORITY_NAMES)},
+                'waiting': len(self.waiting),
+                'tokens': round(self.bucket.tokens, 2) if self.bucket else None,
+                'baseline_latency': round(self.limit.baseline, 4) if self.limit.baseline is not None else None,
+            }
+
+
+class GeminiGateway:
+    """
+    Process-wide admission control for Gemini calls, shared by every service.
+
+    Each (model, call type) pair gets its own lane:
+    1. A token bucket enforces `rate_limits` (requests/minute, keyed
+       "model:call" or just "call"; pairs without a limit are not metered).
+    2. An AIMD concurrency limit adapts to the API: it grows while calls
+       succeed at normal latency and halves on a 429 or 503 (which also
+       empties the bucket), so a backlog backs off instead of turning into a 429 storm.
+    3. Waiters are served by priority: calls made under `background()`
+       (document jobs) queue behind interactive ones, may use at most
+       `background_share` of the concurrency limit and leave
+       `background_reserve` of the bucket for interactive calls.
+    4. `call` retries 429s and transient 5xx errors with jittered
+       exponential backoff; interactive calls give up sooner.
+    """
+
+    def __init__(
+        self,
+        rate_limits: Optional[Dict[str, float]] = None,
+        initial_concurrency: int = 8,
+        max_concurrency: int = 32,
+        background_share: float = 0.75,
+        background_reserve: float = 0.2,
+        latency_tolerance: float = 3.0,
+        max_attempts: int = 5,
+        interactive_max_attempts: int = 3,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        interactive_max_wait: Optional[float] = 30.0,
+    ):
+        self.rate_limits = dict(rate_limits or {})
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.background_share = background_share
+        self.background_reserve = background_reserve
+        self.latency_tolerance = latency_tolerance
+        self.max_attempts = max_attempts
+        self.interactive_max_attempts = interactive_max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.interactive_max_wait = interactive_max_wait
+
+        self._lanes: Dict[tuple, _Lane] = {}
+        self._lock = threading.Lock()
+        self._api_key = None
+
+    def configure(self, api_key: str):
+        """genai.configure, once per process (services used to call it each)."""
+        with self._lock:
+            if api_key == self._api_key:
+                return
+            import google.generativeai as genai
+            genai.configure(api_key=api_key)
+            self._api_key = api_key
+
+    def _lane(self, model: str, call: str) -> _Lane:
+        key = (model, call)
+        lane = self._lanes.get(key)
+        if lane is None:
+            with self._lock:
+                lane = self._lanes.get(key)
+                if lane is None:
+                    rate = self.rate_limits.get(f"{model}:{call}", self.rate_limits.get(call))
+                    lane = _Lane(
+                        TokenBucket(rate) if rate else None,
+                        AIMDLimit(min(self.initial_concurrency, self.max_concurrency), maximum=self.max_concurrency, latency_tolerance=self.latency_tolerance),
+                        self.background_share,
+                        self.background_reserve
+                    )
+                    self._lanes[key] = lane
+        return lane
+
+    @contextmanager
+    def slot(self, call: str, model: str) -> Iterator[None]:
+        """
+        Holds one admission slot for the enclosed API call (e.g. a streamed
+        generation, which `call` cannot retry). Raises GeminiBusyError if an
+        interactive caller waits longer than `interactive_max_wait`.
+        """
+        level = current_priority()
+        lane = self._lane(model, call)
+        queued = time.perf_counter()
+        lane.acquire(level, self.interactive_max_wait if level == INTERACTIVE else None)
+        start = time.perf_counter()
+        GEMINI_QUEUE_SECONDS.observe(start - queued, call=call, priority=PRIORITY_NAMES[level])
+        status = None
+        try:
+            yield
+        except Exception as e:
+            status = error_status(e) or 0
+            if status in OVERLOAD_STATUS:
+                GEMINI_THROTTLED.inc(call=call, model=model, status=status)
+            raise
+        finally:
+            lane.release(level, time.perf_counter() - start, status)
+
+    def call(self, call: str, model: str, fn: Callable[[], T], request=None, measure: Optional[Callable[[T], Any]] = None) -> T:
+        """
+        Runs `fn` (one API call) within the limits, retrying retryable
+        errors. `request`/`measure(result)` feed the payload size metrics.
+        """
+        level = current_priority()
+        attempts = self.interactive_max_attempts if level == INTERACTIVE else self.max_attempts
+        for attempt in range(1, attempts + 1):
+            try:
+                with self.slot(call, model):
+                    with gemini_call(call, model, request) as info:
+                        result = fn()
+                        info["response"] = measure(result) if measure else None
+                return result
+            except GeminiBusyError:
+                raise
+            except Exception as e:
+                status = error_status(e)
+                if status not in RETRYABLE_STATUS or attempt == attempts:
+                    raise
+                self._backoff(call, model, status, attempt, attempts)
+
+    def stream(self, call: str, model: str, fn: Callable[[], Iterable], request=None) -> Iterator[str]:
+        """
+        Runs `fn` (a `generate_content(..., stream=True)` call) within the
+        limits and yields the text of each chunk as it arrives. The slot is
+        held until the stream ends or the generator is closed. Errors before
+        the first chunk are retried like in `call`; after that the caller
+        has already seen part of the answer, so they propagate.
+        """
+        level = current_priority()
+        attempts = self.interactive_max_attempts if level == INTERACTIVE else self.max_attempts
+        for attempt in range(1, attempts + 1):
+            parts = []
+            try:
+                with self.slot(call, model):
+                    with gemini_call(call, model, request) as info:
+                        for chunk in fn():
+                            text = chunk.text
+                            if text:
+                                parts.append(text)
+                                yield text
+                        info["response"] = "".join(parts)
+                return
+            except GeminiBusyError:
+                raise
+            except Exception as e:
+                status = error_status(e)
+                if parts or status not in RETRYABLE_STATUS or attempt == attempts:
+                    raise
+                self._backoff(call, model, status, attempt, attempts)
+
+    def _backoff(self, call: str, model: str, status: int, attempt: int, attempts: int):
+        """Full-jitter exponential backoff before the next attempt."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        GEMINI_RETRIES.inc(call=call, status=status)
+        logger.warning(f"Gemini {call} on {model} failed with {status} (attempt {attempt}/{attempts}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lanes = list(self._lanes.items())
+        return {f"{model}:{call}": lane.stats() for (model, call), lane in lanes}
+
+
+def parse_rate_limits(spec: str) -> Dict[str, float]:
+    """'generate=1000,embed=1500,gemini-2.5-flash:generate=500' -> {key: requests per minute}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        key, _, value = item.rpartition('=')
+        limits[key.strip()] = float(value)
+    return limits
+
+
+_default_gateway = GeminiGateway()
+
+
+def get_gateway() -> GeminiGateway:
+    return _default_gateway
+
+
+def set_gateway(gateway: GeminiGateway):
+    """Replaces the process-wide gateway (call before the services are built)."""
+    global _default_gateway
+    _default_gateway = gateway
@@ -1,20 +1,117 @@
 import google.generativeai as genai
-import PIL.Image
+import hashlib
+import logging
 from io import BytesIO
+from typing import BinaryIO, Callable, Iterator, Optional, Union
+from app.services.gemini_gateway import GeminiGateway, get_gateway
+from app.services.metrics import IMAGE_BYTES, IMAGE_BYTES_SAVED, IMAGE_CACHE_LOOKUPS, timed
+from app.services.image_preprocessor import ImagePreprocessor, InvalidImageError, file_sha256
+from app.services.image_cache import ImageResultCache, dhash
+
+logger = logging.getLogger(__name__)
+
+# Bump when the prompt changes so cached analyses are not reused
+PROMPT_VERSION = 1
 
 class MedicalImageAnalyzer:
-    def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash-lite')
+    def __init__(self, api_key: str, preprocessor: Optional[ImagePreprocessor] = None, cache: Optional[ImageResultCache] = None, gateway: Optional[GeminiGateway] = None):
+        self.gateway = gateway or get_gateway()
+        self.gateway.configure(api_key)
+        self.model_name = 'gemini-2.5-flash-lite'
+        self.model = genai.GenerativeModel(self.model_name)
+        # Downscale + re-encode before upload; results of identical uploads are cached
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        self.cache = cache
 
-    def analyze_image(self, image_bytes: bytes, mime_type: str) -> str:
+    def analyze_image(self, image: Union[bytes, BinaryIO], mime_type: str, content_hash: Optional[str] = None) -> str:
+        """
+        `image` is the uploaded bytes or a (spooled) file object; `content_hash`
+        is its SHA-256 if the caller already computed it while receiving it.
+        """
         try:
-            try:
-                image = PIL.Image.open(BytesIO(image_bytes))
-            except Exception:
-                return "Error: The file provided is not a valid image or is corrupted. Please upload a standard image file (JPG, PNG)."
+            analysis, contents, store = self._plan_analysis(image, content_hash)
+            if contents is None:
+                return analysis
+
+            # 4. Generate (inline blob, so the SDK does not re-encode the image)
+            response = self.gateway.call(
+                "generate", self.model_name, lambda: self.model.generate_content(contents), [contents[0], contents[1]["data"]], lambda r: r.text
+            )
+            store(response.text)
+            return response.text
+        except Exception as e:
+            logger.error(f"Image Analysis Error: {e}")
+            raise e
+
+    def analyze_image_stream(self, image: Union[bytes, BinaryIO], mime_type: str, content_hash: Optional[str] = None) -> Iterator[str]:
+        """
+        analyze_image with a streamed analysis: hashing, cache lookups and
+        preprocessing run now, generation runs as the returned iterator is
+        consumed. Cached analyses come back as a single chunk.
+        """
+        try:
+            analysis, contents, store = self._plan_analysis(image, content_hash)
+        except Exception as e:
+            logger.error(f"Image Analysis Error: {e}")
+            raise e
+        if contents is None:
+            return iter([analysis])
+        return self._stream_generation(contents, store)
+
+    def _stream_generation(self, contents: list, store: Callable[[str], None]) -> Iterator[str]:
+        parts = []
+        for text in self.gateway.stream(
+            "generate", self.model_name, lambda: self.model.generate_content(contents, stream=True), [contents[0], contents[1]["data"]]
+        ):
+            parts.append(text)
+            yield text
+        store("".join(parts))
 
-            prompt = """
+    def _plan_analysis(self, image: Union[bytes, BinaryIO], content_hash: Optional[str]):
+        """
+        Steps before generation. Returns (analysis, None, None) when no
+        generation is needed, else (None, contents, store) where store(analysis)
+        caches the generated analysis.
+        """
+        fileobj = BytesIO(image) if isinstance(image, (bytes, bytearray)) else image
+        if content_hash is None:
+            content_hash = hashlib.sha256(image).hexdigest() if isinstance(image, (bytes, bytearray)) else file_sha256(fileobj)
+        fileobj.seek(0, 2)
+        upload_bytes = fileobj.tell()
+        fileobj.seek(0)
+        IMAGE_BYTES.inc(upload_bytes, stage="uploaded")
+
+        # 1. Same upload as before: no decoding or generation needed
+        scope = f"{self.model_name}:{PROMPT_VERSION}"
+        cache_key = f"{scope}:{content_hash}"
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                IMAGE_CACHE_LOOKUPS.inc(result="hit_exact")
+                IMAGE_BYTES_SAVED.inc(upload_bytes, reason="cache")
+                return cached, None, None
+
+        # 2. Preprocess (downscale, re-encode)
+        try:
+            with timed("image_preprocess"):
+                prepared = self.preprocessor.prepare(fileobj)
+        except InvalidImageError:
+            return "Error: The file provided is not a valid image or is corrupted. Please upload a standard image file (JPG, PNG).", None, None
+        IMAGE_BYTES_SAVED.inc(prepared.bytes_saved, reason="preprocess")
+
+        # 3. Optionally, a re-encoded or resized copy of a cached image
+        image_hash = None
+        if self.cache:
+            image_hash = dhash(prepared.image) if self.cache.hash_distance > 0 else None
+            cached = self.cache.get_similar(scope, image_hash)
+            if cached is not None:
+                IMAGE_CACHE_LOOKUPS.inc(result="hit_perceptual")
+                IMAGE_BYTES_SAVED.inc(len(prepared.data), reason="cache")
+                return cached, None, None
+            IMAGE_CACHE_LOOKUPS.inc(result="miss")
+        IMAGE_BYTES.inc(len(prepared.data), stage="sent")
+
+        prompt = """
             You are a highly experienced medical imaging specialist. 
             Analyze this medical image in detail.
             
@@ -31,9 +128,8 @@ class MedicalImageAnalyzer:
             
             **Disclaimer:** This analysis is generated by AI and is for assistance purposes only. It is NOT a professional medical diagnosis.
             """
-            
-            response = self.model.generate_content([prompt, image])
-            return response.text
-        except Exception as e:
-            print(f"Image Analysis Error: {e}")
-            raise e
+
+        def store(analysis: str):
+            if self.cache:
+                self.cache.put(cache_key, scope, image_hash, analysis)
+        return None, [prompt, {"mime_type": prepared.mime_type, "data": prepared.data}], store
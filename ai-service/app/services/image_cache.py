@@ -0,0 +1,101 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+import PIL.Image
+
+
+def dhash(image: PIL.Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: brightness gradients of a (size+1) x size thumbnail."""
+    small = np.asarray(image.convert('L').resize((size + 1, size), PIL.Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class ImageResultCache:
+    """
+    Analysis results keyed by the SHA-256 of the uploaded bytes (plus the
+    model/prompt scope), so re-uploads of the same file skip preprocessing
+    and generation.
+
+    With `hash_distance > 0`, a miss also compares the difference hash of the
+    preprocessed image against cached entries of the same scope and reuses a
+    result within that Hamming distance (re-encoded or resized copies of the
+    same scan). Off by default: distinct scans of the same anatomy can have
+    close hashes, so only enable it with a small distance.
+
+    Memory is bounded by `max_entries` (LRU) and `ttl_seconds`.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 7 * 86400, hash_distance: int = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hash_distance = hash_distance
+
+        self._entries = OrderedDict()  # key -> (scope, dhash or None, result, created_at)
+        self._lock = threading.Lock()
+
+        self.hits_exact = 0
+        self.hits_perceptual = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return None  # Counted as a miss once the perceptual lookup (if any) fails
+            self.hits_exact += 1
+            return entry[2]
+
+    def get_similar(self, scope: str, image_hash: Optional[int]) -> Optional[str]:
+        with self._lock:
+            if self.hash_distance <= 0 or image_hash is None:
+                self.misses += 1
+                return None
+            best, best_distance = None, self.hash_distance + 1
+            for key in list(self._entries):
+                entry = self._live(key, touch=False)
+                if entry is None or entry[0] != scope or entry[1] is None:
+                    continue
+                distance = bin(entry[1] ^ image_hash).count('1')
+                if distance < best_distance:
+                    best, best_distance = key, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits_perceptual += 1
+            return self._entries[best][2]
+
+    def put(self, key: str, scope: str, image_hash: Optional[int], result: str):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (scope, image_hash, result, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits_exact + self.hits_perceptual + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits_exact": self.hits_exact,
+            "hits_perceptual": self.hits_perceptual,
+            "misses": self.misses,
+            "hit_rate": round((self.hits_exact + self.hits_perceptual) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _live(self, key: str, touch: bool = True):
+        # Call with the lock held
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl_seconds and time.time() - entry[3] > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        if touch:
+            self._entries.move_to_end(key)
+        return entry
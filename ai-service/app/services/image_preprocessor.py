@@ -0,0 +1,126 @@
+import hashlib
+from io import BytesIO
+from typing import BinaryIO
+
+import numpy as np
+import PIL.Image
+import PIL.ImageOps
+
+# Formats Gemini accepts as inline image data
+ENCODINGS = {
+    'JPEG': ('image/jpeg', {'quality': 90, 'optimize': True}),
+    'WEBP': ('image/webp', {'quality': 90, 'method': 4}),
+    'PNG': ('image/png', {'optimize': True}),
+}
+
+
+class InvalidImageError(Exception):
+    """The upload could not be decoded as an image."""
+
+
+class PreparedImage:
+    """An upload after preprocessing: what is sent to the model plus size bookkeeping."""
+
+    def __init__(self, data: bytes, mime_type: str, width: int, height: int, original_bytes: int, original_size: tuple, image: PIL.Image.Image):
+        self.data = data
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.original_bytes = original_bytes
+        self.original_size = original_size
+        self.image = image  # Downscaled image, e.g. for a perceptual hash
+
+    @property
+    def bytes_saved(self) -> int:
+        return max(self.original_bytes - len(self.data), 0)
+
+
+def file_sha256(fileobj: BinaryIO, block_size: int = 1 << 20) -> str:
+    """Streams a (spooled) file through SHA-256 and rewinds it."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(block_size), b''):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class ImagePreprocessor:
+    """
+    Shrinks uploads before they are sent to Gemini.
+
+    1. Decoding is lazy and bounded: `max_pixels` rejects decompression bombs,
+       and JPEGs are decoded at a reduced scale (`draft`) when they are much
+       larger than needed.
+    2. EXIF orientation is applied and the image is downscaled so its longer
+       side is at most `max_side` (the model downsamples larger images anyway).
+    3. The result is re-encoded as `encoding` (JPEG by default). If that is not
+       smaller than the upload and the upload needed no resizing, the original
+       bytes are sent instead.
+
+    Without this, the SDK re-encoded every full-resolution upload as lossless
+    WebP on the request path.
+    """
+
+    def __init__(self, max_side: int = 1536, encoding: str = 'JPEG', max_pixels: int = 100_000_000):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding {encoding}, expected one of {tuple(ENCODINGS)}")
+        self.max_side = max_side
+        self.encoding = encoding
+        self.max_pixels = max_pixels
+
+    def prepare(self, fileobj: BinaryIO) -> PreparedImage:
+        fileobj.seek(0, 2)
+        original_bytes = fileobj.tell()
+        fileobj.seek(0)
+
+        # 1. Open (header only) and check the pixel budget before decoding
+        try:
+            image = PIL.Image.open(fileobj)
+            original_size = image.size
+            if original_size[0] * original_size[1] > self.max_pixels:
+                raise InvalidImageError(f"Image of {original_size[0]}x{original_size[1]} pixels exceeds the limit")
+            source_format = image.format
+            if source_format == 'JPEG':
+                image.draft(image.mode, (self.max_side, self.max_side))
+            image.load()
+        except InvalidImageError:
+            raise
+        except Exception as e:
+            raise InvalidImageError(str(e))
+
+        # 2. Orientation, colour mode and size
+        image = self._to_8bit(PIL.ImageOps.exif_transpose(image))
+        resized = max(image.size) > self.max_side
+        if resized:
+            image.thumbnail((self.max_side, self.max_side), PIL.Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+        # 3. Compact encoding, unless the upload is already smaller
+        out_mime, options = ENCODINGS[self.encoding]
+        buffer = BytesIO()
+        image.save(buffer, format=self.encoding, **options)
+        data = buffer.getvalue()
+        if not resized and original_size == image.size and len(data) >= original_bytes and source_format in ENCODINGS:
+            fileobj.seek(0)
+            data = fileobj.read()
+            out_mime = ENCODINGS[source_format][0]
+
+        return PreparedImage(data, out_mime, image.size[0], image.size[1], original_bytes, original_size, image)
+
+    @staticmethod
+    def _to_8bit(image: PIL.Image.Image) -> PIL.Image.Image:
+        """Grayscale or RGB with 8 bits per channel; transparency is flattened onto white."""
+        if image.mode in ('L', 'RGB'):
+            return image
+        if image.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'F'):
+            # 16-bit/float scans (common for X-ray PNG/TIFF): stretch the used range to 0..255
+            pixels = np.asarray(image, dtype=np.float32)
+            low, high = float(pixels.min()), float(pixels.max())
+            scaled = (pixels - low) * (255.0 / (high - low)) if high > low else np.zeros_like(pixels)
+            return PIL.Image.fromarray(scaled.astype(np.uint8))
+        if 'A' in image.getbands() or 'transparency' in image.info:
+            image = image.convert('RGBA')
+            background = PIL.Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB')
@@ -0,0 +1,564 @@
+import logging
+import os
+import csv
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.file_lock import file_lock
+from app.services.metrics import INFLOW_EVENTS, timed
+
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout of the aggregates changes
+AGGREGATES_VERSION = 1
+
+AGGREGATES_FILE = 'aggregates.npy'
+META_FILE = 'meta.json'
+STATE_LOCK_FILE = 'state.lock'
+
+# Column names recognised in exports (first match wins)
+TIMESTAMP_COLUMNS = ('timestamp', 'schedule', 'admitted_at', 'arrival_time', 'created_at', 'date')
+DEPARTMENT_COLUMNS = ('department', 'specialization', 'ward')
+STATUS_COLUMN = 'status'
+# Appointments that never turned into a visit
+EXCLUDED_STATUSES = {'cancelled', 'canceled', 'no_show', 'no-show', 'noshow'}
+UNKNOWN_DEPARTMENT = 'unknown'
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+HEAD_BYTES = 65536  # Prefix of a CSV export used to recognise it after a rewrite
+BATCH_ROWS = 50000
+
+
+def weekday(day):
+    """Monday=0 for days since 1970-01-01 (a Thursday); works on arrays."""
+    return (day + 3) % 7
+
+
+def parse_timestamp(value, utc_offset_minutes: int = 0) -> Optional[Tuple[int, int]]:
+    """
+    (day since epoch, hour) in the hospital's local time, or None.
+
+    Accepts ISO 8601 strings (with or without an offset, `Z` included) and
+    epoch seconds or milliseconds. Naive timestamps are taken as local time;
+    aware ones are converted to UTC and shifted by `utc_offset_minutes`.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, (int, float)) or (isinstance(value, str) and value.replace('.', '', 1).isdigit()):
+            seconds = float(value)
+            if seconds > 1e11:
+                seconds /= 1000.0  # Milliseconds
+            seconds += utc_offset_minutes * 60
+        else:
+            parsed = datetime.fromisoformat(value.strip())
+            if parsed.tzinfo is not None:
+                seconds = parsed.timestamp() + utc_offset_minutes * 60
+            else:
+                seconds = parsed.replace(tzinfo=timezone.utc).timestamp()
+    except (ValueError, OverflowError, OSError):
+        return None
+    minutes = int(seconds // 60)
+    return minutes // 1440, (minutes % 1440) // 60
+
+
+def _pick(columns: List[str], candidates: Tuple[str, ...]) -> Optional[int]:
+    lowered = [c.strip().lstrip('\ufeff').lower() for c in columns]
+    for name in candidates:
+        if name in lowered:
+            return lowered.index(name)
+    return None
+
+
+class CsvEventSource:
+    """
+    Reads appointment/admission rows appended to a CSV export since the last
+    read. The cursor is the byte offset of the last complete line plus a hash
+    of the file's head, so a re-export that only appended rows is continued
+    and anything else (a rewritten or truncated file) is read from the start.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self, cursor: Optional[dict]) -> Tuple[bool, Iterator[List[tuple]], dict]:
+        """Returns (reset, batches of (timestamp, department, status) rows, new cursor)."""
+        size = os.path.getsize(self.path)
+        with open(self.path, 'rb') as f:
+            head = f.read(HEAD_BYTES)
+        reset = (
+            cursor is None or size < cursor['offset']
+            or hashlib.sha1(head[:cursor['head_bytes']]).hexdigest() != cursor['head']
+        )
+        if reset:
+            cursor = {'offset': 0, 'head_bytes': len(head), 'head': hashlib.sha1(head).hexdigest(), 'columns': None}
+        else:
+            cursor = dict(cursor)
+        return reset, self._batches(cursor), cursor
+
+    def _batches(self, cursor: dict) -> Iterator[List[tuple]]:
+        with open(self.path, 'rb') as f:
+            f.seek(cursor['offset'])
+            pending = b''
+            for block in iter(lambda: f.read(8 << 20), b''):
+                block = pending + block
+                end = block.rfind(b'\n') + 1
+                pending = block[end:]  # A line still being written
+                if not end:
+                    continue
+                lines = block[:end].decode('utf-8', errors='replace').splitlines()
+                if cursor['columns'] is None:
+                    cursor['columns'] = next(csv.reader([lines[0]]))
+                    lines = lines[1:]
+                cursor['offset'] += end
+                yield self._rows(csv.reader(lines), cursor['columns'])
+
+    @staticmethod
+    def _rows(reader, columns: List[str]) -> List[tuple]:
+        ts, dept, status = _pick(columns, TIMESTAMP_COLUMNS), _pick(columns, DEPARTMENT_COLUMNS), _pick(columns, (STATUS_COLUMN,))
+        if ts is None:
+            raise ValueError(f"No timestamp column in export, expected one of {TIMESTAMP_COLUMNS}")
+        rows = []
+        for record in reader:
+            if len(record) <= ts:
+                continue
+            rows.append((
+                record[ts],
+                record[dept] if dept is not None and dept < len(record) else None,
+                record[status] if status is not None and status < len(record) else None
+            ))
+        return rows
+
+
+class SqliteEventSource:
+    """
+    Reads rows of `table` in a SQLite export with a rowid above the last one
+    seen. Rows updated in place (e.g. later cancelled) are not re-read; a
+    table whose rowids went backwards is read from the start.
+    """
+
+    def __init__(self, path: str, table: str = 'events'):
+        self.path = path
+        self.table = table
+
+    def read(self, cursor: Optional[dict]) -> Tuple[bool, Iterator[List[tuple]], dict]:
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        max_rowid = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{self.table}"').fetchone()[0]
+        reset = cursor is None or max_rowid < cursor['rowid']
+        cursor = {'rowid': 0} if reset else dict(cursor)
+        return reset, self._batches(conn, cursor), cursor
+
+    def _batches(self, conn: sqlite3.Connection, cursor: dict) -> Iterator[List[tuple]]:
+        try:
+            columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{self.table}")')]
+            ts, dept, status = _pick(columns, TIMESTAMP_COLUMNS), _pick(columns, DEPARTMENT_COLUMNS), _pick(columns, (STATUS_COLUMN,))
+            if ts is None:
+                raise ValueError(f"No timestamp column in {self.table}, expected one of {TIMESTAMP_COLUMNS}")
+            selected = ', '.join(f'"{columns[i]}"' if i is not None else 'NULL' for i in (ts, dept, status))
+            result = conn.execute(
+                f'SELECT rowid, {selected} FROM "{self.table}" WHERE rowid > ? ORDER BY rowid', (cursor['rowid'],)
+            )
+            while True:
+                batch = result.fetchmany(BATCH_ROWS)
+                if not batch:
+                    break
+                cursor['rowid'] = batch[-1][0]
+                yield [row[1:] for row in batch]
+        finally:
+            conn.close()
+
+
+def seasonal_trend_forecast(history: np.ndarray, last_weekday: int, steps: np.ndarray, half_life: float = 28.0, damping: float = 0.98):
+    """
+    Forecasts every column of `history` (days x series, oldest first) at
+    `steps` days after its last row, all series at once:
+
+    1. Day-of-week profile: recency-weighted mean per weekday, as an additive
+       offset from the overall level (additive, so closed days stay at zero).
+    2. Level and trend: weighted least squares line through the
+       deseasonalized series; the trend is damped towards flat with horizon.
+    3. A 90% band from the weighted residual spread, widening with horizon.
+
+    Returns (mean, lower, upper), each len(steps) x series, clipped at zero.
+    """
+    n_days, n_series = history.shape
+    y = history.astype(np.float64)
+    age = np.arange(n_days - 1, -1, -1, dtype=np.float64)
+    w = 0.5 ** (age / half_life)
+    row_weekday = (last_weekday - age.astype(np.int64)) % 7
+    onehot = np.eye(7)[row_weekday] * w[:, None]  # n_days x 7
+
+    # 1. Weekday offsets from the overall level
+    weekday_weight = onehot.sum(axis=0)
+    seen = weekday_weight > 0
+    profile = np.zeros((7, n_series))
+    profile[seen] = (onehot.T @ y)[seen] / weekday_weight[seen, None]
+    offsets = np.zeros_like(profile)
+    offsets[seen] = profile[seen] - profile[seen].mean(axis=0)
+    z = y - offsets[row_weekday]
+
+    # 2. Weighted linear fit, closed form for all columns
+    t = -age
+    w_sum = w.sum()
+    t_mean = (w @ t) / w_sum
+    z_mean = (w @ z) / w_sum
+    t_var = (w * (t - t_mean) ** 2).sum()
+    slope = ((w * (t - t_mean)) @ (z - z_mean)) / t_var if n_days >= 14 and t_var > 0 else np.zeros(n_series)
+    level = z_mean + slope * (0 - t_mean)
+    residuals = z - (z_mean + np.outer(t - t_mean, slope))
+    sigma = np.sqrt((w @ residuals ** 2) / w_sum)
+
+    steps = np.asarray(steps, dtype=np.float64)
+    trend = damping * (1 - damping ** steps) / (1 - damping)  # Sum of damping**i for i = 1..step
+    step_weekday = (last_weekday + steps.astype(np.int64)) % 7
+    mean = level + np.outer(trend, slope) + offsets[step_weekday]
+    spread = 1.645 * np.outer(np.sqrt(1 + steps / n_days), sigma)
+    return np.clip(mean, 0, None), np.clip(mean - spread, 0, None), np.clip(mean + spread, 0, None)
+
+
+class InflowForecaster:
+    """
+    Patient inflow forecast from an appointment/admission export.
+
+    Events are folded into one count cube, days x hours x departments, that
+    is extended incrementally: each refresh reads only rows added to the
+    source since the last one (see CsvEventSource, SqliteEventSource) and the
+    cube is persisted under `state_dir`, so neither a request nor a restart
+    rescans the history. Days older than `retention_days` are dropped.
+
+    A forecast fits the last `history_weeks` complete weeks of every
+    department (and the total) in one vectorized pass and is cached until new
+    events arrive or the date changes; requests for other horizons or
+    departments are slices of the same result.
+    """
+
+    def __init__(
+        self,
+        source,
+        state_dir: Optional[str] = None,
+        utc_offset_minutes: int = 0,
+        history_weeks: int = 8,
+        max_days: int = 90,
+        retention_days: int = 1100,
+        refresh_seconds: float = 30.0,
+    ):
+        self.source = source
+        self.state_dir = state_dir
+        self.utc_offset_minutes = utc_offset_minutes
+        self.history_weeks = history_weeks
+        self.max_days = max_days
+        self.retention_days = retention_days
+        self.refresh_seconds = refresh_seconds
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.version = 0        # Bumped on every change; keys the forecast cache
+        self._reset()
+        self._cursor = None
+        self._checked_at = None
+        self._forecast = None   # (version, today, arrays)
+        self._responses = {}    # (days, department, hourly) -> response for the current forecast
+
+        # Catch up with the source now rather than on the first request
+        self._load_state()
+        self.refresh(force=True)
+
+    def _reset(self):
+        self.origin = None      # Day (since epoch) of row 0 of the cube
+        self.n_days = 0
+        self.counts = np.zeros((0, 24, 0), dtype=np.int32)
+        self.departments: List[str] = []
+        self._department_index = {}
+        self.events = 0
+        self.version += 1
+
+    # --- Ingestion ---
+
+    def _due(self) -> bool:
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.refresh_seconds
+
+    def refresh(self, force: bool = False) -> int:
+        """Ingests rows added to the source since the last refresh; returns how many."""
+        if self.source is None or not (force or self._due()):
+            return 0
+        with self._refresh_lock:
+            if not (force or self._due()):
+                return 0
+            added, reset = 0, False
+            try:
+                reset, batches, cursor = self.source.read(self._cursor)
+                if reset and self._cursor is not None:
+                    logger.warning("Inflow history was rewritten, rebuilding aggregates")
+                    with self._lock:
+                        self._reset()
+                with timed("inflow_ingest"):
+                    for rows in batches:
+                        added += self.ingest(rows)
+                        self._cursor = dict(cursor)  # Advanced past the batch just ingested
+                self._cursor = cursor
+            except (OSError, sqlite3.Error, ValueError) as e:
+                logger.warning(f"Inflow history unavailable: {e}")
+            self._checked_at = time.monotonic()
+            if added or reset:
+                self._save_state()
+            return added
+
+    def ingest(self, rows: List[tuple]) -> int:
+        """Adds (timestamp, department, status) rows to the aggregates; returns how many counted."""
+        days, hours, departments = [], [], []
+        for timestamp, department, status in rows:
+            if status and str(status).strip().lower() in EXCLUDED_STATUSES:
+                continue
+            parsed = parse_timestamp(timestamp, self.utc_offset_minutes)
+            if parsed is None:
+                continue
+            days.append(parsed[0])
+            hours.append(parsed[1])
+            departments.append((str(department).strip() if department else '') or UNKNOWN_DEPARTMENT)
+        if not days:
+            return 0
+
+        with self._lock:
+            columns = np.fromiter((self._department_column(d) for d in departments), dtype=np.int64, count=len(departments))
+            days = np.asarray(days, dtype=np.int64)
+            hours = np.asarray(hours, dtype=np.int64)
+            if self.origin is not None:
+                keep = days >= self.origin + self.n_days - self.retention_days  # Older than the retention window
+                days, hours, columns = days[keep], hours[keep], columns[keep]
+                if not len(days):
+                    return 0
+            self._ensure_capacity(int(days.min()), int(days.max()))
+
+            # One bincount over flat cube indices instead of per-event updates
+            rows = days - self.origin
+            first, last = int(rows.min()), int(rows.max()) + 1
+            n_departments = len(self.departments)
+            flat = ((rows - first) * 24 + hours) * n_departments + columns
+            block = np.bincount(flat, minlength=(last - first) * 24 * n_departments)
+            self.counts[first:last] += block.reshape(last - first, 24, n_departments).astype(np.int32)
+            self.n_days = max(self.n_days, last)
+            self._trim()
+
+            self.events += len(days)
+            self.version += 1
+        INFLOW_EVENTS.inc(len(days))
+        return len(days)
+
+    def _department_column(self, department: str) -> int:
+        column = self._department_index.get(department)
+        if column is None:
+            column = len(self.departments)
+            self.departments.append(department)
+            self._department_index[department] = column
+        return column
+
+    def _ensure_capacity(self, first_day: int, last_day: int):
+        """Grows the cube (amortized doubling) to cover the days and known departments."""
+        if self.origin is None:
+            self.origin = first_day
+        prepend = max(self.origin - first_day, 0)
+        needed = max(last_day - self.origin + 1, self.n_days) + prepend
+        n_departments = len(self.departments)
+        capacity, _, width = self.counts.shape
+        if prepend or needed > capacity or n_departments > width:
+            new_capacity = max(needed, capacity * 2 if needed > capacity else capacity, 64)
+            grown = np.zeros((new_capacity, 24, max(n_departments, width)), dtype=np.int32)
+            grown[prepend:prepend + self.n_days, :, :width] = self.counts[:self.n_days]
+            self.counts = grown
+            self.origin -= prepend
+            self.n_days += prepend
+
+    def _trim(self):
+        """Drops days beyond the retention window once it is overrun by a quarter."""
+        excess = self.n_days - self.retention_days
+        if excess > self.retention_days // 4:
+            self.counts[:self.n_days - excess] = self.counts[excess:self.n_days]
+            self.counts[self.n_days - excess:self.n_days] = 0
+            self.origin += excess
+            self.n_days -= excess
+
+    # --- Forecasts ---
+
+    def forecast(self, days: int = 7, department: Optional[str] = None, hourly: bool = False) -> List[dict]:
+        """
+        Daily forecast for the next `days` days (today included), for one
+        department or all. With `hourly`, each day also carries the expected
+        count per hour. Raises KeyError for an unknown department.
+        """
+        if not 1 <= days <= self.max_days:
+            raise ValueError(f"days must be between 1 and {self.max_days}")
+        self.refresh()
+        if department is not None and department not in self._department_index:
+            raise KeyError(department)
+
+        forecast = self._current_forecast()
+        if forecast is None:
+            return []
+        key = (days, department, hourly)
+        response = self._responses.get(key)
+        if response is None:
+            response = self._format(forecast, days, department, hourly)
+            self._responses[key] = response
+        return response
+
+    def _today(self) -> int:
+        return int((time.time() + self.utc_offset_minutes * 60) // 86400)
+
+    def _current_forecast(self) -> Optional[dict]:
+        today = self._today()
+        cached = self._forecast
+        if cached is not None and cached[0] == self.version and cached[1] == today:
+            return cached[2]
+        with self._lock:
+            if self.origin is None:
+                return None
+            with timed("inflow_forecast"):
+                arrays = self._compute(today)
+            self._forecast = (self.version, today, arrays)
+            self._responses = {}
+        return arrays
+
+    def _compute(self, today: int) -> Optional[dict]:
+        """Forecasts every department and the total for `max_days` days from today (lock held)."""
+        # Fit on complete days only: not today, not scheduled (future) appointments
+        end = min(today - self.origin, self.n_days)  # Exclusive, in cube rows
+        if end <= 0:
+            return None
+        window = min(self.history_weeks * 7, end)
+        if window >= 7:
+            window -= window % 7
+        cube = self.counts[end - window:end].astype(np.float64)  # window x 24 x departments
+        daily = cube.sum(axis=1)
+        series = np.column_stack([daily.sum(axis=1), daily])    # Column 0 is the total
+
+        last_day = self.origin + end - 1
+        steps = np.arange(today - last_day, today - last_day + self.max_days)
+        mean, lower, upper = seasonal_trend_forecast(series, int(weekday(last_day)), steps)
+
+        # Hour-of-day shares per weekday from the same window
+        by_hour = np.concatenate([cube.sum(axis=2, keepdims=True), cube], axis=2)
+        row_weekday = weekday(np.arange(last_day - window + 1, last_day + 1))
+        profile = np.zeros((7, 24, series.shape[1]))
+        np.add.at(profile, row_weekday, by_hour)
+        totals = profile.sum(axis=1, keepdims=True)
+        overall = by_hour.sum(axis=0)
+        overall = overall / np.maximum(overall.sum(axis=0, keepdims=True), 1)
+        shares = np.where(totals > 0, profile / np.maximum(totals, 1), overall[None])
+
+        return {
+            'days': today + np.arange(self.max_days),
+            'mean': mean, 'lower': lower, 'upper': upper,
+            'hour_shares': shares,
+            'columns': {None: 0, **{d: i + 1 for i, d in enumerate(self.departments)}},
+        }
+
+    @staticmethod
+    def _format(forecast: dict, days: int, department: Optional[str], hourly: bool) -> List[dict]:
+        column = forecast['columns'][department]
+        result = []
+        for i in range(days):
+            day = int(forecast['days'][i])
+            mean = float(forecast['mean'][i, column])
+            item = {
+                'date': datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%Y-%m-%d'),
+                'day': WEEKDAYS[weekday(day)],
+                'predicted_count': int(round(mean)),
+                'lower': int(np.floor(forecast['lower'][i, column])),
+                'upper': int(np.ceil(forecast['upper'][i, column])),
+            }
+            if hourly:
+                item['hourly'] = np.round(mean * forecast['hour_shares'][weekday(day), :, column], 2).tolist()
+            result.append(item)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            'events': self.events,
+            'days': self.n_days,
+            'departments': len(self.departments),
+            'first_day': self._date(self.origin) if self.origin is not None else None,
+            'last_day': self._date(self.origin + self.n_days - 1) if self.n_days else None,
+            'version': self.version,
+        }
+
+    @staticmethod
+    def _date(day: int) -> str:
+        return datetime.fromtimestamp(day * 86400, timezone.utc).strftime('%Y-%m-%d')
+
+    # --- Persistence ---
+
+    def _state_matches(self, meta: dict) -> bool:
+        return (
+            meta.get('format') == AGGREGATES_VERSION
+            and meta.get('source') == getattr(self.source, 'path', None)
+            and meta.get('utc_offset_minutes') == self.utc_offset_minutes
+        )
+
+    def _load_state(self):
+        if not self.state_dir:
+            return
+        meta_path = os.path.join(self.state_dir, META_FILE)
+        if not os.path.exists(meta_path):
+            return
+        try:
+            # Other workers may be saving: read the cube and metadata as one pair
+            with file_lock(os.path.join(self.state_dir, STATE_LOCK_FILE)):
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+                if not self._state_matches(meta):
+                    logger.warning("Inflow aggregates are for another source or format, rebuilding")
+                    return
+                counts = np.load(os.path.join(self.state_dir, AGGREGATES_FILE))
+            if counts.shape[2] != len(meta['departments']):
+                raise ValueError("departments and aggregates disagree")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable inflow aggregates: {e}")
+            return
+        self.counts = counts.astype(np.int32)
+        self.n_days = counts.shape[0]
+        self.origin = meta['origin']
+        self.departments = list(meta['departments'])
+        self._department_index = {d: i for i, d in enumerate(self.departments)}
+        self.events = meta['events']
+        self._cursor = meta['cursor']
+
+    def _save_state(self):
+        """Writes the cube then the metadata (with the source cursor), each atomically."""
+        if not self.state_dir:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+        with self._lock:
+            counts = self.counts[:self.n_days].copy()
+            meta = {
+                'format': AGGREGATES_VERSION,
+                'source': getattr(self.source, 'path', None),
+                'utc_offset_minutes': self.utc_offset_minutes,
+                'origin': self.origin,
+                'departments': list(self.departments),
+                'events': self.events,
+                'cursor': self._cursor,
+            }
+        tmp_suffix = f".{os.getpid()}.tmp"
+        counts_path = os.path.join(self.state_dir, AGGREGATES_FILE)
+        meta_path = os.path.join(self.state_dir, META_FILE)
+        with file_lock(os.path.join(self.state_dir, STATE_LOCK_FILE)):
+            with open(counts_path + tmp_suffix, 'wb') as f:
+                np.save(f, counts)
+            with open(meta_path + tmp_suffix, 'w') as f:
+                json.dump(meta, f)
+            os.replace(counts_path + tmp_suffix, counts_path)
+            os.replace(meta_path + tmp_suffix, meta_path)
+
+
+def open_event_source(path: str, table: str = 'events'):
+    """CsvEventSource or SqliteEventSource by file extension."""
+    if path.lower().endswith(('.db', '.sqlite', '.sqlite3')):
+        return SqliteEventSource(path, table)
+    return CsvEventSource(path)
@@ -0,0 +1,358 @@
+import logging
+import os
+import json
+import time
+import random
+import socket
+import sqlite3
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job states (mirroring the backend's document statuses where they overlap)
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+RETRYING = "RETRYING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+
+ACTIVE_STATES = (QUEUED, RUNNING, RETRYING)
+
+
+class QueueFullError(Exception):
+    """Raised by `submit` when the backlog is at capacity."""
+
+
+class PermanentJobError(Exception):
+    """Raised by a job handler for failures that retrying cannot fix."""
+
+
+class DocumentJobQueue:
+    """
+    SQLite-backed document processing queue.
+
+    Jobs are keyed by document id, so re-submitting a document that is still
+    waiting only refreshes its payload; re-submitting one that is running
+    queues the new payload as a follow-up run once the current run ends. A
+    fixed pool of worker threads claims due jobs, runs `handler(payload)` and
+    retries failures with exponential backoff. Jobs survive restarts: anything
+    left RUNNING by a dead process is put back in the queue when the next
+    process starts (or when its lease expires). Every claim gets its own
+    token, so a worker whose lease expired cannot overwrite the status of the
+    run that re-claimed the job.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        handler: Callable[[dict], None],
+        on_failure: Optional[Callable[[str, dict, str], None]] = None,
+        workers: int = 2,
+        max_backlog: int = 1000,
+        max_attempts: int = 5,
+        retry_base_delay: float = 5.0,
+        retry_max_delay: float = 600.0,
+        lease_seconds: float = 900.0,
+        poll_interval: float = 2.0,
+    ):
+        self.db_path = db_path
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                document_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_run_at REAL NOT NULL,
+                lease_until REAL,
+                owner TEXT,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                claim_id TEXT,
+                follow_up_payload TEXT
+            )
+            """
+        )
+        # Databases created before claim tokens and follow-up runs
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column in ("claim_id", "follow_up_payload"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, next_run_at)")
+
+    # --- Lifecycle ---
+
+    def start(self):
+        self._recover_orphans()
+        self._stopping.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"doc-job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"Job queue started with {self.workers} workers ({self.db_path})")
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _recover_orphans(self):
+        """Requeues RUNNING jobs whose owning process on this host is gone."""
+        host = socket.gethostname()
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute("SELECT document_id, owner FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+            for row in rows:
+                owner_host, _, owner_pid = (row["owner"] or "").rpartition(":")
+                if owner_host != host or not self._is_stale_pid(owner_pid):
+                    continue
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, next_run_at = ?, lease_until = NULL, owner = NULL, updated_at = ? WHERE document_id = ?",
+                    (QUEUED, now, now, row["document_id"]),
+                )
+                logger.info(f"Requeued interrupted job for doc: {row['document_id']}")
+
+    @staticmethod
+    def _is_stale_pid(pid: str) -> bool:
+        try:
+            pid = int(pid)
+        except ValueError:
+            return True
+        if pid == os.getpid():
+            return True  # We are just starting, so nothing can be ours yet
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+    # --- Producer API ---
+
+    def submit(self, document_id: str, payload: dict) -> dict:
+        """
+        Enqueues a job. A job already waiting for the same document is updated
+        in place; if one is running, the payload is kept as its follow-up and
+        queued when that run ends (a later re-submit replaces it). Raises
+        QueueFullError when the backlog is at `max_backlog`.
+        """
+        now = time.time()
+        data = json.dumps(payload)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT status FROM jobs WHERE document_id = ?", (document_id,)).fetchone()
+                if row and row["status"] in (QUEUED, RETRYING):
+                    self._conn.execute(
+                        "UPDATE jobs SET payload = ?, updated_at = ? WHERE document_id = ?",
+                        (data, now, document_id),
+                    )
+                    self._conn.execute("COMMIT")
+                    return self._row_to_dict(self._fetch(document_id), deduplicated=True)
+                if row and row["status"] == RUNNING:
+                    self._conn.execute(
+                        "UPDATE jobs SET follow_up_payload = ?, updated_at = ? WHERE document_id = ?",
+                        (data, now, document_id),
+                    )
+                    self._conn.execute("COMMIT")
+                    return self._row_to_dict(self._fetch(document_id))
+
+                backlog = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?, ?)", ACTIVE_STATES
+                ).fetchone()[0]
+                if backlog >= self.max_backlog:
+                    self._conn.execute("ROLLBACK")
+                    raise QueueFullError(f"Processing backlog is full ({backlog} jobs), retry later")
+
+                self._conn.execute(
+                    """
+                    INSERT INTO jobs (document_id, payload, status, attempts, next_run_at, created_at, updated_at)
+                    VALUES (?, ?, ?, 0, ?, ?, ?)
+                    ON CONFLICT(document_id) DO UPDATE SET
+                        payload = excluded.payload, status = excluded.status, attempts = 0,
+                        next_run_at = excluded.next_run_at, lease_until = NULL, owner = NULL,
+                        last_error = NULL, updated_at = excluded.updated_at, claim_id = NULL, follow_up_payload = NULL
+                    """,
+                    (document_id, data, QUEUED, now, now, now),
+                )
+                self._conn.execute("COMMIT")
+            except QueueFullError:
+                raise
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        with self._wakeup:
+            self._wakeup.notify()
+        return self.get(document_id)
+
+    def get(self, document_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._fetch(document_id)
+        return self._row_to_dict(row) if row else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def _fetch(self, document_id: str):
+        return self._conn.execute("SELECT * FROM jobs WHERE document_id = ?", (document_id,)).fetchone()
+
+    @staticmethod
+    def _row_to_dict(row, deduplicated: bool = False) -> dict:
+        return {
+            "document_id": row["document_id"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "next_run_at": row["next_run_at"] if row["status"] in (QUEUED, RETRYING) else None,
+            "last_error": row["last_error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "deduplicated": deduplicated,
+            "follow_up_queued": row["follow_up_payload"] is not None,
+        }
+
+    # --- Workers ---
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT * FROM jobs
+                    WHERE (status IN (?, ?) AND next_run_at <= ?)
+                       OR (status = ? AND lease_until < ?)
+                    ORDER BY next_run_at LIMIT 1
+                    """,
+                    (QUEUED, RETRYING, now, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, owner = ?, claim_id = ?, updated_at = ? WHERE document_id = ?",
+                    (RUNNING, now + self.lease_seconds, self.owner, uuid.uuid4().hex, now, row["document_id"]),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._fetch(row["document_id"])
+
+    def _next_due_in(self) -> float:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_run_at) FROM jobs WHERE status IN (?, ?)", (QUEUED, RETRYING)
+            ).fetchone()
+        if row[0] is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, row[0] - time.time()))
+
+    def _finish(self, row: sqlite3.Row, status: str, error: Optional[str] = None, next_run_at: Optional[float] = None) -> Optional[str]:
+        """
+        Records the outcome of the claimed run `row` and returns the status
+        stored: `status`, or QUEUED if a follow-up payload was submitted
+        meanwhile (it replaces the outcome as a fresh job). Returns None, and
+        changes nothing, if the run no longer holds the job because its lease
+        expired and the job was claimed again.
+        """
+        now = time.time()
+        with self._lock:
+            current = self._conn.execute(
+                "SELECT follow_up_payload FROM jobs WHERE document_id = ? AND status = ? AND claim_id = ?",
+                (row["document_id"], RUNNING, row["claim_id"]),
+            ).fetchone()
+            if current is None:
+                logger.warning(f"Job for doc {row['document_id']} lost its lease to another run, discarding its {status} result")
+                return None
+            if current["follow_up_payload"] is not None:
+                status = QUEUED
+                self._conn.execute(
+                    """
+                    UPDATE jobs SET status = ?, payload = follow_up_payload, follow_up_payload = NULL, attempts = 0, last_error = NULL,
+                        next_run_at = ?, lease_until = NULL, owner = NULL, claim_id = NULL, updated_at = ? WHERE document_id = ?
+                    """,
+                    (QUEUED, now, now, row["document_id"]),
+                )
+            else:
+                self._conn.execute(
+                    """
+                    UPDATE jobs SET status = ?, last_error = ?, next_run_at = ?, lease_until = NULL, owner = NULL, claim_id = NULL,
+                        updated_at = ? WHERE document_id = ?
+                    """,
+                    (status, error, next_run_at if next_run_at is not None else now, now, row["document_id"]),
+                )
+        if status == QUEUED:
+            with self._wakeup:
+                self._wakeup.notify()
+        return status
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max_delay, self.retry_base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                logger.warning(f"Job queue claim failed: {e}")
+                row = None
+
+            if row is None:
+                with self._wakeup:
+                    self._wakeup.wait(self._next_due_in())
+                continue
+
+            document_id = row["document_id"]
+            payload = json.loads(row["payload"])
+            attempts = row["attempts"]
+            try:
+                self.handler(payload)
+                self._finish(row, COMPLETED)
+            except Exception as e:
+                retryable = not isinstance(e, PermanentJobError) and attempts < self.max_attempts
+                if retryable:
+                    delay = self._backoff(attempts)
+                    logger.warning(f"Job for doc {document_id} failed (attempt {attempts}/{self.max_attempts}), retrying in {delay:.0f}s: {e}")
+                    self._finish(row, RETRYING, str(e), time.time() + delay)
+                    continue
+
+                logger.error(f"Job for doc {document_id} failed permanently: {e}")
+                if self._finish(row, FAILED, str(e)) != FAILED:
+                    continue  # Superseded by a newer run, which reports its own outcome
+                if self.on_failure:
+                    try:
+                        self.on_failure(document_id, payload, str(e))
+                    except Exception as cb_error:
+                        logger.warning(f"Failure callback for doc {document_id} failed: {cb_error}")
@@ -0,0 +1,138 @@
+import logging
+import os
+import json
+import hashlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.embedding_index import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout or record text format changes
+SNAPSHOT_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+EMBEDDINGS_FILE = 'embeddings.npy'
+
+
+def record_text(item: dict) -> str:
+    """The text that is embedded for one MedQuAD record."""
+    return f"Question: {item['question']}\nAnswer: {item['answer']}"
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_snapshot(snapshot_dir: str, mmap: bool = True) -> Optional[Tuple[dict, np.ndarray]]:
+    """Returns (manifest, embedding matrix) or None if there is no usable snapshot."""
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    embeddings_path = os.path.join(snapshot_dir, EMBEDDINGS_FILE)
+    if not (os.path.exists(manifest_path) and os.path.exists(embeddings_path)):
+        return None
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring knowledge base snapshot v{manifest.get('version')} (expected v{SNAPSHOT_VERSION})")
+            return None
+        matrix = np.load(embeddings_path, mmap_mode='r' if mmap else None)
+        if matrix.shape[0] != len(manifest['records']):
+            logger.warning("Ignoring knowledge base snapshot: manifest and embeddings disagree")
+            return None
+        return manifest, matrix
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable knowledge base snapshot: {e}")
+        return None
+
+
+def write_snapshot(snapshot_dir: str, manifest: dict, matrix: np.ndarray):
+    """Writes embeddings then manifest, each atomically, so readers never see a mix."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    embeddings_path = os.path.join(snapshot_dir, EMBEDDINGS_FILE)
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    tmp_suffix = f".{os.getpid()}.tmp"
+
+    with open(embeddings_path + tmp_suffix, 'wb') as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+    with open(manifest_path + tmp_suffix, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(embeddings_path + tmp_suffix, embeddings_path)
+    os.replace(manifest_path + tmp_suffix, manifest_path)
+
+
+def sync_snapshot(
+    source_path: str,
+    snapshot_dir: str,
+    embed_fn: Callable[[List[str]], List[List[float]]],
+    embedding_model: str,
+    persist: bool = True,
+) -> Tuple[List[dict], np.ndarray, int]:
+    """
+    Brings the snapshot in line with the source JSON.
+
+    When the source hash matches the snapshot nothing is embedded and the matrix
+    stays memory-mapped. Otherwise only records whose text is new or changed are
+    passed to `embed_fn`; the rest are copied from the previous snapshot.
+    Returns (records, float32 matrix, number of records embedded).
+    """
+    source_hash = file_sha256(source_path)
+    existing = load_snapshot(snapshot_dir)
+
+    if existing is not None:
+        manifest, matrix = existing
+        if manifest['source_sha256'] == source_hash and manifest['embedding_model'] == embedding_model:
+            return manifest['records'], matrix, 0
+
+    with open(source_path, 'r') as f:
+        data = json.load(f)
+
+    records = []
+    for item in data:
+        text = record_text(item)
+        records.append({'id': item['id'], 'text': text, 'hash': content_hash(text)})
+
+    # Reuse rows of the previous snapshot whose text is unchanged
+    previous_rows: Dict[str, int] = {}
+    previous_matrix = None
+    if existing is not None and existing[0]['embedding_model'] == embedding_model:
+        previous_matrix = existing[1]
+        previous_rows = {r['hash']: i for i, r in enumerate(existing[0]['records'])}
+
+    if not records:
+        return [], np.zeros((0, 0), dtype=np.float32), 0
+
+    to_embed = [i for i, r in enumerate(records) if r['hash'] not in previous_rows]
+    new_embeddings = embed_fn([records[i]['text'] for i in to_embed]) if to_embed else []
+    if len(new_embeddings) != len(to_embed):
+        raise ValueError(f"Got {len(new_embeddings)} embeddings for {len(to_embed)} records")
+
+    dim = len(new_embeddings[0]) if new_embeddings else previous_matrix.shape[1]
+    matrix = np.empty((len(records), dim), dtype=np.float32)
+    for i, r in enumerate(records):
+        if r['hash'] in previous_rows:
+            matrix[i] = previous_matrix[previous_rows[r['hash']]]
+    if to_embed:
+        matrix[to_embed] = np.asarray(new_embeddings, dtype=np.float32)
+
+    if persist:
+        manifest = {
+            'version': SNAPSHOT_VERSION,
+            'embedding_model': embedding_model,
+            'source_sha256': source_hash,
+            'dim': dim,
+            'records': records,
+        }
+        write_snapshot(snapshot_dir, manifest, matrix)
+        # Re-open memory-mapped so the in-memory copy can be released
+        reloaded = load_snapshot(snapshot_dir)
+        if reloaded is not None:
+            matrix = reloaded[1]
+
+    return records, matrix, len(to_embed)
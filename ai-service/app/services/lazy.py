@@ -0,0 +1,59 @@
+import logging
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class LazyService(Generic[T]):
+    """
+    Builds a service on first use instead of at import time.
+
+    `factory` should import its heavy dependencies itself, so that neither the
+    SDKs nor the models are loaded until a request (or the warm-up hook) needs
+    them. Construction is thread-safe and happens at most once; a failed build
+    is retried on the next `get()`.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self._factory = factory
+        self._instance: Optional[T] = None
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> T:
+        instance = self._instance
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._instance is None:
+                start = time.perf_counter()
+                try:
+                    self._instance = self._factory()
+                except Exception as e:
+                    self.last_error = str(e)
+                    raise
+                self.load_seconds = time.perf_counter() - start
+                self.last_error = None
+                logger.info(f"Initialized {self.name} in {self.load_seconds:.2f}s")
+            return self._instance
+
+    def peek(self) -> Optional[T]:
+        """The instance if it has been built, without building it."""
+        return self._instance
+
+    def status(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "error": self.last_error,
+        }
@@ -1,131 +1,309 @@
 import google.generativeai as genai
+import logging
 import os
 import json
-import math
+from typing import Callable, Iterator, List, Optional
+import hashlib
+from contextlib import nullcontext
+from app.services.file_lock import file_lock
+from app.services.kb_snapshot import sync_snapshot
+from app.services.shared_arrays import shared_arrays
+from app.services.vector_search import VectorIndex
+from app.services.response_cache import SemanticResponseCache
+from app.services.metrics import RETRIEVALS, timed
+from app.services.gemini_gateway import GeminiGateway, background, get_gateway
+from app.services.bm25 import RETRIEVAL_MODES, RRF_K, BM25Index, reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../data')
+CHAT_ERROR_MESSAGE = "I encountered an error processing your query. Please try again."
 
 class MedRagService:
-    def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        data_path: Optional[str] = None,
+        snapshot_dir: Optional[str] = None,
+        autoload: bool = True,
+        index_dtype: str = 'float32',
+        ivf_lists: int = 0,
+        ivf_probes: int = 8,
+        response_cache: Optional[SemanticResponseCache] = None,
+        retrieval_mode: str = 'hybrid',
+        lexical_weight: float = 1.0,
+        fusion_candidates: int = 20,
+        gateway: Optional[GeminiGateway] = None,
+        shared_dir: Optional[str] = None
+    ):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {retrieval_mode}, expected one of {RETRIEVAL_MODES}")
+        # Rate limits, adaptive concurrency and retries shared with the other services
+        self.gateway = gateway or get_gateway()
+        self.gateway.configure(api_key)
         self.embedding_model = "models/text-embedding-004"
-        self.gen_model = genai.GenerativeModel('gemini-2.5-flash')
-        
+        self.gen_model_name = 'gemini-2.5-flash'
+        self.gen_model = genai.GenerativeModel(self.gen_model_name)
+        self.data_path = data_path or os.path.join(DATA_DIR, 'medquad_sample.json')
+        self.snapshot_dir = snapshot_dir or os.path.join(DATA_DIR, 'medquad_snapshot')
+
+        # Retrieval index settings: quantization ('float32', 'float16', 'int8') and IVF lists (0 = exact)
+        self.index_dtype = index_dtype
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        # Built retrieval index memory-mapped from here and shared by all workers; None builds a private copy
+        self.shared_dir = shared_dir
+        # Answers to repeated questions; keyed on the knowledge base version
+        self.response_cache = response_cache
+        self.kb_version = ""
+        # Retrieval mode (see RETRIEVAL_MODES in app/services/bm25.py)
+        self.retrieval_mode = retrieval_mode
+        self.lexical_weight = lexical_weight
+        self.fusion_candidates = fusion_candidates
+        self.lexical = BM25Index()  # Row-aligned with self.documents
+
         # In-Memory Knowledge Base
-        self.documents = []  # List of {'id', 'text', 'embedding'}
-        self.load_knowledge_base()
+        self.documents = []  # List of {'id', 'text'}, row-aligned with self.index
+        self.index = None
+        if autoload:
+            self.load_knowledge_base()
+
+    def embed_documents(self, texts: List[str], batch_size: int = 100) -> List[List[float]]:
+        """Embeds texts in API-sized batches, falling back to one call per text."""
+        embeddings = []
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i:i + batch_size]
+            try:
+                result = self.gateway.call(
+                    "embed", self.embedding_model,
+                    lambda: genai.embed_content(model=self.embedding_model, content=batch, task_type="retrieval_document"),
+                    batch, lambda r: r['embedding']
+                )
+                embeddings.extend(result['embedding'])
+            except Exception as e:
+                logger.warning(f"Batch embedding failed, trying individual: {e}")
+                for text in batch:
+                    res = self.gateway.call(
+                        "embed", self.embedding_model,
+                        lambda: genai.embed_content(model=self.embedding_model, content=text, task_type="retrieval_document"),
+                        text, lambda r: r['embedding']
+                    )
+                    embeddings.append(res['embedding'])
+        return embeddings
 
     def load_knowledge_base(self):
-        """Loads and embeds the simulated dataset into memory."""
+        """
+        Loads the knowledge base from its embedding snapshot (memory-mapped).
+        Only records that are new or changed since the snapshot are embedded;
+        build it offline with `python app/ml/build_kb_snapshot.py`.
+        """
         try:
-            file_path = os.path.join(os.path.dirname(__file__), '../data/medquad_sample.json')
-            if not os.path.exists(file_path):
-                print(f"Warning: Data file not found at {file_path}")
+            if not os.path.exists(self.data_path):
+                logger.warning(f"Data file not found at {self.data_path}")
                 return
 
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-
-            print(f"Loading {len(data)} medical records into memory...")
-            
-            # Prepare batch for embedding to save API calls
-            texts_to_embed = [f"Question: {item['question']}\nAnswer: {item['answer']}" for item in data]
-            
-            # Generate Embeddings (Batch)
-            # Note: Gemini batch embedding might have limits, for small sample it's fine.
-            # If large, we would chunk this loop.
-            try:
-                result = genai.embed_content(
-                    model=self.embedding_model,
-                    content=texts_to_embed,
-                    task_type="retrieval_document"
+            # Bulk embedding of new records yields to interactive calls; with
+            # shared workers only the first one embeds, the others wait and reuse its snapshot
+            with background(), file_lock(os.path.join(self.shared_dir, 'kb-sync.lock')) if self.shared_dir else nullcontext():
+                records, embeddings, embedded = sync_snapshot(
+                    self.data_path,
+                    self.snapshot_dir,
+                    self.embed_documents,
+                    self.embedding_model
                 )
-                embeddings = result['embedding']
-            except Exception as e:
-                print(f"Batch embedding failed, trying individual: {e}")
-                embeddings = []
-                for text in texts_to_embed:
-                    res = genai.embed_content(model=self.embedding_model, content=text, task_type="retrieval_document")
-                    embeddings.append(res['embedding'])
+            logger.info(f"Loaded {len(records)} medical records ({embedded} embedded, {len(records) - embedded} from snapshot)")
 
             # Store in memory
-            for i, item in enumerate(data):
-                self.documents.append({
-                    'id': item['id'],
-                    'text': texts_to_embed[i],
-                    'embedding': embeddings[i]
-                })
-            
-            print("Med-Secure AI Knowledge Base Ready.")
+            self.documents = [{'id': record['id'], 'text': record['text']} for record in records]
+            self.kb_version = hashlib.sha256("".join(record['hash'] for record in records).encode('utf-8')).hexdigest()[:16]
+            self.index = self.build_index(embeddings)
+            self.lexical = BM25Index()
+            self.lexical.add([doc['text'] for doc in self.documents])
+            logger.info(f"Retrieval index: {self.index.size} x {self.index.dim} {self.index_dtype}, {self.index.nbytes / 1e6:.1f} MB")
+
+            logger.info("Med-Secure AI Knowledge Base Ready.")
 
         except Exception as e:
-            print(f"Error loading knowledge base: {e}")
+            logger.error(f"Error loading knowledge base: {e}")
 
-    def cosine_similarity(self, v1, v2):
-        """Pure Python Cosine Similarity (No Numpy needed)"""
-        dot_product = sum(a*b for a, b in zip(v1, v2))
-        magnitude_v1 = math.sqrt(sum(a*a for a in v1))
-        magnitude_v2 = math.sqrt(sum(a*a for a in v2))
-        if magnitude_v1 == 0 or magnitude_v2 == 0:
-            return 0.0
-        return dot_product / (magnitude_v1 * magnitude_v2)
+    def build_index(self, embeddings) -> VectorIndex:
+        """The retrieval index; with `shared_dir` it is built once per knowledge base version and memory-mapped."""
+        if not self.shared_dir:
+            return VectorIndex(embeddings, dtype=self.index_dtype, nlist=self.ivf_lists, nprobe=self.ivf_probes)
+        key = hashlib.sha256(f"{self.kb_version}:{self.embedding_model}:{self.index_dtype}:{self.ivf_lists}".encode('utf-8')).hexdigest()[:16]
+        arrays = shared_arrays(
+            os.path.join(self.shared_dir, f"kb-index-{key}"),
+            lambda: VectorIndex(embeddings, dtype=self.index_dtype, nlist=self.ivf_lists).to_arrays(),
+            prune_prefix="kb-index-"
+        )
+        return VectorIndex.from_arrays(arrays, nprobe=self.ivf_probes)
 
-    def retrieve_context(self, question: str, top_k: int = 3) -> str:
+    def embed_query(self, question: str):
+        q_res = self.gateway.call(
+            "embed", self.embedding_model,
+            lambda: genai.embed_content(model=self.embedding_model, content=question, task_type="retrieval_query"),
+            question, lambda r: r['embedding']
+        )
+        return q_res['embedding']
+
+    def search_lexical(self, question: str, top_k: int = 3):
+        """(record rows, scores scaled to the best hit) from BM25 alone."""
+        with timed("retrieve_lexical"):
+            ids, scores = self.lexical.search(question, k=top_k)
+        if len(scores):
+            scores = scores / scores[0]
+        return list(ids), list(scores)
+
+    def search(self, question: str, top_k: int = 3):
+        """
+        Returns (query embedding or None, record rows, scores) of the top_k
+        records using the configured retrieval mode. Without a usable
+        embedding (lexical modes, API failure) the embedding is None.
+        """
+        mode = self.retrieval_mode
+
+        # 1. Lexical fast path: no embedding call
+        if mode in ('lexical', 'auto') and self.lexical.size:
+            with timed("retrieve_lexical"):
+                ids, scores = self.lexical.search(question, k=top_k)
+            if mode == 'lexical' or self.lexical.keywords_suffice(question, ids):
+                RETRIEVALS.inc(service="med_rag", mode="lexical")
+                return None, list(ids), list(scores / scores[0]) if len(scores) else []
+
+        # 2. Embed Query (BM25 only if the embedding API is unavailable)
         try:
-            # 1. Embed Query
-            q_res = genai.embed_content(
-                model=self.embedding_model,
-                content=question,
-                task_type="retrieval_query"
-            )
-            q_emb = q_res['embedding']
-
-            # 2. Score Documents
-            scored_docs = []
-            for doc in self.documents:
-                score = self.cosine_similarity(q_emb, doc['embedding'])
-                scored_docs.append((score, doc['text']))
-
-            # 3. Sort and Top-K
-            scored_docs.sort(key=lambda x: x[0], reverse=True)
-            top_results = scored_docs[:top_k]
-
-            # 4. Format Context
-            context = ""
-            for i, (score, text) in enumerate(top_results):
-                context += f"Source {i+1} (Relevance: {score:.2f}):\n{text}\n\n"
-            
-            return context
+            q_emb = self.embed_query(question)
+        except Exception as e:
+            if not self.lexical.size:
+                raise e
+            logger.warning(f"MedRAG query embedding failed, falling back to BM25: {e}")
+            RETRIEVALS.inc(service="med_rag", mode="lexical_fallback")
+            ids, scores = self.search_lexical(question, top_k)
+            return None, ids, scores
+        if self.index is None:
+            return q_emb, [], []
 
+        # 3. Score Documents & Top-K
+        if mode == 'dense' or not self.lexical.size:
+            with timed("retrieve"):
+                ids, scores = self.index.search(q_emb, k=top_k)
+            RETRIEVALS.inc(service="med_rag", mode="dense")
+            return q_emb, list(ids), list(scores)
+
+        # 4. Hybrid: fuse dense and BM25 candidates by rank; relevance is the
+        #    fused score relative to a record ranked first by both
+        with timed("retrieve"):
+            dense_ids, _ = self.index.search(q_emb, k=self.fusion_candidates)
+        with timed("retrieve_lexical"):
+            lexical_ids, _ = self.lexical.search(question, k=self.fusion_candidates)
+        weights = [1.0, self.lexical_weight]
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids], weights)[:top_k]
+        best_possible = sum(weights) / (RRF_K + 1)
+        RETRIEVALS.inc(service="med_rag", mode="hybrid")
+        return q_emb, [row for row, _ in fused], [score / best_possible for _, score in fused]
+
+    def format_context(self, ids, scores) -> str:
+        context = ""
+        for i, (row, score) in enumerate(zip(ids, scores)):
+            context += f"Source {i+1} (Relevance: {float(score):.2f}):\n{self.documents[row]['text']}\n\n"
+        return context
+
+    def retrieve_context(self, question: str, top_k: int = 3) -> str:
+        try:
+            _, ids, scores = self.search(question, top_k)
+            return self.format_context(ids, scores)
         except Exception as e:
-            print(f"MedRAG Retrieval Error: {e}")
+            logger.error(f"MedRAG Retrieval Error: {e}")
             return ""
 
+    def _plan_chat(self, question: str):
+        """
+        Steps before generation. Returns (answer, None, None) for a cached
+        answer, else (None, prompt, store) where store(answer) caches the
+        generated answer.
+        """
+        # 0. Repeated question: no embedding or generation needed
+        if self.response_cache:
+            cached = self.response_cache.get_exact(self.kb_version, question)
+            if cached is not None:
+                return cached, None, None
+
+        # 1. Retrieve
+        q_emb, ids, scores = None, [], []
+        try:
+            q_emb, ids, scores = self.search(question)
+        except Exception as e:
+            logger.error(f"MedRAG Retrieval Error: {e}")
+        context = self.format_context(ids, scores)
+
+        # 1b. Paraphrased question that retrieved the same records
+        context_key = f"{self.kb_version}:{','.join(str(self.documents[row]['id']) for row in ids)}"
+        if self.response_cache and q_emb is not None:
+            cached = self.response_cache.get_similar(context_key, q_emb)
+            if cached is not None:
+                return cached, None, None
+
+        # 2. Guardrails & System Prompt
+        system_instruction = (
+            "You are 'Med-Secure AI', a specialized medical assistant trained on MedQuAD data. "
+            "Your goal is to provide helpful, accurate medical information based ONLY on the provided context.\n\n"
+            "SAFETY GUARDRAILS (STRICTLY ENFORCED):\n"
+            "1. DO NOT provide specific medical prescriptions or dosages unless explicitly stated in the context.\n"
+            "2. DO NOT make definitive diagnoses. Always frame answers as 'common symptoms include...' or 'this may suggest...'.\n"
+            "3. ALWAYS advise the user to consult a qualified doctor for serious concerns.\n"
+            "4. If the user asks about a topic NOT in the context, politely decline to answer, stating it is out of your training scope.\n\n"
+            "DISCLAIMER: This is AI-generated information and not a substitute for professional medical advice."
+        )
+
+        prompt = (
+            f"{system_instruction}\n\n"
+            f"Retrieved Context:\n{context}\n\n"
+            f"User Question: {question}"
+        )
+
+        def store(answer: str):
+            if self.response_cache:
+                self.response_cache.put(self.kb_version, question, context_key, q_emb, answer)
+        return None, prompt, store
+
     def chat(self, question: str) -> str:
         try:
-            # 1. Retrieve
-            context = self.retrieve_context(question)
-            
-            # 2. Guardrails & System Prompt
-            system_instruction = (
-                "You are 'Med-Secure AI', a specialized medical assistant trained on MedQuAD data. "
-                "Your goal is to provide helpful, accurate medical information based ONLY on the provided context.\n\n"
-                "SAFETY GUARDRAILS (STRICTLY ENFORCED):\n"
-                "1. DO NOT provide specific medical prescriptions or dosages unless explicitly stated in the context.\n"
-                "2. DO NOT make definitive diagnoses. Always frame answers as 'common symptoms include...' or 'this may suggest...'.\n"
-                "3. ALWAYS advise the user to consult a qualified doctor for serious concerns.\n"
-                "4. If the user asks about a topic NOT in the context, politely decline to answer, stating it is out of your training scope.\n\n"
-                "DISCLAIMER: This is AI-generated information and not a substitute for professional medical advice."
-            )
-
-            prompt = (
-                f"{system_instruction}\n\n"
-                f"Retrieved Context:\n{context}\n\n"
-                f"User Question: {question}"
-            )
+            answer, prompt, store = self._plan_chat(question)
+            if prompt is None:
+                return answer
 
             # 3. Generate
-            response = self.gen_model.generate_content(prompt)
+            response = self.gateway.call("generate", self.gen_model_name, lambda: self.gen_model.generate_content(prompt), prompt, lambda r: r.text)
+            store(response.text)
             return response.text
 
         except Exception as e:
-            print(f"MedChat Error: {e}")
-            return "I encountered an error processing your query. Please try again."
+            logger.error(f"MedChat Error: {e}")
+            return CHAT_ERROR_MESSAGE
+
+    def chat_stream(self, question: str) -> Iterator[str]:
+        """
+        chat with a streamed answer: retrieval runs now, generation as the
+        returned iterator is consumed. Like chat it does not raise; a failure
+        ends the stream with the error message.
+        """
+        try:
+            answer, prompt, store = self._plan_chat(question)
+        except Exception as e:
+            logger.error(f"MedChat Error: {e}")
+            return iter([CHAT_ERROR_MESSAGE])
+        if prompt is None:
+            return iter([answer])
+        return self._stream_generation(prompt, store)
+
+    def _stream_generation(self, prompt: str, store: Callable[[str], None]) -> Iterator[str]:
+        parts = []
+        try:
+            for text in self.gateway.stream("generate", self.gen_model_name, lambda: self.gen_model.generate_content(prompt, stream=True), prompt):
+                parts.append(text)
+                yield text
+        except Exception as e:
+            logger.error(f"MedChat Error: {e}")
+            yield f"\n\n{CHAT_ERROR_MESSAGE}" if parts else CHAT_ERROR_MESSAGE
+            return
+        store("".join(parts))
@@ -0,0 +1,275 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = tuple(256 * 4 ** i for i in range(10))  # 256 B .. 64 MiB
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    """Whole numbers in full (byte counts), others in %g."""
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return f"{value:g}"
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:g}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "ai_stage_duration_seconds", "Time spent in each pipeline stage.", ("stage",)))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "ai_http_request_duration_seconds", "HTTP request latency.", ("method", "route", "status")))
+GEMINI_CALLS = REGISTRY.register(Counter(
+    "ai_gemini_calls_total", "Gemini API calls.", ("call", "model", "outcome")))
+GEMINI_SECONDS = REGISTRY.register(Histogram(
+    "ai_gemini_call_duration_seconds", "Gemini API call latency.", ("call", "model")))
+GEMINI_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "ai_gemini_queue_seconds", "Time Gemini calls waited for rate limit and concurrency slots.", ("call", "priority")))
+GEMINI_RETRIES = REGISTRY.register(Counter(
+    "ai_gemini_retries_total", "Gemini calls retried after a retryable error.", ("call", "status")))
+GEMINI_THROTTLED = REGISTRY.register(Counter(
+    "ai_gemini_throttled_total", "Gemini calls rejected as overloaded (429/503).", ("call", "model", "status")))
+GEMINI_CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    "ai_gemini_concurrency_limit", "Current adaptive concurrency limit per model and call type.", ("lane",)))
+GEMINI_PAYLOAD_BYTES = REGISTRY.register(Histogram(
+    "ai_gemini_payload_bytes", "Size of Gemini request and response payloads.", ("call", "direction"), BYTES_BUCKETS))
+STREAM_FIRST_CHUNK_SECONDS = REGISTRY.register(Histogram(
+    "ai_stream_first_chunk_seconds", "Time from request to the first streamed answer chunk (perceived latency).", ("route",)))
+STREAM_SECONDS = REGISTRY.register(Histogram(
+    "ai_stream_duration_seconds", "Time from request to the end of a streamed answer.", ("route", "outcome")))
+PDF_PAGES = REGISTRY.register(Counter(
+    "ai_pdf_pages_total", "PDF pages extracted."))
+PDF_PAGES_PER_SECOND = REGISTRY.register(Histogram(
+    "ai_pdf_extract_pages_per_second", "PDF extraction throughput per document.", (), RATE_BUCKETS))
+PREDICTION_ROWS = REGISTRY.register(Counter(
+    "ai_prediction_rows_total", "Rows scored by the disease model."))
+NO_SHOW_ROWS = REGISTRY.register(Counter(
+    "ai_no_show_rows_total", "Appointments scored by the no-show model."))
+CHUNKS_EMBEDDED = REGISTRY.register(Counter(
+    "ai_chunks_embedded_total", "Document chunks sent for embedding."))
+CHUNK_EMBEDDINGS_AVOIDED = REGISTRY.register(Counter(
+    "ai_chunk_embeddings_avoided_total", "Chunk embeddings saved against the fixed 1000/200 window."))
+IMAGE_BYTES = REGISTRY.register(Counter(
+    "ai_image_bytes_total", "Image bytes uploaded and sent to the model.", ("stage",)))
+IMAGE_BYTES_SAVED = REGISTRY.register(Counter(
+    "ai_image_bytes_saved_total", "Upload bytes not sent to the model, by reason.", ("reason",)))
+IMAGE_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "ai_image_cache_lookups_total", "Image analysis cache lookups by result.", ("result",)))
+RESPONSE_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "ai_response_cache_lookups_total", "Q&A response cache lookups by result.", ("result",)))
+INFLOW_EVENTS = REGISTRY.register(Counter(
+    "ai_inflow_events_ingested_total", "Appointment/admission events added to the inflow aggregates."))
+RETRIEVALS = REGISTRY.register(Counter(
+    "ai_retrievals_total", "Context retrievals by service and the mode actually used.", ("service", "mode")))
+JOBS = REGISTRY.register(Gauge(
+    "ai_jobs", "Document jobs in the queue database by status.", ("status",)))
+SINGLE_FLIGHT_REQUESTS = REGISTRY.register(Counter(
+    "ai_single_flight_requests_total", "Requests that started a computation (leader) or joined an identical one in flight (follower).", ("route", "role")))
+
+PROCESS_MEMORY_BYTES = REGISTRY.register(Gauge(
+    "ai_process_memory_bytes", "Memory of this worker process: rss, private (anonymous) and shared (file-backed, e.g. mapped model arrays).", ("pid", "kind")))
+
+# Stage timings of the request (or job) being handled, for its structured log line
+_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("stage_timings", default=None)
+
+
+def start_timings() -> Tuple[Dict[str, float], contextvars.Token]:
+    """Starts collecting stage timings for the current request or job."""
+    timings: Dict[str, float] = {}
+    return timings, _timings.set(timings)
+
+
+def stop_timings(token: contextvars.Token):
+    _timings.reset(token)
+
+
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        # Repeated stages (e.g. several embedding batches) add up
+        timings[stage] = round(timings.get(stage, 0.0) + seconds, 4)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Times the enclosed block as `stage` (also when it raises)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def payload_bytes(payload) -> int:
+    """Approximate wire size of a Gemini request/response payload."""
+    if payload is None:
+        return 0
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload.encode('utf-8'))
+    if isinstance(payload, (list, tuple)):
+        if payload and isinstance(payload[0], float):
+            return 4 * len(payload)  # An embedding vector
+        return sum(payload_bytes(item) for item in payload)
+    if isinstance(payload, dict):
+        return sum(payload_bytes(value) for value in payload.values())
+    return 0
+
+
+@contextmanager
+def gemini_call(call: str, model: str, request=None) -> Iterator[dict]:
+    """
+    Counts and times one Gemini call, also as the `call` stage. Set
+    `info["response"]` inside the block to record the response size.
+    """
+    info = {"response": None}
+    outcome = "error"
+    start = time.perf_counter()
+    try:
+        yield info
+        outcome = "ok"
+    finally:
+        seconds = time.perf_counter() - start
+        GEMINI_CALLS.inc(call=call, model=model, outcome=outcome)
+        GEMINI_SECONDS.observe(seconds, call=call, model=model)
+        GEMINI_PAYLOAD_BYTES.observe(payload_bytes(request), call=call, direction="request")
+        if outcome == "ok":
+            GEMINI_PAYLOAD_BYTES.observe(payload_bytes(info["response"]), call=call, direction="response")
+        record_stage(call, seconds)
+
+
+def process_memory(pid="self") -> Dict[str, int]:
+    """
+    Resident memory of a process in bytes from /proc/<pid>/status: `rss`,
+    `private` (anonymous pages, which grow with every worker) and `shared`
+    (file-backed and shared memory, e.g. memory-mapped model arrays, which
+    workers share through the page cache). Empty where /proc is unavailable.
+    """
+    fields = {"VmRSS": "rss", "RssAnon": "private", "RssFile": "shared", "RssShmem": "shared"}
+    memory: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    memory[fields[name]] = memory.get(fields[name], 0) + int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return memory
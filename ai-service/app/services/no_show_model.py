@@ -0,0 +1,138 @@
+import json
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Bump when the exported layout changes
+MODEL_FORMAT = 1
+
+# Feature layout shared by app/ml/train_no_show.py and serving
+AGE_BANDS = (18, 31, 46, 61, 76)  # Band edges: <18, 18-30, 31-45, 46-60, 61-75, 76+
+GENDERS = ('male', 'female', 'other')
+APPOINTMENT_TYPES = ('checkup', 'follow-up', 'consultation', 'emergency', 'lab-test', 'procedure', 'vaccination')
+NUMERIC_FEATURES = ('log_lead_time', 'log_prior_appointments', 'prior_no_show_rate', 'first_visit')
+# Smoothed no-show rate (no_shows + a) / (appointments + b): patients without history get a/b
+HISTORY_PRIOR = (1.0, 10.0)
+
+
+def normalize_category(value) -> str:
+    """'Follow Up', 'follow_up' and ' FOLLOW-UP' all become 'follow-up'."""
+    return '-'.join(str(value or '').strip().lower().replace('_', ' ').split())
+
+
+def numeric_features(lead_time_days, prior_appointments, prior_no_shows) -> np.ndarray:
+    """(n, len(NUMERIC_FEATURES)) float64 matrix of the numeric features."""
+    lead = np.clip(np.asarray(lead_time_days, dtype=np.float64), 0, None)
+    appointments = np.clip(np.asarray(prior_appointments, dtype=np.float64), 0, None)
+    no_shows = np.clip(np.asarray(prior_no_shows, dtype=np.float64), 0, appointments)
+    a, b = HISTORY_PRIOR
+    return np.column_stack([
+        np.log1p(lead),
+        np.log1p(appointments),
+        (no_shows + a) / (appointments + b),
+        (appointments == 0).astype(np.float64),
+    ])
+
+
+def age_band(age) -> np.ndarray:
+    return np.searchsorted(AGE_BANDS, np.asarray(age, dtype=np.float64), side='right')
+
+
+class CategoricalLookup:
+    """
+    Maps raw category strings to codes. Known spellings are precomputed and
+    other values are normalized once and memoized, so encoding a roster is
+    one dict lookup per row. Unknown categories get the trailing code
+    len(values), whose weight is 0 (the average category).
+    """
+
+    def __init__(self, values: Sequence[str], max_memo: int = 10000):
+        self.values = list(values)
+        self.unknown = len(self.values)
+        self.max_memo = max_memo
+        index = {value: code for code, value in enumerate(self.values)}
+        self._index = index
+        self._memo = {}
+        for value, code in index.items():
+            for spelling in (value, value.title(), value.upper(), value.capitalize(), value.replace('-', ' '), value.replace('-', ' ').title()):
+                self._memo[spelling] = code
+
+    def code(self, value) -> int:
+        code = self._index.get(normalize_category(value), self.unknown)
+        if len(self._memo) < self.max_memo:
+            self._memo[value] = code
+        return code
+
+    def encode(self, raw: Sequence) -> np.ndarray:
+        memo = self._memo
+        codes = [memo.get(value) for value in raw]
+        if None in codes:
+            codes = [self.code(value) if code is None else code for value, code in zip(raw, codes)]
+        return np.asarray(codes, dtype=np.intp)
+
+
+class NoShowModel:
+    """
+    Logistic regression no-show model exported by `app/ml/train_no_show.py`.
+
+    Standardization is folded into the exported weights, so a score is one
+    dot product plus three weight-table gathers (age band, gender,
+    appointment type); no one-hot matrix is built. Scoring a roster is a
+    single vectorized call over all rows.
+    """
+
+    def __init__(self, bias: float, numeric_weights, age_weights, gender_weights, appointment_type_weights, defaults: dict, metrics: dict = None):
+        self.bias = float(bias)
+        self.numeric_weights = np.asarray(numeric_weights, dtype=np.float64)
+        # Trailing 0 is the weight of an unknown category
+        self.age_weights = np.asarray(age_weights, dtype=np.float64)
+        self.gender_weights = np.append(np.asarray(gender_weights, dtype=np.float64), 0.0)
+        self.appointment_type_weights = np.append(np.asarray(appointment_type_weights, dtype=np.float64), 0.0)
+        self.defaults = defaults
+        self.metrics = metrics or {}
+        self.genders = CategoricalLookup(GENDERS)
+        self.appointment_types = CategoricalLookup(APPOINTMENT_TYPES)
+
+    @classmethod
+    def load(cls, path: str) -> "NoShowModel":
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if data.get('format') != MODEL_FORMAT:
+            raise ValueError(f"No-show model format {data.get('format')}, expected {MODEL_FORMAT}")
+        if (tuple(data['genders']), tuple(data['appointment_types']), tuple(data['age_bands']), tuple(data['numeric_features'])) != (GENDERS, APPOINTMENT_TYPES, AGE_BANDS, NUMERIC_FEATURES):
+            raise ValueError("No-show model was trained with a different feature layout, retrain it")
+        return cls(
+            data['bias'], data['numeric_weights'], data['age_weights'], data['gender_weights'],
+            data['appointment_type_weights'], data['defaults'], data.get('metrics')
+        )
+
+    def predict_proba(self, columns: Dict[str, List]) -> np.ndarray:
+        """
+        No-show probability per row. `columns` holds equal-length lists:
+        age, gender, appointment_type and optionally lead_time_days,
+        prior_appointments, prior_no_shows (None entries take the training
+        defaults).
+        """
+        n = len(columns['age'])
+        numeric = numeric_features(
+            self._column(columns, 'lead_time_days', n),
+            self._column(columns, 'prior_appointments', n),
+            self._column(columns, 'prior_no_shows', n),
+        )
+        logit = (
+            self.bias
+            + numeric @ self.numeric_weights
+            + self.age_weights[age_band(columns['age'])]
+            + self.gender_weights[self.genders.encode(columns['gender'])]
+            + self.appointment_type_weights[self.appointment_types.encode(columns['appointment_type'])]
+        )
+        return 1.0 / (1.0 + np.exp(-logit))
+
+    def _column(self, columns: Dict[str, List], name: str, n: int) -> np.ndarray:
+        default = self.defaults.get(name, 0.0)
+        values = columns.get(name)
+        if values is None:
+            return np.full(n, default, dtype=np.float64)
+        if None in values:
+            values = [default if value is None else value for value in values]
+        return np.asarray(values, dtype=np.float64)
@@ -0,0 +1,311 @@
+import logging
+import os
+import re
+import json
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from app.services.bm25 import BM25Index
+from app.services.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+META_FILE = 'meta.json'
+# Data files of indexes written before compaction got its own file set
+VECTORS_FILE = 'vectors.f32'
+CHUNKS_FILE = 'chunks.jsonl'
+
+
+class PatientEntry:
+    """Everything indexed for one patient, rows in append order."""
+
+    def __init__(self, documents: List[dict], texts: List[str], matrix: np.ndarray, version: int, stamp: int, lexical: Optional[BM25Index] = None):
+        self.documents = documents  # [{'document_id', 'key', 'rows'}]
+        self.texts = texts
+        self.matrix = matrix        # Memory-mapped, L2-normalized rows
+        self.version = version
+        self.stamp = stamp          # mtime of meta.json this entry reflects
+        self.row_document = []      # document id of every row
+        self.row_chunk = []         # chunk number within its document
+        for doc in documents:
+            self.row_document.extend([doc['document_id']] * doc['rows'])
+            self.row_chunk.extend(range(doc['rows']))
+        if lexical is None:
+            lexical = BM25Index()
+            lexical.add(texts)
+        self.lexical = lexical
+
+    def extended(self, document: dict, chunks: List[str], matrix: np.ndarray, version: int, stamp: int) -> "PatientEntry":
+        """
+        The entry with one more document appended. The BM25 index is extended
+        in place rather than rebuilt, so it may briefly hold rows a reader of
+        this (older) entry doesn't have; callers skip rows >= size.
+        """
+        self.lexical.add(chunks)
+        return PatientEntry(self.documents + [document], self.texts + list(chunks), matrix, version, stamp, lexical=self.lexical)
+
+    @property
+    def size(self) -> int:
+        return len(self.texts)
+
+    def source(self, row: int) -> dict:
+        return {'document_id': self.row_document[row], 'chunk': self.row_chunk[row] + 1}
+
+
+class PatientVectorIndex:
+    """
+    Chunk embeddings of all documents of a patient, for cross-document Q&A.
+
+    Each patient has a directory with an append-only float32 matrix
+    (`vectors.<id>.f32`), the chunk texts (`chunks.<id>.jsonl`) and
+    `meta.json`, which names those files, lists the documents and their row
+    counts and is replaced last. A crash mid-append leaves the previous state
+    readable (trailing rows are ignored and cut off by the next append); a
+    compaction writes a new pair of files, switches to them by replacing
+    meta.json and only then deletes the old pair, so a crash at any point
+    leaves one consistent set. Adding a document appends its already
+    computed, normalized chunk embeddings: nothing is re-embedded.
+
+    Size is bounded by `max_chunks` rows per patient; the oldest documents
+    are dropped (and the files compacted) to make room, so query cost stays
+    at one mat-vec over at most `max_chunks` rows. At most `max_loaded`
+    patients are kept memory-mapped (LRU). Updates hold a per-patient lock
+    file, so several worker processes can share one index directory.
+    """
+
+    def __init__(self, index_dir: str, max_chunks: int = 5000, max_loaded: int = 32):
+        self.index_dir = index_dir
+        self.max_chunks = max_chunks
+        self.max_loaded = max_loaded
+
+        self._lock = threading.Lock()
+        self._loaded = OrderedDict()  # patient id -> PatientEntry
+        self._patient_locks = {}
+
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    @staticmethod
+    def _safe_id(patient_id: str) -> str:
+        return re.sub(r'[^A-Za-z0-9.-]', '-', patient_id)
+
+    def _dir(self, patient_id: str) -> str:
+        return os.path.join(self.index_dir, self._safe_id(patient_id))
+
+    def _patient_lock(self, patient_id: str) -> threading.Lock:
+        with self._lock:
+            return self._patient_locks.setdefault(patient_id, threading.Lock())
+
+    @contextmanager
+    def _writer(self, patient_id: str) -> Iterator[None]:
+        """Serializes updates of one patient across threads and worker processes."""
+        with self._patient_lock(patient_id), file_lock(self._dir(patient_id) + '.lock'):
+            yield
+
+    # --- Reads ---
+
+    def get(self, patient_id: str) -> Optional[PatientEntry]:
+        entry = self._current(patient_id)
+        if entry is not None:
+            return entry
+        with self._patient_lock(patient_id):
+            entry = self._current(patient_id) or self._load(patient_id)
+        if entry is not None:
+            self._remember(patient_id, entry)
+        return entry
+
+    def _meta_stamp(self, patient_id: str) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(self._dir(patient_id), META_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _current(self, patient_id: str) -> Optional[PatientEntry]:
+        """The loaded entry, if another process hasn't changed the index since."""
+        with self._lock:
+            entry = self._loaded.get(patient_id)
+            if entry is not None:
+                self._loaded.move_to_end(patient_id)
+        if entry is None or entry.stamp != self._meta_stamp(patient_id):
+            return None
+        return entry
+
+    def _load(self, patient_id: str) -> Optional[PatientEntry]:
+        """
+        The patient's entry from disk, or None if there is none or it is
+        inconsistent (the next add_document then starts the index afresh).
+        """
+        directory = self._dir(patient_id)
+        for attempt in range(2):
+            try:
+                stamp = self._meta_stamp(patient_id)
+                meta = self._read_meta(patient_id)
+            except FileNotFoundError:
+                return None
+            except (OSError, ValueError) as e:
+                logger.warning(f"Patient index {directory} unreadable, ignoring: {e}")
+                return None
+            try:
+                return self._read_entry(directory, meta, stamp)
+            except (OSError, ValueError, KeyError) as e:
+                if attempt == 0 and self._meta_stamp(patient_id) != stamp:
+                    continue  # Compacted by another process meanwhile: read the new files
+                logger.warning(f"Patient index {directory} inconsistent with its meta.json, rebuilding: {e}")
+                return None
+
+    @staticmethod
+    def _read_entry(directory: str, meta: dict, stamp: int) -> PatientEntry:
+        vectors_file, chunks_file = PatientVectorIndex._files(meta)
+        rows = sum(doc['rows'] for doc in meta['documents'])
+        texts = []
+        if rows:
+            with open(os.path.join(directory, chunks_file), 'r') as f:
+                for line in f:
+                    if len(texts) == rows:
+                        break  # Rows of an interrupted append
+                    texts.append(json.loads(line))
+            if len(texts) < rows:
+                raise ValueError(f"{chunks_file} has {len(texts)} of {rows} rows")
+            # Raises ValueError if the file is shorter than the rows meta.json lists
+            matrix = np.memmap(os.path.join(directory, vectors_file), dtype=np.float32, mode='r', shape=(rows, meta['dim']))
+        else:
+            matrix = np.zeros((0, meta.get('dim') or 0), dtype=np.float32)
+        return PatientEntry(meta['documents'], texts, matrix, meta['version'], stamp)
+
+    @staticmethod
+    def _files(meta: dict):
+        """(vectors, chunks) file names the meta refers to."""
+        return meta.get('vectors', VECTORS_FILE), meta.get('chunks', CHUNKS_FILE)
+
+    def _remember(self, patient_id: str, entry: PatientEntry):
+        with self._lock:
+            self._loaded[patient_id] = entry
+            self._loaded.move_to_end(patient_id)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+
+    # --- Updates ---
+
+    def add_document(self, patient_id: str, document_id: str, key: str, chunks: List[str], matrix) -> bool:
+        """
+        Appends a document's chunks and (normalized) embeddings to the patient's
+        index. Re-adding the same content is a no-op (job retries); new content
+        for a known document replaces its rows. Returns True if rows were added.
+        """
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if not chunks or matrix.shape[0] != len(chunks):
+            return False
+        if len(chunks) > self.max_chunks:
+            chunks, matrix = chunks[:self.max_chunks], matrix[:self.max_chunks]
+        dim = matrix.shape[1]
+
+        with self._writer(patient_id):
+            entry = self._current(patient_id) or self._load(patient_id)
+            version = entry.version if entry is not None else 0
+            if entry is not None and entry.size and entry.matrix.shape[1] != dim:
+                logger.warning(f"Embedding size changed, rebuilding patient index {patient_id}")
+                entry = None
+
+            documents = entry.documents if entry is not None else []
+            if any(doc['document_id'] == document_id and doc['key'] == key for doc in documents):
+                return False
+
+            # 1. Drop the document's old rows and, at the cap, the oldest documents
+            #    (leaving 10% headroom so the files are not compacted on every append)
+            keep = [doc for doc in documents if doc['document_id'] != document_id]
+            if sum(doc['rows'] for doc in keep) + len(chunks) > self.max_chunks:
+                while keep and sum(doc['rows'] for doc in keep) + len(chunks) > self.max_chunks * 0.9:
+                    keep.pop(0)
+            if entry is None:
+                self._write(patient_id, [], [], np.zeros((0, dim), dtype=np.float32), version)
+                entry = self._load(patient_id)
+            elif len(keep) != len(documents):
+                self._compact(patient_id, entry, keep, version)
+                entry = self._load(patient_id)
+
+            # 2. Append rows (cutting off any left by an interrupted append), then publish them
+            directory = self._dir(patient_id)
+            meta = self._read_meta(patient_id)
+            files = self._files(meta)
+            vectors_path = os.path.join(directory, files[0])
+            chunks_path = os.path.join(directory, files[1])
+            os.truncate(vectors_path, entry.size * dim * 4)
+            os.truncate(chunks_path, meta['chunks_bytes'])
+            with open(vectors_path, 'ab') as f:
+                f.write(np.ascontiguousarray(matrix).tobytes())
+            with open(chunks_path, 'a') as f:
+                f.writelines(json.dumps(chunk) + '\n' for chunk in chunks)
+            document = {'document_id': document_id, 'key': key, 'rows': len(chunks)}
+            self._write_meta(patient_id, entry.documents + [document], dim, version + 1, files)
+
+            rows = entry.size + len(chunks)
+            grown = np.memmap(vectors_path, dtype=np.float32, mode='r', shape=(rows, dim))
+            entry = entry.extended(document, chunks, grown, version + 1, self._meta_stamp(patient_id))
+
+        self._remember(patient_id, entry)
+        return True
+
+    def remove_document(self, patient_id: str, document_id: str) -> bool:
+        with self._writer(patient_id):
+            entry = self._load(patient_id)
+            if entry is None or not any(doc['document_id'] == document_id for doc in entry.documents):
+                return False
+            keep = [doc for doc in entry.documents if doc['document_id'] != document_id]
+            self._compact(patient_id, entry, keep, entry.version + 1)
+            entry = self._load(patient_id)
+        self._remember(patient_id, entry)
+        return True
+
+    def _compact(self, patient_id: str, entry: PatientEntry, keep: List[dict], version: int):
+        """Rewrites the files with only the rows of `keep` (call with the patient lock held)."""
+        kept_ids = {doc['document_id'] for doc in keep}
+        rows = [row for row in range(entry.size) if entry.row_document[row] in kept_ids]
+        dim = entry.matrix.shape[1]
+        matrix = np.asarray(entry.matrix[rows], dtype=np.float32) if rows else np.zeros((0, dim), dtype=np.float32)
+        self._write(patient_id, keep, [entry.texts[row] for row in rows], matrix, version)
+
+    def _write(self, patient_id: str, documents: List[dict], texts: List[str], matrix: np.ndarray, version: int):
+        """
+        Writes a new file set and switches to it by replacing meta.json; the
+        files it replaces (and any left by an interrupted write) are deleted
+        after the switch. Readers still mapping old files keep their pages.
+        """
+        directory = self._dir(patient_id)
+        os.makedirs(directory, exist_ok=True)
+        file_id = uuid.uuid4().hex[:12]
+        files = (f"vectors.{file_id}.f32", f"chunks.{file_id}.jsonl")
+        with open(os.path.join(directory, files[0]), 'wb') as f:
+            f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        with open(os.path.join(directory, files[1]), 'w') as f:
+            f.writelines(json.dumps(text) + '\n' for text in texts)
+        self._write_meta(patient_id, documents, matrix.shape[1], version, files)
+        for name in os.listdir(directory):
+            if name.startswith(('vectors.', 'chunks.')) and name not in files:
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def _read_meta(self, patient_id: str) -> dict:
+        with open(os.path.join(self._dir(patient_id), META_FILE), 'r') as f:
+            return json.load(f)
+
+    def _write_meta(self, patient_id: str, documents: List[dict], dim: int, version: int, files):
+        directory = self._dir(patient_id)
+        path = os.path.join(directory, META_FILE)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        meta = {
+            'version': version,
+            'dim': dim,
+            'vectors': files[0],
+            'chunks': files[1],
+            'chunks_bytes': os.path.getsize(os.path.join(directory, files[1])),
+            'documents': documents
+        }
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
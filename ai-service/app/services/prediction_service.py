@@ -1,79 +1,159 @@
+import logging
 import os
-import joblib
 import json
 import numpy as np
+from typing import List
 from dotenv import load_dotenv
+from app.services.forest_inference import CompiledForest
+from app.services.no_show_model import NoShowModel
+from app.services.metrics import NO_SHOW_ROWS, PREDICTION_ROWS, timed
+
+logger = logging.getLogger(__name__)
 
 # Load env variables (for consistency, though ML model is local)
 load_dotenv(os.path.join(os.path.dirname(__file__), '../../../backend/.env'))
 
 class PredictionService:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, inflow_forecaster=None, shared_dir=None):
         # We accept api_key to match the signature in main.py, even if we don't use it for the ML part
+        self.inflow_forecaster = inflow_forecaster  # InflowForecaster, None without an inflow history
+        # Model arrays are memory-mapped from here and shared by all workers; None loads private copies
+        self.shared_dir = shared_dir
         self.model_path = os.path.join(os.path.dirname(__file__), '../models/disease_model.pkl')
+        # Flattened export of the same forest; served without importing sklearn
+        self.forest_path = os.path.join(os.path.dirname(__file__), '../models/disease_forest.npz')
         self.symptoms_path = os.path.join(os.path.dirname(__file__), '../models/symptoms.json')
+        # Logistic regression written by app/ml/train_no_show.py
+        self.no_show_path = os.path.join(os.path.dirname(__file__), '../models/no_show_model.json')
         
         self.model = None
+        self.no_show_model = None
         self.all_symptoms = []
+        self.symptom_index = {}  # symptom -> feature column
         
         self._load_model()
 
     def _load_model(self):
         try:
-            if os.path.exists(self.model_path) and os.path.exists(self.symptoms_path):
+            if os.path.exists(self.forest_path) and os.path.exists(self.symptoms_path):
+                self.model = CompiledForest.load(self.forest_path, shared_dir=self.shared_dir)
+                logger.info(f"Loaded Compiled Disease Model from {self.forest_path}")
+            elif os.path.exists(self.model_path) and os.path.exists(self.symptoms_path):
+                import joblib  # Unpickling pulls in sklearn
                 self.model = joblib.load(self.model_path)
+                logger.info(f"Loaded Disease Model from {self.model_path}")
+            else:
+                self.model = None
+
+            if self.model is not None:
                 with open(self.symptoms_path, 'r') as f:
                     self.all_symptoms = json.load(f)
-                print(f"Loaded Disease Model from {self.model_path}")
+                self.symptom_index = {symptom: i for i, symptom in enumerate(self.all_symptoms)}
+            else:
+                logger.warning("Disease Model not found. Please run train_model.py")
+        except Exception as e:
+            logger.error(f"Failed to load model: {e}")
+
+        try:
+            if os.path.exists(self.no_show_path):
+                self.no_show_model = NoShowModel.load(self.no_show_path)
+                logger.info(f"Loaded No-Show Model from {self.no_show_path}")
             else:
-                print("Disease Model not found. Please run train_model.py")
+                logger.warning("No-Show Model not found. Please run train_no_show.py")
         except Exception as e:
-            print(f"Failed to load model: {e}")
+            logger.error(f"Failed to load no-show model: {e}")
 
-    def predict_inflow(self, days=7):
-        # Placeholder for existing inflow logic if needed, or remove if unused
-        return []
+    def predict_inflow(self, days=7, department=None, hourly=False):
+        """[{date, day, predicted_count, lower, upper[, hourly]}] for the next `days` days."""
+        if self.inflow_forecaster is None:
+            return []
+        return self.inflow_forecaster.forecast(days, department=department, hourly=hourly)
 
-    def predict_no_show(self, age, gender, appointment_type):
-        # Placeholder for existing risk logic
-        return 10
+    def predict_no_show(self, age, gender, appointment_type, lead_time_days=None, prior_appointments=None, prior_no_shows=None):
+        """No-show risk score (0-100) of one appointment."""
+        return int(self.predict_no_show_batch({
+            'age': [age],
+            'gender': [gender],
+            'appointment_type': [appointment_type],
+            'lead_time_days': [lead_time_days],
+            'prior_appointments': [prior_appointments],
+            'prior_no_shows': [prior_no_shows]
+        })[0])
 
-    def predict_disease_ml(self, user_symptoms_str):
+    def predict_no_show_batch(self, columns: dict) -> np.ndarray:
         """
-        Predict disease based on comma-separated symptoms string.
+        No-show risk scores (0-100) for a whole roster given as columns (see
+        NoShowModel.predict_proba), scored in one vectorized call.
+        """
+        if not self.no_show_model:
+            raise Exception("No-show model not loaded")
+        with timed("predict_no_show"):
+            probs = self.no_show_model.predict_proba(columns)
+        NO_SHOW_ROWS.inc(len(probs))
+        return np.rint(probs * 100).astype(np.int64)
+
+    @staticmethod
+    def parse_symptoms(user_symptoms_str: str) -> List[str]:
+        # "fever, cough" -> ["fever", "cough"]
+        return [s.strip().lower().replace(' ', '_') for s in user_symptoms_str.split(',')]
+
+    def build_feature_matrix(self, symptom_lists: List[List[str]]) -> np.ndarray:
+        """One uint8 row per input, 1 where the symptom column is present."""
+        rows, cols = [], []
+        for row, symptoms in enumerate(symptom_lists):
+            for symptom in symptoms:
+                col = self.symptom_index.get(symptom)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        X = np.zeros((len(symptom_lists), len(self.all_symptoms)), dtype=np.uint8)
+        X[rows, cols] = 1
+        return X
+
+    def predict_disease_batch(self, user_symptoms_strs: List[str], top_k: int = 1) -> List[dict]:
+        """
+        Predicts diseases for many comma-separated symptom strings with a single
+        predict_proba call. With top_k > 1 each result also lists the k most
+        likely diseases.
         """
         if not self.model or not self.all_symptoms:
             raise Exception("Model not loaded")
+        if not user_symptoms_strs:
+            return []
 
-        # 1. Parse Input
-        # "fever, cough" -> ["fever", "cough"]
-        input_symptoms = [s.strip().lower().replace(' ', '_') for s in user_symptoms_str.split(',')]
-        
-        # 2. Create Feature Vector
-        feature_vector = []
-        for symptom in self.all_symptoms:
-            if symptom in input_symptoms:
-                feature_vector.append(1)
-            else:
-                feature_vector.append(0)
-        
-        # Reshape for sklearn
-        X = np.array([feature_vector])
-        
-        # 3. Predict
+        # 1. Parse Input & Create Feature Matrix
+        symptom_lists = [self.parse_symptoms(s) for s in user_symptoms_strs]
+        X = self.build_feature_matrix(symptom_lists)
+
+        # 2. Predict (one call for the whole batch)
         valid_classes = self.model.classes_
-        
-        # Get probabilities
-        probs = self.model.predict_proba(X)[0]
-        
-        # Get best match
-        best_idx = np.argmax(probs)
-        predicted_disease = valid_classes[best_idx]
-        confidence = float(probs[best_idx])
-        
-        return {
-            "disease": predicted_disease,
-            "confidence_score": confidence,
-            "symptoms_analyzed": input_symptoms
-        }
+        with timed("predict_proba"):
+            probs = self.model.predict_proba(X)
+        PREDICTION_ROWS.inc(len(symptom_lists))
+
+        # 3. Best match (and optional top-k) per row
+        best_idx = np.argmax(probs, axis=1)
+        top_k = max(1, min(top_k, len(valid_classes)))
+        if top_k > 1:
+            top_idx = np.argsort(-probs, axis=1, kind='stable')[:, :top_k]
 
+        results = []
+        for i, symptoms in enumerate(symptom_lists):
+            result = {
+                "disease": str(valid_classes[best_idx[i]]),
+                "confidence_score": float(probs[i, best_idx[i]]),
+                "symptoms_analyzed": symptoms
+            }
+            if top_k > 1:
+                result["top_predictions"] = [
+                    {"disease": str(valid_classes[j]), "confidence_score": float(probs[i, j])}
+                    for j in top_idx[i]
+                ]
+            results.append(result)
+        return results
+
+    def predict_disease_ml(self, user_symptoms_str):
+        """
+        Predict disease based on comma-separated symptoms string.
+        """
+        return self.predict_disease_batch([user_symptoms_str])[0]
@@ -1,23 +1,64 @@
 import google.generativeai as genai
+import json
+import logging
+import threading
 import numpy as np
-from typing import List, Dict
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+from app.services.embedding_index import DocumentEmbeddingIndex, content_hash, normalize_rows
+from app.services.response_cache import SemanticResponseCache
+from app.services.metrics import CHUNK_EMBEDDINGS_AVOIDED, CHUNKS_EMBEDDED, RETRIEVALS, timed
+from app.services.gemini_gateway import GeminiGateway, get_gateway
+from app.services.chunker import StructuredChunker
+from app.services.bm25 import RETRIEVAL_MODES, BM25Index, reciprocal_rank_fusion
+from app.services.patient_index import PatientVectorIndex
+
+logger = logging.getLogger(__name__)
 
 class RAGService:
-    def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        index: Optional[DocumentEmbeddingIndex] = None,
+        response_cache: Optional[SemanticResponseCache] = None,
+        chunker=None,
+        retrieval_mode: str = "hybrid",
+        lexical_weight: float = 1.0,
+        fusion_candidates: int = 20,
+        lexical_cache_size: int = 64,
+        patient_index: Optional[PatientVectorIndex] = None,
+        gateway: Optional[GeminiGateway] = None
+    ):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {retrieval_mode}, expected one of {RETRIEVAL_MODES}")
+        # Rate limits, adaptive concurrency and retries shared with the other services
+        self.gateway = gateway or get_gateway()
+        self.gateway.configure(api_key)
         self.embedding_model = 'models/text-embedding-004' 
-        self.gen_model = genai.GenerativeModel('gemini-2.5-flash-lite')
-
-    def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        chunks = []
-        start = 0
-        text_len = len(text)
-        while start < text_len:
-            end = start + chunk_size
-            chunk = text[start:end]
-            chunks.append(chunk)
-            start += chunk_size - overlap 
-        return chunks
+        self.gen_model_name = 'gemini-2.5-flash-lite'
+        self.gen_model = genai.GenerativeModel(self.gen_model_name)
+        # Chunk embeddings persisted per document; None keeps the old per-request behaviour
+        self.index = index
+        # Answers to repeated questions about the same document; None disables caching
+        self.response_cache = response_cache
+        # Sentence/page aware, deduplicating chunker (see app/services/chunker.py)
+        self.chunker = chunker or StructuredChunker()
+        # BM25 indexes of recently used documents, keyed like the embedding index
+        self.retrieval_mode = retrieval_mode
+        self.lexical_weight = lexical_weight
+        self.fusion_candidates = fusion_candidates
+        self.lexical_cache_size = lexical_cache_size
+        self._lexical = OrderedDict()
+        self._lexical_lock = threading.Lock()
+        # All documents of a patient in one index, for cross-document questions
+        self.patient_index = patient_index
+
+    def chunk_text(self, text: str) -> List[str]:
+        return self.chunker.chunk(text).chunks
+
+    def index_key(self, text_hash: str) -> str:
+        """Index entries depend on the chunking, so the chunker version is part of the key."""
+        return f"{self.chunker.version}-{text_hash}"
 
     def get_embeddings(self, chunks: List[str]) -> List[List[float]]:
         try:
@@ -26,63 +67,318 @@ class RAGService:
             for i in range(0, len(chunks), batch_size):
                 batch = chunks[i : i + batch_size]
                 if not batch: continue
-                print(f"Embedding batch {i//batch_size + 1}...")
-                result = genai.embed_content(
-                    model=self.embedding_model,
-                    content=batch,
-                    task_type="retrieval_document",
-                    title="Medical Document Chunk"
+                logger.debug(f"Embedding batch {i//batch_size + 1} ({len(batch)} chunks)")
+                result = self.gateway.call(
+                    "embed", self.embedding_model,
+                    lambda: genai.embed_content(
+                        model=self.embedding_model,
+                        content=batch,
+                        task_type="retrieval_document",
+                        title="Medical Document Chunk"
+                    ),
+                    batch, lambda r: r.get('embedding')
                 )
                 if 'embedding' in result:
                      all_embeddings.extend(result['embedding'])
             return all_embeddings
         except Exception as e:
-            print(f"Embedding generation failed: {e}")
+            logger.error(f"Embedding generation failed: {e}")
+            raise e
+
+    def index_document(self, document_id: Optional[str], text: str) -> Tuple[List[str], np.ndarray]:
+        """
+        Chunks and embeds a document once, returning (chunks, normalized matrix).
+        Already indexed content is served from the index without embedding calls.
+        """
+        key = self.index_key(content_hash(text))
+        if self.index is not None:
+            entry = self.index.get(key)
+            if entry is not None:
+                self.index.reference(document_id, key)  # Identical text may be indexed under another document
+                if self.retrieval_mode != "dense":
+                    self.lexical_index(key, entry[0])
+                return entry
+
+        with timed("chunk"):
+            result = self.chunker.chunk(text)
+        chunks = result.chunks
+        if not chunks:
+            return [], np.zeros((0, 0), dtype=np.float32)
+
+        if self.retrieval_mode != "dense":
+            self.lexical_index(key, chunks)
+        CHUNKS_EMBEDDED.inc(len(chunks))
+        CHUNK_EMBEDDINGS_AVOIDED.inc(result.stats["embeddings_avoided"])
+        logger.info(f"Generating embeddings for document {document_id}: {result.stats}")
+        with timed("index"):
+            chunk_embeddings = self.get_embeddings(chunks)
+            if self.index is None:
+                return chunks, normalize_rows(chunk_embeddings)
+            return self.index.put(document_id, key, chunks, chunk_embeddings)
+
+    def lexical_index(self, key: str, chunks: List[str]) -> BM25Index:
+        """BM25 index over a document's chunks, built once per index key (LRU)."""
+        with self._lexical_lock:
+            bm25 = self._lexical.get(key)
+            if bm25 is not None:
+                self._lexical.move_to_end(key)
+                return bm25
+        bm25 = BM25Index()
+        bm25.add(chunks)
+        with self._lexical_lock:
+            self._lexical[key] = bm25
+            while len(self._lexical) > self.lexical_cache_size:
+                self._lexical.popitem(last=False)
+        return bm25
+
+    def document_chunks(self, key: str, text: str) -> List[str]:
+        """Chunks without any embedding call: from the index if present, else freshly chunked."""
+        if self.index is not None:
+            entry = self.index.get(key)
+            if entry is not None:
+                return entry[0]
+        with timed("chunk"):
+            return self.chunker.chunk(text).chunks
+
+    @staticmethod
+    def _fill(indices, n_chunks: int, top_k: int) -> List[int]:
+        """Pads a short lexical result with the first chunks so the context is never empty."""
+        selected = [int(i) for i in indices]
+        for i in range(n_chunks):
+            if len(selected) >= min(top_k, n_chunks):
+                break
+            if i not in selected:
+                selected.append(i)
+        return selected
+
+    def rank(self, question: str, lexical, dense, top_k: int, service: str = "rag"):
+        """
+        Ranks rows of a corpus with the configured retrieval mode; returns
+        (row indices best first, query embedding or None). `lexical()` returns
+        the corpus' BM25Index, `dense()` returns (normalized matrix, query
+        embedding) and may raise, in which case BM25 is used instead.
+        """
+        mode = self.retrieval_mode
+
+        # 1. Lexical fast path: no embedding calls at all
+        if mode in ("lexical", "auto"):
+            bm25 = lexical()
+            with timed("retrieve_lexical"):
+                ids, _ = bm25.search(question, top_k)
+            if mode == "lexical" or bm25.keywords_suffice(question, ids):
+                RETRIEVALS.inc(service=service, mode="lexical")
+                return self._fill(ids, bm25.size, top_k), None
+
+        # 2. Dense retrieval, fused with BM25 unless dense-only
+        try:
+            matrix, q_embedding = dense()
+        except Exception as e:
+            logger.warning(f"Dense retrieval unavailable, falling back to BM25: {e}")
+            bm25 = lexical()
+            with timed("retrieve_lexical"):
+                ids, _ = bm25.search(question, top_k)
+            RETRIEVALS.inc(service=service, mode="lexical_fallback")
+            return self._fill(ids, bm25.size, top_k), None
+
+        if mode == "dense":
+            RETRIEVALS.inc(service=service, mode="dense")
+            return [int(i) for i in self.select_chunks(q_embedding, matrix, top_k)], q_embedding
+
+        dense_ids = self.select_chunks(q_embedding, matrix, self.fusion_candidates)
+        with timed("retrieve_lexical"):
+            lexical_ids, _ = lexical().search(question, self.fusion_candidates)
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids], [1.0, self.lexical_weight])
+        RETRIEVALS.inc(service=service, mode="hybrid")
+        return [i for i, _ in fused[:top_k]], q_embedding
+
+    def retrieve(self, document_id: Optional[str], text: str, text_hash: str, question: str, top_k: int = 3):
+        """Returns (chunks, indices of the top_k chunks, query embedding or None) for one document."""
+        if not text.strip():
+            return [], [], None
+        key = self.index_key(text_hash)
+        state = {}
+
+        def lexical():
+            if "chunks" not in state:
+                state["chunks"] = self.document_chunks(key, text)
+            return self.lexical_index(key, state["chunks"])
+
+        def dense():
+            state["chunks"], matrix = self.index_document(document_id, text)
+            return matrix, self.embed_question(question)
+
+        top_indices, q_embedding = self.rank(question, lexical, dense, top_k)
+        return state.get("chunks") or [], top_indices, q_embedding
+
+    # --- Patient-level (cross-document) Q&A ---
+
+    def index_patient_document(self, patient_id: str, document_id: str, text: str) -> bool:
+        """Indexes a document (if not already) and appends its chunk embeddings to the patient's index."""
+        chunks, chunk_matrix = self.index_document(document_id, text)
+        if self.patient_index is None or not chunks:
+            return False
+        with timed("patient_index"):
+            return self.patient_index.add_document(patient_id, document_id, self.index_key(content_hash(text)), chunks, chunk_matrix)
+
+    def answer_patient_question(self, patient_id: str, question: str, top_k: int = 8) -> dict:
+        """
+        Answers a question across all indexed documents of a patient.
+        Returns {"answer", "sources"}; every source names the document and
+        chunk the excerpt came from.
+        """
+        try:
+            entry = self.patient_index.get(patient_id) if self.patient_index is not None else None
+            if entry is None or not entry.size:
+                return {"answer": "No processed documents found for this patient.", "sources": []}
+
+            # 0. Same question against the same set of documents
+            corpus_key = f"patient:{patient_id}:{entry.version}"
+            if self.response_cache:
+                cached = self.response_cache.get_exact(corpus_key, question)
+                if cached is not None:
+                    return json.loads(cached)
+
+            # 1. Retrieve across documents (rows are in processing order)
+            rows, q_embedding = self.rank(
+                question,
+                lambda: entry.lexical,
+                lambda: (entry.matrix, self.embed_question(question)),
+                top_k,
+                service="rag_patient"
+            )
+            rows = sorted(row for row in rows if row < entry.size)  # BM25 may already hold a newer append
+
+            # 2. Paraphrased question that retrieved the same chunks
+            context_key = f"{corpus_key}:{','.join(str(row) for row in rows)}"
+            if self.response_cache and q_embedding is not None:
+                cached = self.response_cache.get_similar(context_key, q_embedding)
+                if cached is not None:
+                    return json.loads(cached)
+
+            # 3. Generate
+            sources = []
+            context = ""
+            for i, row in enumerate(rows):
+                source = entry.source(row)
+                context += f"Source {i+1} (document {source['document_id']}, chunk {source['chunk']}):\n{entry.texts[row]}\n\n"
+                sources.append({"source": i + 1, **source, "excerpt": entry.texts[row][:300]})
+            prompt = (
+                "Answer the question using ONLY the provided excerpts from this patient's documents. "
+                "Excerpts are listed in the order the documents were processed; when a value appears in "
+                "several documents, describe how it changed. Cite the excerpts you use as [Source N].\n"
+                f"Context:\n{context}\n"
+                f"Question: {question}"
+            )
+
+            response = self.gateway.call("generate", self.gen_model_name, lambda: self.gen_model.generate_content(prompt), prompt, lambda r: r.text)
+            result = {"answer": response.text, "sources": sources}
+            if self.response_cache:
+                self.response_cache.put(corpus_key, question, context_key, q_embedding, json.dumps(result))
+            return result
+        except Exception as e:
+            logger.error(f"Patient RAG Pipeline Error: {e}")
             raise e
 
-    def retrieve_relevant_chunks(self, question: str, chunks: List[str], chunk_embeddings: List[List[float]], top_k: int = 3) -> str:
-        # 1. Embed Question
-        q_result = genai.embed_content(
-            model=self.embedding_model,
-            content=question,
-            task_type="retrieval_query"
+    def embed_question(self, question: str) -> np.ndarray:
+        """L2-normalized query embedding."""
+        q_result = self.gateway.call(
+            "embed", self.embedding_model,
+            lambda: genai.embed_content(model=self.embedding_model, content=question, task_type="retrieval_query"),
+            question, lambda r: r['embedding']
         )
-        q_embedding = np.array(q_result['embedding'])
+        q_embedding = np.asarray(q_result['embedding'], dtype=np.float32)
+        q_norm = np.linalg.norm(q_embedding)
+        if q_norm > 0:
+            q_embedding = q_embedding / q_norm
+        return q_embedding
 
-        # 2. Similarity
-        chunk_embeddings_np = np.array(chunk_embeddings)
-        dot_products = np.dot(chunk_embeddings_np, q_embedding)
-        norms = np.linalg.norm(chunk_embeddings_np, axis=1) * np.linalg.norm(q_embedding)
-        similarities = dot_products / norms
+    def select_chunks(self, q_embedding: np.ndarray, chunk_matrix: np.ndarray, top_k: int = 3) -> np.ndarray:
+        """Indices of the top_k chunks, best first (rows are pre-normalized, so a single mat-vec gives cosine)."""
+        with timed("retrieve"):
+            similarities = chunk_matrix @ q_embedding
+            k = min(top_k, chunk_matrix.shape[0])
+            return np.argsort(similarities)[-k:][::-1]
 
-        # 3. Top K
-        k = min(top_k, len(chunks))
-        top_indices = np.argsort(similarities)[-k:][::-1]
+    def retrieve_relevant_chunks(self, question: str, chunks: List[str], chunk_matrix: np.ndarray, top_k: int = 3) -> str:
+        """`chunk_matrix` holds L2-normalized chunk embeddings, one row per chunk."""
+        top_indices = self.select_chunks(self.embed_question(question), chunk_matrix, top_k)
+        return self.format_context(chunks, top_indices)
 
-        # 4. Context
+    def format_context(self, chunks: List[str], top_indices) -> str:
         relevant_context = ""
-        print(f"--- RAG Retrieval ---")
         for idx in top_indices:
             relevant_context += f"Info {idx+1}:\n{chunks[idx]}\n\n"
         return relevant_context
 
-    def answer_question_rag(self, full_text: str, question: str) -> str:
-        try:
-            chunks = self.chunk_text(full_text)
-            if not chunks: return "Empty document."
-            
-            print(f"Generating embeddings for {len(chunks)} chunks...")
-            chunk_embeddings = self.get_embeddings(chunks)
-            context = self.retrieve_relevant_chunks(question, chunks, chunk_embeddings)
+    def _plan_answer(self, full_text: str, question: str, document_id: Optional[str]):
+        """
+        Steps before generation. Returns (answer, None, None) when no
+        generation is needed, else (None, prompt, store) where store(answer)
+        caches the generated answer.
+        """
+        # 0. Same question about the same document: no embedding or generation needed
+        text_hash = content_hash(full_text)
+        if self.response_cache:
+            cached = self.response_cache.get_exact(text_hash, question)
+            if cached is not None:
+                return cached, None, None
 
-            prompt = (
-                "Answer the user's question using ONLY the provided context.\n"
-                f"Context:\n{context}\n\n"
-                f"Question: {question}"
-            )
+        # 1. Retrieve
+        chunks, top_indices, q_embedding = self.retrieve(document_id, full_text, text_hash, question)
+        if not chunks: return "Empty document.", None, None
 
-            response = self.gen_model.generate_content(prompt)
+        # 2. Paraphrased question that retrieved the same chunks
+        context_key = f"{self.index_key(text_hash)}:{','.join(str(i) for i in top_indices)}"
+        if self.response_cache and q_embedding is not None:
+            cached = self.response_cache.get_similar(context_key, q_embedding)
+            if cached is not None:
+                return cached, None, None
+
+        context = self.format_context(chunks, top_indices)
+        prompt = (
+            "Answer the user's question using ONLY the provided context.\n"
+            f"Context:\n{context}\n\n"
+            f"Question: {question}"
+        )
+
+        def store(answer: str):
+            if self.response_cache:
+                self.response_cache.put(text_hash, question, context_key, q_embedding, answer)
+        return None, prompt, store
+
+    def answer_question_rag(self, full_text: str, question: str, document_id: Optional[str] = None) -> str:
+        try:
+            answer, prompt, store = self._plan_answer(full_text, question, document_id)
+            if prompt is None:
+                return answer
+
+            # 3. Generate
+            response = self.gateway.call("generate", self.gen_model_name, lambda: self.gen_model.generate_content(prompt), prompt, lambda r: r.text)
+            store(response.text)
             return response.text
         except Exception as e:
-            print(f"RAG Pipeline Error: {e}")
+            logger.error(f"RAG Pipeline Error: {e}")
+            raise e
+
+    def answer_question_rag_stream(self, full_text: str, question: str, document_id: Optional[str] = None) -> Iterator[str]:
+        """
+        answer_question_rag with a streamed answer: retrieval runs now (so
+        its errors surface before any output), generation runs as the
+        returned iterator is consumed and yields text chunks as Gemini
+        produces them. Cached answers come back as a single chunk.
+        """
+        try:
+            answer, prompt, store = self._plan_answer(full_text, question, document_id)
+        except Exception as e:
+            logger.error(f"RAG Pipeline Error: {e}")
             raise e
+        if prompt is None:
+            return iter([answer])
+        return self._stream_generation(prompt, store)
+
+    def _stream_generation(self, prompt: str, store: Callable[[str], None]) -> Iterator[str]:
+        parts = []
+        for text in self.gateway.stream("generate", self.gen_model_name, lambda: self.gen_model.generate_content(prompt, stream=True), prompt):
+            parts.append(text)
+            yield text
+        store("".join(parts))
@@ -0,0 +1,215 @@
+import logging
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from app.services.metrics import RESPONSE_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation insensitive form of a question."""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip(" ?!.")
+
+
+class _Entry:
+    __slots__ = ("corpus_key", "question", "context_key", "embedding", "answer", "created_at")
+
+    def __init__(self, corpus_key: str, question: str, context_key: str, embedding: np.ndarray, answer: str, created_at: float):
+        self.corpus_key = corpus_key
+        self.question = question
+        self.context_key = context_key
+        self.embedding = embedding
+        self.answer = answer
+        self.created_at = created_at
+
+
+class SemanticResponseCache:
+    """
+    Caches generated answers so repeated questions skip the generation call.
+
+    Lookups happen in two stages:
+    - `get_exact(corpus_key, question)`: the same (normalized) question against
+      the same corpus (document text or knowledge base version). Retrieval is
+      deterministic, so no embedding call is needed either.
+    - `get_similar(context_key, embedding)`: a paraphrased question whose
+      embedding is within `threshold` cosine similarity of a cached one AND
+      whose retrieval returned the same chunks (`context_key`). Requiring the
+      same context keeps near-identical but different questions ("type 1" vs
+      "type 2 diabetes") from sharing an answer. Entries stored without an
+      embedding (lexical-only retrieval) serve exact hits only.
+
+    Memory is bounded by `max_entries` (LRU) and `ttl_seconds`. With
+    `persist_path` entries are also written to SQLite and reloaded on start.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 2000, ttl_seconds: float = 86400, persist_path: Optional[str] = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._by_question: Dict[Tuple[str, str], int] = {}
+        self._by_context: Dict[str, Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+        self._conn = None
+        if persist_path:
+            os.makedirs(os.path.dirname(os.path.abspath(persist_path)), exist_ok=True)
+            self._conn = sqlite3.connect(persist_path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    corpus_key TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    context_key TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    answer TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (corpus_key, question)
+                )
+                """
+            )
+            self._load()
+
+    # --- Lookups ---
+
+    def get_exact(self, corpus_key: str, question: str) -> Optional[str]:
+        with self._lock:
+            entry_id = self._by_question.get((corpus_key, normalize_question(question)))
+            entry = self._live(entry_id)
+            if entry is None:
+                return None  # Counted as a miss by get_similar, which follows
+            self.hits_exact += 1
+            RESPONSE_CACHE_LOOKUPS.inc(result="hit_exact")
+            return entry.answer
+
+    def get_similar(self, context_key: str, embedding) -> Optional[str]:
+        query = self._normalize(embedding)
+        with self._lock:
+            candidates = [self._live(entry_id) for entry_id in list(self._by_context.get(context_key, ()))]
+            candidates = [entry for entry in candidates if entry is not None and entry.embedding is not None]
+            if not candidates:
+                self.misses += 1
+                RESPONSE_CACHE_LOOKUPS.inc(result="miss")
+                return None
+            scores = np.stack([entry.embedding for entry in candidates]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                RESPONSE_CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self.hits_semantic += 1
+            RESPONSE_CACHE_LOOKUPS.inc(result="hit_semantic")
+            return candidates[best].answer
+
+    # --- Updates ---
+
+    def put(self, corpus_key: str, question: str, context_key: str, embedding, answer: str):
+        if self.max_entries <= 0:
+            return
+        vector = self._normalize(embedding) if embedding is not None else None
+        entry = _Entry(corpus_key, normalize_question(question), context_key, vector, answer, time.time())
+        # SQLite is written under the lock too, so clear() and removals cannot
+        # interleave with the insert and leave deleted rows behind
+        with self._lock:
+            self._insert(entry)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (entry.corpus_key, entry.question, entry.context_key, vector.tobytes() if vector is not None else b"", entry.answer, entry.created_at),
+                )
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_question.clear()
+            self._by_context.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        lookups = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_rate": round((self.hits_exact + self.hits_semantic) / lookups, 4) if lookups else 0.0,
+        }
+
+    # --- Internals (call with the lock held) ---
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _live(self, entry_id: Optional[int]) -> Optional[_Entry]:
+        if entry_id is None or entry_id not in self._entries:
+            return None
+        entry = self._entries[entry_id]
+        if self.ttl_seconds and time.time() - entry.created_at > self.ttl_seconds:
+            self._remove(entry_id)
+            return None
+        self._entries.move_to_end(entry_id)
+        return entry
+
+    def _insert(self, entry: _Entry):
+        key = (entry.corpus_key, entry.question)
+        if key in self._by_question:
+            self._remove(self._by_question[key], persist=False)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._by_question[key] = entry_id
+        self._by_context.setdefault(entry.context_key, set()).add(entry_id)
+
+    def _remove(self, entry_id: int, persist: bool = True):
+        entry = self._entries.pop(entry_id)
+        self._by_question.pop((entry.corpus_key, entry.question), None)
+        ids = self._by_context.get(entry.context_key)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_context[entry.context_key]
+        if persist and self._conn is not None:
+            self._conn.execute("DELETE FROM responses WHERE corpus_key = ? AND question = ?", (entry.corpus_key, entry.question))
+
+    def _evict(self):
+        # Least recently used first; their rows are deleted from SQLite as well
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)), persist=True)
+
+    def _load(self):
+        oldest = time.time() - self.ttl_seconds if self.ttl_seconds else 0
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (oldest,))
+        # Rows beyond max_entries would never be loaded: drop them too
+        self._conn.execute(
+            "DELETE FROM responses WHERE rowid NOT IN (SELECT rowid FROM responses ORDER BY created_at DESC LIMIT ?)",
+            (max(self.max_entries, 0),),
+        )
+        rows = self._conn.execute(
+            "SELECT corpus_key, question, context_key, embedding, answer, created_at FROM responses ORDER BY created_at DESC LIMIT ?",
+            (max(self.max_entries, 0),),
+        ).fetchall()
+        with self._lock:
+            for corpus_key, question, context_key, embedding, answer, created_at in reversed(rows):
+                self._insert(_Entry(corpus_key, question, context_key, np.frombuffer(embedding, dtype=np.float32) if embedding else None, answer, created_at))
+        if rows:
+            logger.info(f"Loaded {len(rows)} cached responses")
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from app.services.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'arrays.json'
+
+
+def attach_arrays(directory: str) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Memory-maps (read-only) every array written by `publish_arrays`, or
+    returns None if the directory is missing or incomplete. Pages are shared
+    through the OS page cache, so N worker processes attaching the same
+    directory hold one copy of the data.
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r') as f:
+            names = json.load(f)['arrays']
+        # Plain ndarray views of the maps: np.memmap results add overhead to every operation
+        return {name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')) for name in names}
+    except (OSError, ValueError, KeyError) as e:
+        if os.path.exists(manifest_path):
+            logger.warning(f"Ignoring unreadable shared arrays in {directory}: {e}")
+        return None
+
+
+def publish_arrays(directory: str, arrays: Dict[str, np.ndarray]):
+    """
+    Writes `arrays` as .npy files into `directory`: into a temporary sibling
+    first, then renamed into place, so readers see all arrays or none.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = f"{directory}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.asarray(array))
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+        json.dump({'arrays': list(arrays)}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(tmp_dir, directory)
+
+
+def shared_arrays(directory: str, build: Callable[[], Dict[str, np.ndarray]], prune_prefix: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """
+    Attaches the arrays in `directory`, building and publishing them first
+    if needed. Workers starting together serialize on a lock file, so
+    `build` runs in one process only and the others attach its result.
+    After a build, sibling directories named `prune_prefix*` (older
+    versions) are deleted; processes still mapping them are unaffected.
+    """
+    arrays = attach_arrays(directory)
+    if arrays is not None:
+        return arrays
+    with file_lock(f"{directory}.lock"):
+        arrays = attach_arrays(directory)
+        if arrays is None:
+            publish_arrays(directory, build())
+            arrays = attach_arrays(directory)
+            if prune_prefix:
+                _prune(directory, prune_prefix)
+    return arrays
+
+
+def _prune(directory: str, prefix: str):
+    parent, current = os.path.split(os.path.abspath(directory))
+    for name in os.listdir(parent):
+        if name.startswith(prefix) and name != current and not name.endswith(('.lock', '.tmp')):
+            shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+
+
+def source_key(path: str, *extra) -> str:
+    """Short key of a source file's identity (path, size, mtime) plus build parameters."""
+    stat = os.stat(path)
+    identity = json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime_ns, *extra])
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,52 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from app.services.metrics import SINGLE_FLIGHT_REQUESTS
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests: the first request for a key
+    (the leader) starts the computation, requests for the same key arriving
+    while it runs (followers) wait for it and get the same result, or the
+    same exception. Once it finishes the key is forgotten; later repeats are
+    served by the response and image caches instead.
+
+    Lives on the event loop (no locks needed). A leader whose client
+    disconnects does not cancel the computation its followers wait for.
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is not None:
+            self.followers += 1
+            SINGLE_FLIGHT_REQUESTS.inc(route=self.route, role="follower")
+            return await asyncio.shield(call)
+
+        self.leaders += 1
+        SINGLE_FLIGHT_REQUESTS.inc(route=self.route, role="leader")
+        call = asyncio.ensure_future(compute())
+        self._calls[key] = call
+        call.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(call)
+
+    def _finish(self, key: str, call: asyncio.Future):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.cancelled():
+            call.exception()  # Retrieved here in case every waiter has gone
+
+    def stats(self) -> dict:
+        total = self.leaders + self.followers
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "coalesced_ratio": round(self.followers / total, 4) if total else 0.0
+        }
@@ -1,6 +1,53 @@
+import logging
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import google.generativeai as genai
+import hashlib
 import os
+import threading
+from typing import List, Optional
+from app.services.gemini_gateway import GeminiGateway, get_gateway
+
+logger = logging.getLogger(__name__)
+
+# Split points tried in order when cutting a document into sections
+SECTION_SEPARATORS = ("\n\n", "\n", ". ", " ")
+
+
+def split_sections(text: str, max_chars: int) -> List[str]:
+    """
+    Splits text into sections of at most `max_chars`, cutting at paragraph
+    boundaries where possible, then lines, sentences and finally words.
+    """
+    if len(text) <= max_chars:
+        return [text] if text.strip() else []
+
+    for separator in SECTION_SEPARATORS:
+        pieces = text.split(separator)
+        if len(pieces) > 1:
+            break
+    else:
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+    sections, current = [], ""
+    for piece in pieces:
+        candidate = f"{current}{separator}{piece}" if current else piece
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current.strip():
+            sections.append(current)
+        if len(piece) > max_chars:
+            # A single oversized paragraph: split it at the next finer boundary
+            sections.extend(split_sections(piece, max_chars))
+            current = ""
+        else:
+            current = piece
+    if current.strip():
+        sections.append(current)
+    return sections
 
 class Summarizer(ABC):
     @abstractmethod
@@ -10,29 +57,95 @@ class Summarizer(ABC):
 import google.generativeai as genai
 
 class GeminiSummarizer(Summarizer):
-    def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-flash-lite')
-        print(f"Initialized Gemini Summarizer with model: gemini-2.5-flash-lite")
+    """
+    Short reports are summarized with one prompt. Longer ones are summarized
+    map-reduce style: the text is split into sections at paragraph boundaries,
+    the sections are summarized concurrently (bounded by `max_concurrency`
+    across all jobs) and the section summaries are combined into the final
+    patient summary, reducing again if they are still too long. Section
+    summaries are cached by content hash, so re-processing a document only
+    pays for the sections that changed.
+    """
+
+    def __init__(self, api_key: str, single_pass_chars: int = 30000, section_chars: int = 12000, max_concurrency: int = 4, cache_size: int = 1024, gateway: Optional[GeminiGateway] = None):
+        # Rate limits, adaptive concurrency and retries shared with the other services
+        self.gateway = gateway or get_gateway()
+        self.gateway.configure(api_key)
+        self.model_name = 'gemini-2.5-flash-lite'
+        self.model = genai.GenerativeModel(self.model_name)
+        self.single_pass_chars = single_pass_chars
+        self.section_chars = section_chars
+        self.pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="summarize")
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        logger.info(f"Initialized Gemini Summarizer with model: gemini-2.5-flash-lite")
 
     def summarize(self, text: str) -> str:
         try:
-            clean_text = text[:30000] # Safe truncation
+            if len(text) <= self.single_pass_chars:
+                return self._summarize_report(text)
 
-            prompt = (
-                "Analyze this medical report and provide a concise summary for the patient. "
-                "Include key findings, any abnormal results, and doctor's recommendations if present. "
-                "Keep it simple and easy to understand. "
-                "DISCLAIMER: This is not a medical diagnosis.\n\n"
-                f"Content:\n{clean_text}"
-            )
-            
-            response = self.model.generate_content(prompt)
-            return response.text
+            # 1. Map: summarize every section concurrently
+            sections = split_sections(text, self.section_chars)
+            logger.info(f"Summarizing {len(text)} chars as {len(sections)} sections")
+            section_summaries = self._map(self._summarize_section, sections)
+
+            # 2. Reduce: combine until the notes fit in a single prompt
+            notes = "\n\n".join(section_summaries)
+            while len(notes) > self.single_pass_chars:
+                parts = split_sections(notes, self.section_chars)
+                reduced = "\n\n".join(self._map(self._summarize_section, parts))
+                if len(reduced) >= len(notes):
+                    break  # Not shrinking any further; send what we have
+                notes = reduced
+            return self._summarize_report(notes, from_sections=True)
         except Exception as e:
-            print(f"Summarization failed: {e}")
+            logger.error(f"Summarization failed: {e}")
             raise e
 
+    def _map(self, fn, items) -> List[str]:
+        """pool.map that carries the caller's context (e.g. the job's Gemini priority) into the workers."""
+        futures = [self.pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _summarize_report(self, content: str, from_sections: bool = False) -> str:
+        subject = "these notes, taken from consecutive sections of one medical report," if from_sections else "this medical report"
+        prompt = (
+            f"Analyze {subject} and provide a concise summary for the patient. "
+            "Include key findings, any abnormal results, and doctor's recommendations if present. "
+            "Keep it simple and easy to understand. "
+            "DISCLAIMER: This is not a medical diagnosis.\n\n"
+            f"Content:\n{content}"
+        )
+        response = self.gateway.call("generate", self.model_name, lambda: self.model.generate_content(prompt), prompt, lambda r: r.text)
+        return response.text
+
+    def _summarize_section(self, section: str) -> str:
+        key = hashlib.sha256(section.encode('utf-8')).hexdigest()
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        prompt = (
+            "This is one section of a longer medical report. "
+            "Write compact notes covering every finding, measurement, abnormal result, diagnosis, "
+            "medication and recommendation in it. Keep exact values and dates; do not add anything "
+            "that is not in the text.\n\n"
+            f"Section:\n{section}"
+        )
+        summary = self.gateway.call("generate", self.model_name, lambda: self.model.generate_content(prompt), prompt, lambda r: r.text).text
+
+        with self._cache_lock:
+            self._cache[key] = summary
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return summary
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
     def answer_question(self, context: str, question: str) -> str:
         try:
             prompt = (
@@ -45,5 +158,5 @@ class GeminiSummarizer(Summarizer):
             response = self.model.generate_content(prompt)
             return response.text
         except Exception as e:
-            print(f"Q&A failed: {e}")
+            logger.error(f"Q&A failed: {e}")
             raise e
@@ -0,0 +1,147 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+from app.services.embedding_index import normalize_rows
+
+SUPPORTED_DTYPES = ('float32', 'float16', 'int8')
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without a full sort."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Cosine k-means over L2-normalized rows; returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(vectors.shape[0], n_clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~np.any(sums, axis=1)
+        if empty.any():
+            # Re-seed empty clusters from random points
+            sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Cosine-similarity search over a fixed embedding matrix.
+
+    Rows are L2-normalized once at build time and kept in one contiguous array,
+    optionally quantized to float16 (2x smaller) or int8 with a per-row scale
+    (4x smaller). Scoring converts blocks back to float32 for BLAS; NumPy's
+    float16 conversion is slow, so int8 is usually the faster compressed option. With
+    `nlist > 0` an IVF coarse index is built: rows are grouped by their nearest
+    k-means centroid and a query only scores the `nprobe` closest groups.
+    """
+
+    def __init__(self, embeddings, dtype: str = 'float32', nlist: int = 0, nprobe: int = 8, block_rows: int = 1024, seed: int = 0):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dtype {dtype}, expected one of {SUPPORTED_DTYPES}")
+        self.dtype = dtype
+        self.nprobe = nprobe
+        self.block_rows = block_rows
+
+        vectors = normalize_rows(embeddings)
+        self.size = vectors.shape[0]
+        self.dim = vectors.shape[1] if vectors.ndim == 2 else 0
+
+        # Original row id of every stored row (rows are regrouped for IVF)
+        self.ids = np.arange(self.size)
+        self.centroids = None
+        self.list_offsets = None
+        if nlist and self.size >= nlist:
+            self.centroids = spherical_kmeans(vectors, nlist, seed=seed)
+            assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+            self.ids = np.argsort(assignment, kind='stable')
+            vectors = vectors[self.ids]
+            self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+
+        self.scales = None
+        if dtype == 'float16':
+            self.vectors = vectors.astype(np.float16)
+        elif dtype == 'int8':
+            self.scales = np.abs(vectors).max(axis=1).astype(np.float32) / 127.0
+            self.scales[self.scales == 0] = 1.0
+            self.vectors = np.round(vectors / self.scales[:, None]).astype(np.int8)
+        else:
+            self.vectors = vectors
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """The built index as plain arrays (see `from_arrays`)."""
+        arrays = {'vectors': self.vectors, 'ids': self.ids}
+        if self.scales is not None:
+            arrays['scales'] = self.scales
+        if self.centroids is not None:
+            arrays['centroids'] = self.centroids
+            arrays['list_offsets'] = self.list_offsets
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], nprobe: int = 8, block_rows: int = 1024) -> "VectorIndex":
+        """
+        An index over already built arrays, e.g. memory-mapped ones shared by
+        several worker processes; nothing is normalized, quantized or copied.
+        """
+        index = cls.__new__(cls)
+        index.vectors = arrays['vectors']
+        index.dtype = str(index.vectors.dtype)
+        index.nprobe = nprobe
+        index.block_rows = block_rows
+        index.size = index.vectors.shape[0]
+        index.dim = index.vectors.shape[1] if index.vectors.ndim == 2 else 0
+        index.ids = arrays['ids']
+        index.scales = arrays.get('scales')
+        index.centroids = arrays.get('centroids')
+        index.list_offsets = arrays.get('list_offsets')
+        return index
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def _score_range(self, query: np.ndarray, start: int, stop: int) -> np.ndarray:
+        if self.dtype == 'float32':
+            return self.vectors[start:stop] @ query
+        scores = np.empty(stop - start, dtype=np.float32)
+        for block in range(start, stop, self.block_rows):
+            end = min(block + self.block_rows, stop)
+            scores[block - start:end - start] = self.vectors[block:end].astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales[start:stop]
+        return scores
+
+    def search(self, query, k: int = 3, nprobe: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (row ids, cosine scores) of the k best matches, best first."""
+        if self.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        if self.centroids is None:
+            scores = self._score_range(query, 0, self.size)
+            best = top_k_indices(scores, k)
+            return self.ids[best], scores[best]
+
+        # IVF: score only the rows of the closest lists
+        probe = top_k_indices(self.centroids @ query, nprobe or self.nprobe)
+        ranges = [(self.list_offsets[c], self.list_offsets[c + 1]) for c in probe]
+        positions = np.concatenate([np.arange(a, b) for a, b in ranges])
+        scores = np.concatenate([self._score_range(query, a, b) for a, b in ranges])
+        best = top_k_indices(scores, k)
+        return self.ids[positions[best]], scores[best]
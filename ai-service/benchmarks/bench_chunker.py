@@ -0,0 +1,90 @@
+"""
+Chunk counts (= embedding items) and chunking time of StructuredChunker
+against the old fixed 1000/200 window, on synthetic report PDFs run through
+the real extractor:
+
+    python benchmarks/bench_chunker.py --pages 1 10 50
+
+Before measuring, it checks that header/footer removal and near-duplicate
+dropping keep lab rows, dates and panels that differ between visits.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic_docs
+from app.services.chunker import FixedWindowChunker, StructuredChunker
+from app.services.text_extractor import PDFTextExtractor
+
+
+def measure(chunker, text: str, repeats: int):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = chunker.chunk(text)
+    elapsed = (time.perf_counter() - start) / repeats * 1000
+    sizes = [len(c) for c in result.chunks] or [0]
+    return result, elapsed, sum(sizes) / len(sizes)
+
+
+def check_values_kept():
+    """Values that differ between visits (a trend) survive boilerplate removal and deduplication."""
+    # Rows differing only in their numbers are not a repeated header/footer
+    pages = [
+        f"City General Hospital\nHbA1c {hba1c} %\nLDL {ldl} mg/dL\nVisit {visit}\nPage {i + 1} of 3"
+        for i, (hba1c, ldl, visit) in enumerate([("6.8", 120, "2024-01-10"), ("8.4", 160, "2024-06-10"), ("7.1", 140, "2024-11-10")])
+    ]
+    text = "\n".join(StructuredChunker().chunk("\f".join(pages)).chunks)
+    for row in ("HbA1c 6.8 %", "HbA1c 8.4 %", "HbA1c 7.1 %", "LDL 120 mg/dL", "LDL 160 mg/dL", "Visit 2024-01-10", "Visit 2024-06-10"):
+        assert row in text, f"boilerplate removal dropped {row!r}"
+    assert text.count("City General Hospital") == 1 and "Page 2 of 3" not in text, "header/footer not removed"
+
+    # A row identical on both pages of a two-page report is content
+    pages = ["Potassium 4.1 mmol/L\nSodium 140 mmol/L\nNotes: stable\nHbA1c 6.8 %", "Potassium 4.1 mmol/L\nSodium 138 mmol/L\nNotes: review\nHbA1c 6.8 %"]
+    text = "\n".join(StructuredChunker().chunk("\f".join(pages)).chunks)
+    assert text.count("Potassium 4.1 mmol/L") == 2 and text.count("HbA1c 6.8 %") == 2, "two-page report lost a repeated row"
+
+    # Two visits' panels differing in one value are not near duplicates (shingle Jaccard >= 0.9)
+    panel = [f"{name}: {{{i}}} {unit} (reference range {low} to {high}) reported by the central laboratory"
+             for i, (name, unit, low, high) in enumerate(synthetic_docs.TESTS[:11])]
+    values = [round((low + high) / 2, 1) for _, _, low, high in synthetic_docs.TESTS[:11]]
+    visits = ["\n".join(panel).format(*values), "\n".join(panel).format(*values[:4], 8.4, *values[5:])]
+    result = StructuredChunker(max_chars=max(map(len, visits))).chunk("\n\n".join(visits))
+    assert len(result.chunks) == 2 and "HbA1c: 8.4 %" in result.chunks[1], "later visit's panel dropped as a near duplicate"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--max-chars", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    check_values_kept()
+
+    extractor = PDFTextExtractor()
+    pdf_dir = tempfile.mkdtemp(prefix="bench-chunker-")
+    fixed = FixedWindowChunker()
+    structured = StructuredChunker(max_chars=args.max_chars)
+
+    print(f"{'pages':>5} {'chars':>8} | {'fixed':>6} {'ms':>6} | {'struct':>6} {'ms':>6} {'avg':>5} | {'saved':>6} {'boiler':>6} {'dups':>5}")
+    for pages in args.pages:
+        path = synthetic_docs.make_report_pdf(pdf_dir, pages, args.seed)
+        text = extractor.extract_text(path, "application/pdf")
+        fixed_result, fixed_ms, _ = measure(fixed, text, args.repeats)
+        result, ms, avg = measure(structured, text, args.repeats)
+        stats = result.stats
+        saved = 1 - len(result.chunks) / max(len(fixed_result.chunks), 1)
+        print(
+            f"{pages:>5} {len(text):>8} | {len(fixed_result.chunks):>6} {fixed_ms:>6.2f} | "
+            f"{len(result.chunks):>6} {ms:>6.2f} {avg:>5.0f} | {saved:>6.1%} "
+            f"{stats['boilerplate_lines_removed']:>6} {stats['duplicate_chunks_dropped']:>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Latency benchmark of CompiledForest against sklearn's predict_proba, with a
+bit-identity check on the probabilities. Needs the artifacts written by
+`python app/ml/train_model.py`:
+
+    python benchmarks/bench_forest.py --rows 10000
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.forest_inference import CompiledForest
+
+MODEL_DIR = os.path.join(os.path.dirname(__file__), '../app/models')
+
+
+def per_call_ms(fn, repeats: int) -> float:
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="Rows for the batch measurement")
+    parser.add_argument("--distinct", type=int, default=300, help="Distinct rows in the repeated-input batch")
+    parser.add_argument("--repeats", type=int, default=200, help="Calls for the single-row measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import joblib
+    clf = joblib.load(os.path.join(MODEL_DIR, 'disease_model.pkl'))
+    clf.n_jobs = 1  # Threaded accumulation would make sklearn's own sums order-dependent
+    forest = CompiledForest.load(os.path.join(MODEL_DIR, 'disease_forest.npz'))
+
+    rng = np.random.default_rng(args.seed)
+    X = (rng.random((args.rows, forest.n_features)) < 0.15).astype(np.uint8)
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+    expected = clf.predict_proba(X)
+    actual = forest.predict_proba(X)
+    identical = np.array_equal(expected, actual)
+    print(f"{forest.n_estimators} trees, {len(forest.feature)} nodes, max depth {forest.max_depth}")
+    print(f"Bit-identical probabilities on {args.rows} rows: {identical}")
+    if not identical:
+        print(f"  max abs diff: {np.abs(expected - actual).max():.3e}")
+
+    single = X[:1]
+    print(f"\n{'':<22}{'sklearn':>12}{'compiled':>12}")
+    sk_single = per_call_ms(lambda: clf.predict_proba(single), args.repeats)
+    cf_single = per_call_ms(lambda: forest.predict_proba(single), args.repeats)
+    print(f"{'1 row (ms/call)':<22}{sk_single:>12.3f}{cf_single:>12.3f}")
+    sk_batch = per_call_ms(lambda: clf.predict_proba(X), 3)
+    cf_batch = per_call_ms(lambda: forest.predict_proba(X), 3)
+    print(f"{f'{args.rows} rows (ms/call)':<22}{sk_batch:>12.1f}{cf_batch:>12.1f}")
+
+    # Real symptom batches repeat; the compiled forest walks distinct rows only once
+    X_repeated = X[rng.integers(0, args.distinct, args.rows)]
+    identical = identical and np.array_equal(clf.predict_proba(X_repeated), forest.predict_proba(X_repeated))
+    sk_rep = per_call_ms(lambda: clf.predict_proba(X_repeated), 3)
+    cf_rep = per_call_ms(lambda: forest.predict_proba(X_repeated), 3)
+    print(f"{f'  {args.distinct} distinct':<22}{sk_rep:>12.1f}{cf_rep:>12.1f}")
+
+    sys.exit(0 if identical else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Interactive latency and 429s while a document backlog hammers a rate-limited
+Gemini (benchmarks/fake_genai.py with a per-second quota, i.e. the per-minute
+quota scaled down 60x):
+
+    python benchmarks/bench_gemini_gateway.py --quota 20 --bulk 300 --bulk-threads 32
+
+Three setups run the same load, bulk generate calls from --bulk-threads
+document workers plus one interactive call every --interactive-interval s:
+- direct:      calls go straight to the API (the old per-service behaviour)
+- gateway/fifo: shared GeminiGateway, bulk calls not marked as background
+- gateway:     shared GeminiGateway, bulk calls under background()
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fake_genai
+
+genai = fake_genai.install()
+
+from app.services import gemini_gateway
+from app.services.gemini_gateway import GeminiGateway
+
+MODEL = "gemini-2.5-flash"
+
+
+def run(label: str, gateway, args, mark_background: bool):
+    fake_genai.reset_counters()
+    model = genai.GenerativeModel(MODEL)
+    failures = {"bulk": 0, "interactive": 0}
+    interactive_ms = []
+
+    def generate(prompt: str):
+        if gateway is None:
+            return model.generate_content(prompt)
+        return gateway.call("generate", MODEL, lambda: model.generate_content(prompt))
+
+    def bulk(i: int):
+        try:
+            with gemini_gateway.background() if mark_background else nullcontext():
+                generate(f"summarize document {i}")
+        except Exception:
+            failures["bulk"] += 1
+
+    stop = threading.Event()
+
+    def interactive():
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                generate(f"question {i}")
+                interactive_ms.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                failures["interactive"] += 1
+            i += 1
+            stop.wait(args.interactive_interval)
+
+    start = time.perf_counter()
+    probe = threading.Thread(target=interactive)
+    probe.start()
+    with ThreadPoolExecutor(max_workers=args.bulk_threads) as pool:
+        list(pool.map(bulk, range(args.bulk)))
+    bulk_seconds = time.perf_counter() - start
+    stop.set()
+    probe.join()
+
+    p50, p99 = np.percentile(interactive_ms, [50, 99]) if interactive_ms else (float("nan"), float("nan"))
+    print(
+        f"{label:<13} bulk {bulk_seconds:6.1f}s  failed {failures['bulk']:>4}/{args.bulk}   "
+        f"interactive n={len(interactive_ms) + failures['interactive']:>3} p50 {p50:7.0f} ms  p99 {p99:7.0f} ms  failed {failures['interactive']:>3}   "
+        f"429s {fake_genai.CALLS['throttled']:>5}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quota", type=int, default=20, help="API calls allowed per second")
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds per generate call")
+    parser.add_argument("--bulk", type=int, default=300, help="Bulk (document job) calls")
+    parser.add_argument("--bulk-threads", type=int, default=32)
+    parser.add_argument("--interactive-interval", type=float, default=0.25)
+    args = parser.parse_args()
+
+    fake_genai.install(generate_latency=args.latency, jitter=args.latency * 0.2, quota_per_second=args.quota)
+
+    def gateway():
+        # Backoff scaled down like the quota window; the limit sits just under the quota
+        return GeminiGateway(
+            rate_limits={"generate": args.quota * 60 * 0.95}, max_attempts=8, interactive_max_attempts=3,
+            backoff_base=0.1, backoff_max=2.0
+        )
+
+    print(f"quota {args.quota}/s, {args.latency * 1000:.0f} ms per call, {args.bulk} bulk calls from {args.bulk_threads} threads")
+    run("direct", None, args, mark_background=False)
+    run("gateway/fifo", gateway(), args, mark_background=False)
+    run("gateway", gateway(), args, mark_background=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Latency and recall of the retrieval modes (dense, hybrid, lexical, auto) of
+RAGService and MedRagService against the dense-only path, offline with the
+fake Gemini client:
+
+    python benchmarks/bench_hybrid_retrieval.py --pages 20 --queries 200 --embed-latency 0.08
+
+Per mode:
+- ms/query: wall time of retrieval including the (simulated) embedding round trip
+- embeds/q: embedding API calls per query
+- agree@k:  overlap of the top-k with the dense-only top-k
+- prec@k:   for questions naming a lab test, the share of the top-k chunks or
+            records that mention it (keyword ground truth)
+
+The fake embeddings are bag-of-words hashes, so dense retrieval is itself
+fairly lexical here; real embeddings diverge more from BM25 in both directions.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_genai
+import synthetic_docs
+
+MODES = ("dense", "hybrid", "lexical", "auto")
+
+
+def report(label: str, rows):
+    print(f"\n{label}")
+    print(f"{'mode':<10}{'ms/query':>10}{'embeds/q':>10}{'agree@k':>10}{'prec@k':>8}")
+    for mode, ms, embeds, agree, hit in rows:
+        print(f"{mode:<10}{ms:>10.2f}{embeds:>10.2f}{agree:>10.3f}{hit:>8.3f}")
+
+
+def evaluate(run_query, queries, truths, k: int):
+    """run_query(question) -> top ids; returns per-query tops, ms/query, embeds/query, precision."""
+    fake_genai.reset_counters()
+    tops = []
+    start = time.perf_counter()
+    for question in queries:
+        tops.append([int(i) for i in run_query(question)][:k])
+    ms = (time.perf_counter() - start) / len(queries) * 1000
+    embeds = fake_genai.CALLS["embed"] / len(queries)
+    graded = [(top, truth) for top, truth in zip(tops, truths) if truth]
+    precision = sum(len(set(top) & truth) for top, truth in graded) / max(len(graded) * k, 1)
+    return tops, ms, embeds, precision
+
+
+def agreement(tops, dense_tops, k: int) -> float:
+    return sum(len(set(a) & set(b)) for a, b in zip(tops, dense_tops)) / max(len(tops) * k, 1)
+
+
+def bench_document(args, state_dir: str):
+    from app.services.embedding_index import DocumentEmbeddingIndex, content_hash
+    from app.services.rag_service import RAGService
+
+    text = "\n\f".join("\n".join(lines) for lines in synthetic_docs.report_pages(args.pages, args.seed))
+    text_hash = content_hash(text)
+    index = DocumentEmbeddingIndex(os.path.join(state_dir, "doc_index"))
+    queries = synthetic_docs.questions(args.queries, args.seed)
+
+    services = {mode: RAGService(api_key="bench", index=index, retrieval_mode=mode) for mode in MODES}
+    chunks, _ = services["dense"].index_document("bench-doc", text)  # Embedded once, shared by all modes
+    test_names = [name for name, *_ in synthetic_docs.TESTS]
+    truths = []
+    for question in queries:
+        named = [name for name in test_names if name in question]
+        truths.append({i for i, chunk in enumerate(chunks) if named and named[0] in chunk})
+
+    rows, dense_tops = [], None
+    for mode in MODES:
+        service = services[mode]
+        service.index_document("bench-doc", text)  # Builds the BM25 index like process_document does
+        tops, ms, embeds, hit = evaluate(
+            lambda q: service.retrieve("bench-doc", text, text_hash, q, top_k=args.k)[1], queries, truths, args.k
+        )
+        dense_tops = dense_tops or tops
+        rows.append((mode, ms, embeds, agreement(tops, dense_tops, args.k), hit))
+    report(f"RAGService: {args.pages}-page report, {len(chunks)} chunks, {len(queries)} questions", rows)
+
+
+def knowledge_base(n_records: int, seed: int):
+    """MedQuAD-shaped records about the synthetic lab tests and notes."""
+    rng = random.Random(seed)
+    templates = [
+        ("What is {t}?", "{t} is a laboratory measurement reported in {u}. The usual reference range is {lo} to {hi} {u}."),
+        ("What causes high {t}?", "Elevated {t} can be caused by infection, dehydration, medication or chronic disease."),
+        ("What causes low {t}?", "A low {t} result may follow blood loss, malnutrition or reduced production."),
+        ("How is {t} tested?", "{t} is measured from a blood sample; fasting may be required."),
+    ]
+    filler = [note.split(".")[0] for note in synthetic_docs.NOTES]
+    records = []
+    while len(records) < n_records:
+        name, unit, low, high = rng.choice(synthetic_docs.TESTS)
+        question, answer = rng.choice(templates)
+        answer = answer.format(t=name, u=unit, lo=low, hi=high) + " " + " ".join(rng.sample(filler, 2)) + "."
+        records.append({"id": f"r{len(records)}", "question": question.format(t=name), "answer": answer})
+    return records
+
+
+def bench_knowledge_base(args, state_dir: str):
+    from app.services.med_rag_service import MedRagService
+
+    records = knowledge_base(args.records, args.seed)
+    data_path = os.path.join(state_dir, "kb.json")
+    with open(data_path, "w") as f:
+        json.dump(records, f)
+    snapshot_dir = os.path.join(state_dir, "kb_snapshot")
+    queries = synthetic_docs.questions(args.queries, args.seed + 1)
+    test_names = [name for name, *_ in synthetic_docs.TESTS]
+
+    rows, dense_tops, truths = [], None, None
+    for mode in MODES:
+        service = MedRagService("bench", data_path=data_path, snapshot_dir=snapshot_dir, retrieval_mode=mode)
+        if truths is None:
+            truths = []
+            for question in queries:
+                named = [name for name in test_names if name in question]
+                truths.append({i for i, doc in enumerate(service.documents) if named and named[0] in doc["text"]})
+        tops, ms, embeds, hit = evaluate(lambda q: service.search(q, top_k=args.k)[1], queries, truths, args.k)
+        dense_tops = dense_tops or tops
+        rows.append((mode, ms, embeds, agreement(tops, dense_tops, args.k), hit))
+    report(f"MedRagService: {len(records)} records, {len(queries)} questions", rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--embed-latency", type=float, default=0.08, help="Simulated embedding round trip (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake_genai.install(embed_latency=args.embed_latency, generate_latency=0.0)
+    state_dir = tempfile.mkdtemp(prefix="bench-hybrid-")
+    bench_document(args, state_dir)
+    bench_knowledge_base(args, state_dir)
+
+
+if __name__ == "__main__":
+    main()
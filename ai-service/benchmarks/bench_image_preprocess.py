@@ -0,0 +1,58 @@
+"""
+Upload size and CPU time of ImagePreprocessor against what the SDK did with
+a PIL image before (full resolution, lossless WebP), on synthetic scans:
+
+    python benchmarks/bench_image_preprocess.py --sizes 1024 2048 4096 --max-side 1536
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+import PIL.Image
+
+import synthetic_docs
+from app.services.image_preprocessor import ImagePreprocessor
+
+
+def sdk_webp(data: bytes):
+    """The old path: decode at full size, encode lossless WebP (google.generativeai's _pil_to_blob)."""
+    start = time.perf_counter()
+    image = PIL.Image.open(io.BytesIO(data))
+    buffer = io.BytesIO()
+    image.save(buffer, format="webp", lossless=True)
+    return len(buffer.getvalue()), (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 2048, 4096])
+    parser.add_argument("--formats", nargs="+", default=["PNG", "JPEG"])
+    parser.add_argument("--max-side", type=int, default=1536)
+    parser.add_argument("--encoding", default="JPEG")
+    args = parser.parse_args()
+
+    preprocessor = ImagePreprocessor(max_side=args.max_side, encoding=args.encoding)
+    print(f"{'upload':<12}{'bytes':>10} | {'old KB':>8}{'ms':>8} | {'new KB':>8}{'ms':>8}{'size':>11} | {'sent':>6}")
+    for fmt in args.formats:
+        for side in args.sizes:
+            data = synthetic_docs.make_image(side, side * 3 // 4, seed=side, fmt=fmt)
+            old_bytes, old_ms = sdk_webp(data)
+            start = time.perf_counter()
+            prepared = preprocessor.prepare(io.BytesIO(data))
+            new_ms = (time.perf_counter() - start) * 1000
+            label = f"{fmt} {side}"
+            print(
+                f"{label:<12}{len(data):>10} | {old_bytes / 1024:>8.0f}{old_ms:>8.1f} | "
+                f"{len(prepared.data) / 1024:>8.0f}{new_ms:>8.1f}{f'{prepared.width}x{prepared.height}':>11} | "
+                f"{len(prepared.data) / old_bytes:>6.1%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
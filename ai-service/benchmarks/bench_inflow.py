@@ -0,0 +1,143 @@
+"""
+Ingest and forecast latency of InflowForecaster on a synthetic appointment
+export (weekly seasonality, trend, per-department volumes), plus a backtest of
+the forecast against a same-weekday-last-week baseline:
+
+    python benchmarks/bench_inflow.py --years 3 --per-day 300 --departments 12
+
+Reported:
+- initial ingest of the whole export, reload from the persisted aggregates,
+  and an incremental refresh after one more day is appended
+- forecast latency: first call after new events (fit) and cached calls
+- MAPE of 7-day forecasts over the last --backtest-weeks weeks, per series
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.services.inflow_forecaster import CsvEventSource, InflowForecaster, seasonal_trend_forecast, weekday
+
+WEEKLY = np.array([1.15, 1.1, 1.05, 1.0, 0.95, 0.55, 0.3])  # Mon..Sun
+HOURLY = np.exp(-0.5 * ((np.arange(24) - 11) / 3.0) ** 2)
+
+
+def daily_means(first_day: int, n_days: int, n_departments: int, per_day: float, rng) -> np.ndarray:
+    """days x departments expected counts."""
+    days = first_day + np.arange(n_days)
+    shares = rng.dirichlet(np.ones(n_departments) * 2)
+    trend = 1 + 0.15 * np.arange(n_days) / 365.0
+    annual = 1 + 0.1 * np.sin(2 * np.pi * np.arange(n_days) / 365.25)
+    return per_day * np.outer(WEEKLY[weekday(days)] * trend * annual, shares)
+
+
+def write_events(path: str, first_day: int, means: np.ndarray, rng, mode: str = 'w'):
+    counts = rng.poisson(means)
+    hour_p = HOURLY / HOURLY.sum()
+    with open(path, mode, newline='') as f:
+        writer = csv.writer(f)
+        if mode == 'w':
+            writer.writerow(['schedule', 'department', 'status'])
+        for d, row in enumerate(counts):
+            day_seconds = (first_day + d) * 86400
+            for dept, n in enumerate(row):
+                hours = rng.choice(24, size=n, p=hour_p)
+                minutes = rng.integers(0, 60, size=n)
+                cancelled = rng.random(n) < 0.08
+                for h, m, c in zip(hours, minutes, cancelled):
+                    stamp = time.strftime('%Y-%m-%dT%H:%M:00Z', time.gmtime(day_seconds + h * 3600 + m * 60))
+                    writer.writerow([stamp, f"dept-{dept}", 'cancelled' if c else 'completed'])
+    return counts
+
+
+def backtest(forecaster: InflowForecaster, weeks: int, history_weeks: int):
+    """MAPE of 7-day forecasts made at each of the last `weeks` week starts."""
+    daily = forecaster.counts[:forecaster.n_days].sum(axis=1).astype(np.float64)
+    series = np.column_stack([daily.sum(axis=1), daily])
+    errors, naive_errors = [], []
+    for w in range(weeks, 0, -1):
+        cut = series.shape[0] - 7 * w
+        history = series[cut - history_weeks * 7:cut]
+        actual = series[cut:cut + 7]
+        last_day = forecaster.origin + cut - 1
+        mean, _, _ = seasonal_trend_forecast(history, int(weekday(last_day)), np.arange(1, 8))
+        naive = history[-7:]
+        scale = np.maximum(actual, 1)
+        errors.append(np.abs(mean - actual) / scale)
+        naive_errors.append(np.abs(naive - actual) / scale)
+    return np.mean(errors, axis=(0, 1)), np.mean(naive_errors, axis=(0, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--per-day", type=float, default=300)
+    parser.add_argument("--departments", type=int, default=12)
+    parser.add_argument("--history-weeks", type=int, default=8)
+    parser.add_argument("--backtest-weeks", type=int, default=12)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench-inflow-")
+    path = os.path.join(workdir, "appointments.csv")
+    today = int(time.time() // 86400)
+    n_days = int(args.years * 365)
+    first_day = today - n_days
+    means = daily_means(first_day, n_days + 1, args.departments, args.per_day, rng)
+
+    start = time.perf_counter()
+    write_events(path, first_day, means[:n_days], rng)
+    print(f"export: {os.path.getsize(path) / 1e6:.1f} MB written in {time.perf_counter() - start:.1f}s")
+
+    def build():
+        return InflowForecaster(CsvEventSource(path), state_dir=os.path.join(workdir, "state"),
+                                history_weeks=args.history_weeks, refresh_seconds=0)
+
+    start = time.perf_counter()
+    forecaster = build()
+    print(f"initial ingest: {forecaster.events} events, {forecaster.n_days} days in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    forecaster = build()
+    print(f"restart (persisted aggregates): {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def timed_calls(label, fn):
+        samples = []
+        for _ in range(args.calls):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"{label:<32} p50 {np.percentile(samples, 50):7.3f} ms  p99 {np.percentile(samples, 99):7.3f} ms")
+
+    start = time.perf_counter()
+    forecaster.forecast(30)
+    print(f"{'forecast after new events (fit)':<32} {(time.perf_counter() - start) * 1000:7.3f} ms")
+    timed_calls("cached 7-day forecast", lambda: forecaster.forecast(7))
+    timed_calls("cached 30-day, one department", lambda: forecaster.forecast(30, department="dept-0", hourly=True))
+
+    mape, naive_mape = backtest(forecaster, args.backtest_weeks, args.history_weeks)
+    print(f"\n7-day MAPE over {args.backtest_weeks} weeks   forecast   last-week naive")
+    print(f"{'total':<32}{mape[0]:>9.1%}{naive_mape[0]:>18.1%}")
+    print(f"{'departments (mean)':<32}{mape[1:].mean():>9.1%}{naive_mape[1:].mean():>18.1%}")
+
+    # One more day of events, read incrementally
+    appended = write_events(path, today, means[n_days:], rng, mode='a')
+    start = time.perf_counter()
+    added = forecaster.refresh(force=True)
+    refresh_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    forecaster.forecast(7)
+    refit_ms = (time.perf_counter() - start) * 1000
+    print(f"\nappend {int(appended.sum())} rows: refresh {refresh_ms:.1f} ms ({added} counted), refit {refit_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
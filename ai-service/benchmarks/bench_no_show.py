@@ -0,0 +1,87 @@
+"""
+Throughput of no-show scoring in rows/sec: the vectorized roster call
+against one call per appointment, in-process and through the HTTP API.
+Uses app/models/no_show_model.json (run `python app/ml/train_no_show.py`)
+or trains a throwaway model if it is missing:
+
+    python benchmarks/bench_no_show.py --rows 1000 10000 100000 --http-rows 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from app.ml.train_no_show import generate_synthetic_data, train
+from app.services.no_show_model import NoShowModel
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../app/models/no_show_model.json')
+FEATURES = ('age', 'gender', 'appointment_type', 'lead_time_days', 'prior_appointments', 'prior_no_shows')
+
+
+def roster(n: int, seed: int) -> dict:
+    """Columns as a scheduler would send them (Python lists)."""
+    data = generate_synthetic_data(n, seed)
+    return {name: data[name].tolist() for name in FEATURES}
+
+
+def rate(rows: int, seconds: float) -> str:
+    return f"{rows / seconds:>12,.0f} rows/s  ({seconds * 1000:9.2f} ms)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--single-rows", type=int, default=2000, help="Rows for the one-call-per-row measurement")
+    parser.add_argument("--http-rows", type=int, default=5000, help="Roster size for the HTTP measurement (0 skips it)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    model_path = MODEL_PATH
+    if not os.path.exists(model_path):
+        model_dir = tempfile.mkdtemp(prefix="bench-no-show-")
+        train(model_dir=model_dir)
+        model_path = os.path.join(model_dir, 'no_show_model.json')
+    model = NoShowModel.load(model_path)
+
+    print("in-process")
+    for n in args.rows:
+        columns = roster(n, args.seed)
+        model.predict_proba(columns)  # warm-up (memoizes category spellings)
+        start = time.perf_counter()
+        model.predict_proba(columns)
+        print(f"  batch    {n:>8}: {rate(n, time.perf_counter() - start)}")
+
+    columns = roster(args.single_rows, args.seed)
+    batch = model.predict_proba(columns)
+    start = time.perf_counter()
+    single = [model.predict_proba({name: [values[i]] for name, values in columns.items()})[0] for i in range(args.single_rows)]
+    print(f"  per-row  {args.single_rows:>8}: {rate(args.single_rows, time.perf_counter() - start)}")
+    assert np.allclose(single, batch), "batch and per-row scores differ"
+
+    if args.http_rows:
+        from fastapi.testclient import TestClient
+        import main as service
+        client = TestClient(service.app)
+        columns = roster(args.http_rows, args.seed)
+        items = [dict(zip(FEATURES, values), appointment_id=str(i)) for i, values in enumerate(zip(*(columns[f] for f in FEATURES)))]
+        client.post("/predictions/risk/batch", json={"appointments": items[:10]})  # Loads the model
+
+        start = time.perf_counter()
+        response = client.post("/predictions/risk/batch", json={"appointments": items})
+        response.raise_for_status()
+        print(f"http\n  batch    {args.http_rows:>8}: {rate(args.http_rows, time.perf_counter() - start)}")
+
+        n = min(args.http_rows, args.single_rows)
+        start = time.perf_counter()
+        for item in items[:n]:
+            client.post("/predictions/risk", json=item).raise_for_status()
+        print(f"  per-row  {n:>8}: {rate(n, time.perf_counter() - start)}")
+
+
+if __name__ == "__main__":
+    main()
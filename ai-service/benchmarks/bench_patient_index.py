@@ -0,0 +1,63 @@
+"""
+Append and query cost of PatientVectorIndex as a patient's document count
+grows, with random unit vectors (no API calls):
+
+    python benchmarks/bench_patient_index.py --documents 400 --chunks 25 --max-chunks 5000
+
+Appends stay proportional to the new document (plus an occasional compaction
+once the cap is reached) and query time levels off at the row cap.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.services.embedding_index import normalize_rows
+from app.services.patient_index import PatientVectorIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=400)
+    parser.add_argument("--chunks", type=int, default=25, help="Chunks per document")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--max-chunks", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    index = PatientVectorIndex(tempfile.mkdtemp(prefix="bench-patient-"), max_chunks=args.max_chunks)
+    queries = normalize_rows(rng.standard_normal((args.queries, args.dim)))
+    report_every = max(1, args.documents // 10)
+
+    print(f"{'docs':>6} {'rows':>7} {'MB':>7} | {'append ms':>10} | {'dense ms':>9} {'bm25 ms':>8}")
+    append_times = []
+    for doc in range(args.documents):
+        chunks = [f"doc {doc} chunk {i} hba1c {rng.uniform(4, 9):.1f} glucose {rng.integers(70, 200)}" for i in range(args.chunks)]
+        matrix = normalize_rows(rng.standard_normal((args.chunks, args.dim)))
+        start = time.perf_counter()
+        index.add_document("patient", f"doc{doc}", f"k{doc}", chunks, matrix)
+        append_times.append(time.perf_counter() - start)
+
+        if (doc + 1) % report_every == 0:
+            entry = index.get("patient")
+            start = time.perf_counter()
+            for q in queries:
+                np.argsort(entry.matrix @ q)[-8:]
+            dense_ms = (time.perf_counter() - start) / len(queries) * 1000
+            start = time.perf_counter()
+            for _ in range(len(queries)):
+                entry.lexical.search("hba1c trend glucose", 8)
+            bm25_ms = (time.perf_counter() - start) / len(queries) * 1000
+            append_ms = np.mean(append_times[-report_every:]) * 1000
+            print(f"{doc + 1:>6} {entry.size:>7} {entry.matrix.nbytes / 1e6:>7.1f} | {append_ms:>10.2f} | {dense_ms:>9.3f} {bm25_ms:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
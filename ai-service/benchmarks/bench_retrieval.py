@@ -0,0 +1,79 @@
+"""
+Recall-vs-latency benchmark for VectorIndex against exact float32 search.
+
+Uses synthetic clustered embeddings sized like the full MedQuAD corpus, so it
+runs offline:
+
+    python benchmarks/bench_retrieval.py --rows 47000 --dim 768
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.vector_search import VectorIndex
+
+
+def synthetic_embeddings(rows: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    return centers[labels] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+
+
+def run(index: VectorIndex, queries: np.ndarray, truth: np.ndarray, k: int, nprobe: int = None):
+    hits = 0
+    start = time.perf_counter()
+    for q, expected in zip(queries, truth):
+        ids, _ = index.search(q, k=k, nprobe=nprobe)
+        hits += len(set(ids.tolist()) & set(expected.tolist()))
+    elapsed = time.perf_counter() - start
+    return hits / truth.size, elapsed / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=47000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = synthetic_embeddings(args.rows, args.dim, clusters=max(16, args.rows // 200), seed=args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = data[rng.choice(args.rows, args.queries, replace=False)]
+    queries = queries + 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    exact = VectorIndex(data)
+    truth = np.stack([exact.search(q, k=args.k)[0] for q in queries])
+
+    print(f"{args.rows} x {args.dim}, {args.queries} queries, recall@{args.k} vs exact float32\n")
+    print(f"{'index':<28}{'MB':>8}{'recall':>10}{'ms/query':>12}")
+
+    configs = [
+        ("exact float32", dict(), [None]),
+        ("exact float16", dict(dtype='float16'), [None]),
+        ("exact int8", dict(dtype='int8'), [None]),
+        (f"ivf{args.nlist} float32", dict(nlist=args.nlist), [4, 16, 32]),
+        (f"ivf{args.nlist} int8", dict(dtype='int8', nlist=args.nlist), [16]),
+    ]
+    for name, kwargs, probes in configs:
+        build_start = time.perf_counter()
+        index = exact if not kwargs else VectorIndex(data, **kwargs)
+        build_s = time.perf_counter() - build_start
+        for nprobe in probes:
+            recall, ms = run(index, queries, truth, args.k, nprobe)
+            label = name if nprobe is None else f"{name} nprobe={nprobe}"
+            print(f"{label:<28}{index.nbytes / 1e6:>8.1f}{recall:>10.3f}{ms:>12.3f}")
+        if kwargs:
+            print(f"{'':<4}(built in {build_s:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Upstream Gemini calls and latency for bursts of identical concurrent /qa and
+/analyze-image requests (patient, doctor and frontend asking at once), with
+and without single-flight coalescing, over real HTTP with the fake Gemini
+backend:
+
+    python benchmarks/bench_single_flight.py --burst 3 --rounds 10
+
+Every round uses a new question / image, so the duplicates of a round can
+only be shared while the first one is still in flight (the response and
+image caches see nothing to reuse).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_genai
+import synthetic_docs
+
+
+async def burst(client, size: int, method: str, url: str, **kwargs):
+    async def one(i: int):
+        start = time.perf_counter()
+        # Each duplicate arrives a few ms after the previous one, as from separate clients
+        await asyncio.sleep(0.005 * i)
+        response = await client.request(method, url, **kwargs)
+        response.raise_for_status()
+        return time.perf_counter() - start
+    return await asyncio.gather(*(one(i) for i in range(size)))
+
+
+async def run(port: int, args, document: str, label: str, offset: int):
+    import httpx
+    fake_genai.reset_counters()
+    latencies = []
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+        for i in range(args.rounds):
+            latencies += await burst(client, args.burst, "POST", "/qa",
+                                     json={"context": document, "question": f"{label} question {offset + i}?", "document_id": "bench"})
+    qa_calls = dict(fake_genai.CALLS)
+
+    fake_genai.reset_counters()
+    image_latencies = []
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+        for i in range(args.rounds):
+            image = synthetic_docs.make_image(512, 512, seed=offset + i)
+            image_latencies += await burst(client, args.burst, "POST", "/analyze-image", files={"file": (f"scan{i}.png", image, "image/png")})
+    image_calls = dict(fake_genai.CALLS)
+
+    requests = args.rounds * args.burst
+    for route, calls, samples in (("/qa", qa_calls, latencies), ("/analyze-image", image_calls, image_latencies)):
+        samples = np.array(samples) * 1000
+        print(f"{label:<14} {route:<15} {requests} requests: generate calls {calls['generate']:3d}  embed calls {calls['embed']:3d}   "
+              f"p50 {np.percentile(samples, 50):6.0f} ms  p95 {np.percentile(samples, 95):6.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=3, help="Identical requests per round")
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--generate-ms", type=float, default=1500)
+    parser.add_argument("--embed-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ["AI_STATE_DIR"] = tempfile.mkdtemp(prefix="bench-single-flight-")
+    fake_genai.install(embed_latency=args.embed_ms / 1000, generate_latency=args.generate_ms / 1000)
+
+    import httpx
+    import uvicorn
+    import main as service
+
+    server = uvicorn.Server(uvicorn.Config(service.app, host="127.0.0.1", port=0, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    document = synthetic_docs.report_text(5, seed=0)
+    httpx.post(f"http://127.0.0.1:{port}/qa", json={"context": document, "question": "warm-up", "document_id": "bench"}, timeout=120).raise_for_status()
+    print(f"bursts of {args.burst} identical requests, fake generation {args.generate_ms:.0f} ms")
+
+    for label, enabled, offset in (("independent", False, 0), ("single-flight", True, 10_000)):
+        service.SINGLE_FLIGHT = enabled
+        asyncio.run(run(port, args, document, label, offset))
+    print(f"\n/ready single_flight: {httpx.get(f'http://127.0.0.1:{port}/ready').json()['single_flight']}")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
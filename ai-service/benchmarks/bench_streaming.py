@@ -0,0 +1,92 @@
+"""
+Time to first byte and total latency of /qa and /analyze-image against their
+Server-Sent Events variants, over real HTTP (uvicorn in a thread) with the
+fake Gemini backend:
+
+    python benchmarks/bench_streaming.py --generate-ms 2000 --requests 20
+
+Every request uses a new question or image, so no cached answer is reused.
+With streaming, the first chunk arrives after retrieval plus Gemini's time to
+its first token instead of after the whole answer.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_genai
+import synthetic_docs
+
+
+def measure(client, method: str, url: str, **kwargs):
+    """(seconds to the first body byte, seconds to the end of the body)."""
+    start = time.perf_counter()
+    first = None
+    with client.stream(method, url, **kwargs) as response:
+        response.raise_for_status()
+        for _ in response.iter_raw():
+            if first is None:
+                first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def report(label: str, samples):
+    first, total = (np.array(values) * 1000 for values in zip(*samples))
+    print(f"{label:<24} first byte p50 {np.percentile(first, 50):7.0f} ms  p95 {np.percentile(first, 95):7.0f} ms   "
+          f"total p50 {np.percentile(total, 50):7.0f} ms  p95 {np.percentile(total, 95):7.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--generate-ms", type=float, default=2000, help="Fake generation time for a whole answer")
+    parser.add_argument("--embed-ms", type=float, default=50)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=5, help="Pages of the /qa document")
+    args = parser.parse_args()
+
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ["AI_STATE_DIR"] = tempfile.mkdtemp(prefix="bench-streaming-")
+    fake_genai.install(embed_latency=args.embed_ms / 1000, generate_latency=args.generate_ms / 1000)
+
+    import httpx
+    import uvicorn
+    import main as service
+
+    server = uvicorn.Server(uvicorn.Config(service.app, host="127.0.0.1", port=0, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    document = synthetic_docs.report_text(args.pages, seed=0)
+    with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+        client.post("/qa", json={"context": document, "question": "warm-up", "document_id": "bench"}).raise_for_status()
+        print(f"fake generation {args.generate_ms:.0f} ms (streamed: first chunk after 1/4), {args.requests} requests each")
+
+        for label, url in (("/qa", "/qa"), ("/qa/stream", "/qa/stream")):
+            samples = [
+                measure(client, "POST", url, json={"context": document, "question": f"{label} question {i}?", "document_id": "bench"})
+                for i in range(args.requests)
+            ]
+            report(label, samples)
+
+        for label, url, offset in (("/analyze-image", "/analyze-image", 0), ("/analyze-image/stream", "/analyze-image/stream", 10_000)):
+            samples = [
+                measure(client, "POST", url, files={"file": (f"scan{i}.png", synthetic_docs.make_image(512, 512, seed=offset + i), "image/png")})
+                for i in range(args.requests)
+            ]
+            report(label, samples)
+
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
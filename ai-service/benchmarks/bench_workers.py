@@ -0,0 +1,108 @@
+"""
+Memory per worker process with private model/index copies against
+memory-mapped shared arrays, on a synthetic MedQuAD-sized knowledge base
+(fake Gemini embeddings, so no API quota is used):
+
+    python benchmarks/bench_workers.py --workers 1 2 4 --records 20000
+
+Each worker process builds what a uvicorn worker would: the MedRag retrieval
+index (from the embedding snapshot) and the compiled disease forest, runs a
+few searches and predictions so the arrays are paged in, then reports its
+resident memory. `private` memory is what grows with every added worker;
+`shared` (file-backed) pages are held once by the OS page cache.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+AI_SERVICE_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, AI_SERVICE_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+WORDS = ("fever cough asthma diabetes insulin glucose heart failure stroke kidney liver anemia thyroid migraine "
+         "arthritis lupus sepsis pneumonia influenza measles hepatitis tumor lymphoma eczema psoriasis ulcer").split()
+
+
+def write_knowledge_base(path: str, n_records: int):
+    import random
+    rng = random.Random(0)
+    records = [
+        {"id": i, "question": f"What is {' '.join(rng.sample(WORDS, 3))} {i}?", "answer": " ".join(rng.choices(WORDS, k=40))}
+        for i in range(n_records)
+    ]
+    with open(path, "w") as f:
+        json.dump(records, f)
+
+
+def worker(args, shared: bool, barrier, results):
+    import fake_genai
+    fake_genai.install()
+    import numpy as np
+    from app.services.med_rag_service import MedRagService
+    from app.services.metrics import process_memory
+    from app.services.prediction_service import PredictionService
+
+    start = time.perf_counter()
+    shared_dir = os.path.join(args["workdir"], "shared") if shared else None
+    med_rag = MedRagService("bench", data_path=args["data_path"], snapshot_dir=args["snapshot_dir"], retrieval_mode="dense", shared_dir=shared_dir)
+    predictor = PredictionService(shared_dir=shared_dir)
+    startup = time.perf_counter() - start
+
+    rng = np.random.default_rng(os.getpid())
+    for _ in range(20):
+        med_rag.index.search(rng.standard_normal(med_rag.index.dim).astype(np.float32), k=3)
+    if predictor.model is not None:
+        predictor.predict_disease_batch(["fever, cough, headache"] * 100)
+
+    results.put({"pid": os.getpid(), "startup": startup, **process_memory()})
+    barrier.wait()  # Stay alive until every worker has measured
+
+
+def run(args: dict, n_workers: int, shared: bool):
+    ctx = multiprocessing.get_context("spawn")  # Like uvicorn --workers
+    barrier, results = ctx.Barrier(n_workers), ctx.Queue()
+    processes = [ctx.Process(target=worker, args=(args, shared, barrier, results)) for _ in range(n_workers)]
+    for process in processes:
+        process.start()
+    rows = [results.get(timeout=600) for _ in processes]
+    for process in processes:
+        process.join()
+    mb = lambda key: sum(row.get(key, 0) for row in rows) / 1e6
+    print(
+        f"{'shared' if shared else 'private':<8} workers={n_workers}  per worker: rss {mb('rss') / n_workers:7.1f} MB  "
+        f"private {mb('private') / n_workers:7.1f} MB  shared {mb('shared') / n_workers:7.1f} MB   "
+        f"all workers private {mb('private'):8.1f} MB   startup {max(row['startup'] for row in rows):5.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--records", type=int, default=20000, help="Knowledge base records (768-d embeddings each)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-workers-")
+    data_path = os.path.join(workdir, "kb.json")
+    snapshot_dir = os.path.join(workdir, "snapshot")
+    write_knowledge_base(data_path, args.records)
+
+    import fake_genai
+    fake_genai.install()
+    from app.services.med_rag_service import MedRagService
+    start = time.perf_counter()
+    MedRagService("bench", data_path=data_path, snapshot_dir=snapshot_dir, retrieval_mode="dense")  # Writes the snapshot
+    print(f"knowledge base: {args.records} records, snapshot built in {time.perf_counter() - start:.1f}s\n")
+
+    config = {"workdir": workdir, "data_path": data_path, "snapshot_dir": snapshot_dir}
+    for n_workers in args.workers:
+        for shared in (False, True):
+            run(config, n_workers, shared)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Deterministic offline stand-in for `google.generativeai`.
+
+`install()` registers a fake module under `google.generativeai` before the
+services import it, so benchmarks and smoke tests run without API quota and
+give reproducible results:
+
+- `embed_content` returns hash-based bag-of-words embeddings: identical
+  texts give identical vectors and texts sharing words are similar, so
+  retrieval and the response cache behave like they would with real vectors.
+- `GenerativeModel.generate_content` returns a canned answer derived from a
+  hash of the prompt (optionally streamed in chunks).
+- Each call sleeps for a configurable latency (plus jitter) to model the
+  network round trip; calls are counted in `CALLS`.
+- With `quota_per_second`, calls beyond that many per one-second window fail
+  with a 429 `ResourceExhausted` (counted in `CALLS["throttled"]`), like the
+  API's per-minute quota scaled down.
+
+    import fake_genai
+    fake_genai.install(embed_latency=0.05, generate_latency=0.8)
+    import main  # services now talk to the fake
+"""
+import hashlib
+import random
+import re
+import sys
+import threading
+import time
+import types
+from functools import lru_cache
+
+import numpy as np
+
+CALLS = {"embed": 0, "embed_items": 0, "generate": 0, "generate_stream": 0, "throttled": 0}
+CONFIG = {
+    "dim": 768,
+    "embed_latency": 0.0,
+    "generate_latency": 0.0,
+    "jitter": 0.0,
+    "answer_words": 120,
+    "fail_rate": 0.0,
+    "quota_per_second": 0,
+    "seed": 0,
+}
+_lock = threading.Lock()
+_rng = random.Random(0)
+_TOKEN = re.compile(r"[a-z0-9]+")
+_window = [0.0, 0]  # Start of the current one-second quota window, calls in it
+
+
+class ResourceExhausted(Exception):
+    """Same name and `code` as google.api_core.exceptions.ResourceExhausted."""
+    code = 429
+
+
+def _count(name: str, amount: int = 1):
+    with _lock:
+        CALLS[name] += amount
+
+
+def reset_counters():
+    with _lock:
+        for key in CALLS:
+            CALLS[key] = 0
+
+
+def _sleep(latency: float):
+    with _lock:
+        if CONFIG["quota_per_second"]:
+            now = time.monotonic()
+            if now - _window[0] >= 1.0:
+                _window[0], _window[1] = now, 0
+            _window[1] += 1
+            if _window[1] > CONFIG["quota_per_second"]:
+                CALLS["throttled"] += 1
+                raise ResourceExhausted("fake_genai: 429 Resource has been exhausted (e.g. check quota).")
+        jitter = _rng.uniform(0, CONFIG["jitter"]) if CONFIG["jitter"] else 0.0
+        fail = CONFIG["fail_rate"] and _rng.random() < CONFIG["fail_rate"]
+    if latency + jitter > 0:
+        time.sleep(latency + jitter)
+    if fail:
+        raise RuntimeError("fake_genai: injected failure (503 Service Unavailable)")
+
+
+@lru_cache(maxsize=200_000)
+def _token_vector(token: str) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(f"{CONFIG['seed']}:{token}".encode(), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(CONFIG["dim"]).astype(np.float32)
+
+
+def embed_text(text: str) -> list:
+    tokens = _TOKEN.findall(str(text).lower())
+    if not tokens:
+        tokens = ["<empty>"]
+    vector = np.zeros(CONFIG["dim"], dtype=np.float32)
+    for token in tokens:
+        vector += _token_vector(token)
+    vector /= np.linalg.norm(vector) or 1.0
+    return vector.tolist()
+
+
+def embed_content(model=None, content=None, task_type=None, title=None, **kwargs):
+    if isinstance(content, (list, tuple)):
+        _sleep(CONFIG["embed_latency"])
+        _count("embed")
+        _count("embed_items", len(content))
+        return {"embedding": [embed_text(item) for item in content]}
+    _sleep(CONFIG["embed_latency"])
+    _count("embed")
+    _count("embed_items")
+    return {"embedding": embed_text(content)}
+
+
+def _prompt_text(contents) -> str:
+    if isinstance(contents, (list, tuple)):
+        return "".join(_prompt_text(part) for part in contents)
+    if isinstance(contents, (str, bytes)):
+        return contents if isinstance(contents, str) else contents.decode("latin-1")
+    return repr(type(contents))  # PIL images and other parts
+
+
+def canned_answer(contents) -> str:
+    digest = hashlib.sha256(_prompt_text(contents).encode("utf-8", "replace")).hexdigest()
+    words = [f"finding-{digest[i % 60:i % 60 + 4]}" for i in range(CONFIG["answer_words"])]
+    return f"[fake {digest[:12]}] " + " ".join(words)
+
+
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class _StreamResponse:
+    """Iterates text chunks like the SDK's streaming response; `.text` joins them."""
+
+    def __init__(self, text: str, chunks: int, latency: float):
+        size = max(1, len(text) // max(chunks, 1))
+        self._pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        self._latency = latency
+        self.text = text
+
+    def __iter__(self):
+        per_chunk = self._latency / max(len(self._pieces), 1)
+        for piece in self._pieces:
+            time.sleep(per_chunk)
+            yield _Chunk(piece)
+
+    def resolve(self):
+        return self
+
+
+class GenerativeModel:
+    def __init__(self, model_name: str = "fake-model", **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        answer = canned_answer(contents)
+        if stream:
+            _count("generate_stream")
+            # First chunk after ~1/4 of the latency, the rest spread out
+            _sleep(CONFIG["generate_latency"] / 4)
+            return _StreamResponse(answer, chunks=8, latency=CONFIG["generate_latency"] * 3 / 4)
+        _sleep(CONFIG["generate_latency"])
+        _count("generate")
+        return _Response(answer)
+
+
+def configure(api_key=None, **kwargs):
+    pass
+
+
+def install(embed_latency: float = None, generate_latency: float = None, jitter: float = None, dim: int = None, fail_rate: float = None, seed: int = None, quota_per_second: int = None) -> types.ModuleType:
+    """Registers the fake as `google.generativeai` and applies the given settings."""
+    for key, value in (("embed_latency", embed_latency), ("generate_latency", generate_latency), ("jitter", jitter),
+                       ("dim", dim), ("fail_rate", fail_rate), ("seed", seed), ("quota_per_second", quota_per_second)):
+        if value is not None:
+            CONFIG[key] = value
+    _token_vector.cache_clear()
+    _rng.seed(CONFIG["seed"])
+
+    module = types.ModuleType("google.generativeai")
+    module.configure = configure
+    module.embed_content = embed_content
+    module.GenerativeModel = GenerativeModel
+    module.FAKE = True
+    sys.modules["google.generativeai"] = module
+    try:
+        import google  # Namespace package shared with protobuf etc.
+    except ImportError:
+        google = types.ModuleType("google")
+        google.__path__ = []
+        sys.modules["google"] = google
+    google.generativeai = module
+    return module
@@ -0,0 +1,99 @@
+"""
+Import-time profile of `main` (via `python -X importtime`), used as a cold-start
+check: fails when a heavy dependency is imported eagerly again or when the
+import exceeds the budget.
+
+    python benchmarks/import_profile.py --budget-ms 1500
+    python benchmarks/import_profile.py --serve   # also time start -> first /ready
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Must only be imported on first use of the service that needs them
+LAZY_MODULES = ['google.generativeai', 'PIL', 'pypdf', 'numpy', 'joblib', 'sklearn', 'pandas']
+
+
+def profile_imports():
+    """Returns {module: (self_us, cumulative_us)} for a fresh `import main`."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=SERVICE_DIR, capture_output=True, text=True, env=os.environ.copy()
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"import main failed:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def time_first_ready(timeout: float = 60.0) -> float:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'],
+        cwd=SERVICE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/ready', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.02)
+        raise SystemExit(f"/ready did not answer within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=None, help="Fail if `import main` takes longer")
+    parser.add_argument("--top", type=int, default=15, help="Slowest top-level imports to list")
+    parser.add_argument("--serve", action="store_true", help="Also time process start to first 200 from /ready")
+    args = parser.parse_args()
+
+    modules = profile_imports()
+    total_ms = modules['main'][1] / 1000
+    print(f"import main: {total_ms:.0f} ms cumulative, {len(modules)} modules\n")
+
+    top_level = sorted(
+        ((cum, name) for name, (_, cum) in modules.items() if '.' not in name and name != 'main'),
+        reverse=True
+    )[:args.top]
+    for cum, name in top_level:
+        print(f"{cum / 1000:>9.1f} ms  {name}")
+
+    failures = []
+    eager = [m for m in LAZY_MODULES if m in modules]
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        failures.append(f"import took {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    if args.serve:
+        print(f"\nstart -> first /ready: {time_first_ready():.2f} s")
+
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
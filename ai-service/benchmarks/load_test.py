@@ -0,0 +1,326 @@
+"""
+Offline load test for the AI service.
+
+Drives the FastAPI app in-process (httpx + ASGITransport) with the
+deterministic fake Gemini backend (benchmarks/fake_genai.py), so runs cost no
+API quota and are reproducible. Status callbacks go to a local stub server.
+Reports p50/p95/p99 latency, requests/sec and process memory per scenario.
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/load_test.py --scenario all --requests 200 --concurrency 16
+    python benchmarks/load_test.py --scenario process --pdf-pages 1 10 50 --generate-ms 800
+
+Save a baseline and fail (exit code 1) when a later run regresses:
+
+    python benchmarks/load_test.py --save baseline.json
+    python benchmarks/load_test.py --compare baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_genai
+import synthetic_docs
+
+SCENARIOS = ("qa", "process", "image", "disease")
+
+
+class CallbackStub:
+    """Stands in for the Node backend's status callback routes."""
+
+    def __init__(self):
+        self.received: Dict[str, float] = {}
+        self.event = threading.Condition()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_PATCH(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                if self.path.endswith("/status/batch"):
+                    ids = [update["id"] for update in body.get("updates", [])]
+                else:
+                    ids = [self.path.split("/")[-2]]
+                with stub.event:
+                    for document_id in ids:
+                        stub.received[document_id] = time.perf_counter()
+                    stub.event.notify_all()
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api"
+
+    def wait_for(self, ids: List[str], timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self.event:
+            while not all(document_id in self.received for document_id in ids):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.event.wait(remaining)
+        return True
+
+
+def memory_mb() -> Dict[str, float]:
+    """Current and peak resident set size of this process."""
+    values = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    values[line.split(":")[0]] = int(line.split()[1]) / 1024
+        return {"rss_mb": round(values.get("VmRSS", 0), 1), "peak_rss_mb": round(values.get("VmHWM", 0), 1)}
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 * 1024)
+        return {"rss_mb": None, "peak_rss_mb": round(peak, 1)}
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(name: str, latencies: List[float], errors: int, wall: float, extra: dict = None) -> dict:
+    values = sorted(latencies)
+    result = {
+        "scenario": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        "rps": round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        "wall_s": round(wall, 2),
+    }
+    result.update(memory_mb())
+    result.update(extra or {})
+    return result
+
+
+async def drive(send: Callable, n: int, concurrency: int) -> Tuple[List[float], int, float]:
+    """Runs `await send(i)` for i in range(n) with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await send(i)
+                ok = response.status_code < 400
+            except Exception as e:
+                print(f"  request {i} failed: {e}")
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return latencies, errors, time.perf_counter() - start
+
+
+# --- Scenarios ---
+
+async def scenario_qa(client, main, args) -> dict:
+    documents = [synthetic_docs.report_text(args.qa_pages, seed=i) for i in range(args.documents)]
+    questions = synthetic_docs.questions(args.requests, seed=args.seed)
+    rng = random.Random(args.seed)
+    picks = [rng.randrange(len(documents)) for _ in range(args.requests)]
+
+    async def send(i):
+        # Repeats of earlier (document, question) pairs exercise the response cache
+        j = rng.randrange(i) if i and rng.random() < args.repeat_ratio else i
+        return await client.post("/qa", json={
+            "context": documents[picks[j]],
+            "question": f"{questions[j]} (#{j})",
+            "document_id": f"bench-doc-{picks[j]}",
+        })
+
+    latencies, errors, wall = await drive(send, args.requests, args.concurrency)
+    return summarize("qa", latencies, errors, wall, {"documents": len(documents), "pages_per_document": args.qa_pages})
+
+
+async def scenario_process(client, main, args, callbacks: CallbackStub) -> dict:
+    pdf_dir = os.path.join(args.work_dir, "pdfs")
+    paths = [synthetic_docs.make_report_pdf(pdf_dir, pages, seed=args.seed) for pages in args.pdf_pages]
+    jobs = []
+    for i in range(args.jobs):
+        pages = args.pdf_pages[i % len(args.pdf_pages)]
+        jobs.append((f"bench-job-{args.seed}-{i}", paths[i % len(paths)], pages))
+
+    submitted = {}
+    start = time.perf_counter()
+    for document_id, path, _ in jobs:
+        submitted[document_id] = time.perf_counter()
+        response = await client.post("/process", json={"document_id": document_id, "file_path": path, "mime_type": "application/pdf"})
+        response.raise_for_status()
+
+    ids = [document_id for document_id, _, _ in jobs]
+    done = await asyncio.to_thread(callbacks.wait_for, ids, args.timeout)
+    wall = time.perf_counter() - start
+    latencies = [callbacks.received[d] - submitted[d] for d in ids if d in callbacks.received]
+    pages = sum(p for d, _, p in jobs if d in callbacks.received)
+    result = summarize("process", latencies, len(ids) - len(latencies), wall, {
+        "pages_per_s": round(pages / wall, 1) if wall > 0 else 0.0,
+        "pdf_pages": args.pdf_pages,
+    })
+    if not done:
+        result["timed_out"] = True
+    return result
+
+
+async def scenario_image(client, main, args) -> dict:
+    images = [synthetic_docs.make_image(args.image_size, args.image_size, seed=i) for i in range(4)]
+
+    async def send(i):
+        return await client.post("/analyze-image", files={"file": (f"scan{i}.png", images[i % len(images)], "image/png")})
+
+    latencies, errors, wall = await drive(send, args.requests, args.concurrency)
+    return summarize("image", latencies, errors, wall, {"image_bytes": len(images[0])})
+
+
+async def scenario_disease(client, main, args) -> dict:
+    predictor = main.predictor.get()
+    if not predictor.model:
+        return {"scenario": "disease", "skipped": "disease model not found (run app/ml/train_model.py)"}
+    rng = random.Random(args.seed)
+    symptoms = predictor.all_symptoms
+
+    async def send(i):
+        return await client.post("/predictions/disease-custom", json={"symptoms": ", ".join(rng.sample(symptoms, rng.randint(2, 6)))})
+
+    latencies, errors, wall = await drive(send, args.requests, args.concurrency)
+    return summarize("disease", latencies, errors, wall)
+
+
+# --- Driver ---
+
+def setup_app(args, callbacks: CallbackStub):
+    """Points the service at the fake Gemini and the callback stub, then imports it."""
+    fake_genai.install(
+        embed_latency=args.embed_ms / 1000,
+        generate_latency=args.generate_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        seed=args.seed,
+    )
+    os.environ["GEMINI_API_KEY"] = "fake-key"
+    os.environ["BACKEND_URL"] = callbacks.url
+    os.environ["AI_STATE_DIR"] = os.path.join(args.work_dir, "state")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import main
+    return main
+
+
+async def run(args) -> List[dict]:
+    import httpx
+
+    callbacks = CallbackStub()
+    main = setup_app(args, callbacks)
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = []
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            for name in scenarios:
+                fake_genai.reset_counters()
+                if name == "process":
+                    result = await scenario_process(client, main, args, callbacks)
+                else:
+                    result = await globals()[f"scenario_{name}"](client, main, args)
+                result["gemini_calls"] = dict(fake_genai.CALLS)
+                results.append(result)
+                print_result(result)
+    return results
+
+
+def print_result(result: dict):
+    if "skipped" in result:
+        print(f"{result['scenario']:<8} skipped: {result['skipped']}")
+        return
+    print(
+        f"{result['scenario']:<8} n={result['requests']:<5} err={result['errors']:<3} "
+        f"p50={result['p50_ms']:>9.2f}ms p95={result['p95_ms']:>9.2f}ms p99={result['p99_ms']:>9.2f}ms "
+        f"rps={result['rps']:>8.2f} rss={result['rss_mb']}MB peak={result['peak_rss_mb']}MB"
+        + (f" pages/s={result['pages_per_s']}" if "pages_per_s" in result else "")
+    )
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    ok = True
+    for result in results:
+        before = baseline.get(result["scenario"])
+        if not before or "skipped" in result or "skipped" in before:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            print(f"REGRESSION {result['scenario']}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms")
+            ok = False
+        if result["rps"] < before["rps"] * (1 - tolerance):
+            print(f"REGRESSION {result['scenario']}: rps {before['rps']} -> {result['rps']}")
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario (qa, image, disease)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--jobs", type=int, default=12, help="Documents submitted in the process scenario")
+    parser.add_argument("--pdf-pages", type=int, nargs="+", default=[1, 10, 50], help="Synthetic PDF sizes (pages)")
+    parser.add_argument("--documents", type=int, default=20, help="Distinct documents in the qa scenario")
+    parser.add_argument("--qa-pages", type=int, default=20, help="Pages per qa document")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Share of qa requests repeating an earlier question")
+    parser.add_argument("--image-size", type=int, default=1024)
+    parser.add_argument("--embed-ms", type=float, default=50, help="Fake embedding call latency")
+    parser.add_argument("--generate-ms", type=float, default=400, help="Fake generation call latency")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=None, help="Where PDFs and service state go (default: a temp dir)")
+    parser.add_argument("--save", help="Write results as JSON")
+    parser.add_argument("--compare", help="Baseline JSON from --save; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression for --compare")
+    args = parser.parse_args()
+    args.work_dir = args.work_dir or tempfile.mkdtemp(prefix="ai-bench-")
+
+    print(f"Fake Gemini: embed {args.embed_ms}ms, generate {args.generate_ms}ms; work dir {args.work_dir}")
+    results = asyncio.run(run(args))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k not in ("save", "compare")}, "results": results}, f, indent=2)
+        print(f"Saved results to {args.save}")
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
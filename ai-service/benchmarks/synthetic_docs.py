@@ -0,0 +1,140 @@
+"""
+Synthetic inputs for the benchmarks: multi-page lab-report PDFs (written
+directly, no PDF library needed), report text, questions and images.
+
+    python benchmarks/synthetic_docs.py --pages 1 10 50 --out /tmp/bench_pdfs
+"""
+import argparse
+import io
+import os
+import random
+from typing import List
+
+TESTS = [
+    ("Hemoglobin", "g/dL", 12.0, 17.5), ("WBC", "10^3/uL", 4.0, 11.0), ("Platelets", "10^3/uL", 150, 450),
+    ("Glucose (fasting)", "mg/dL", 70, 100), ("HbA1c", "%", 4.0, 5.6), ("Creatinine", "mg/dL", 0.6, 1.3),
+    ("ALT", "U/L", 7, 56), ("AST", "U/L", 10, 40), ("TSH", "mIU/L", 0.4, 4.0), ("LDL cholesterol", "mg/dL", 0, 100),
+    ("HDL cholesterol", "mg/dL", 40, 80), ("Triglycerides", "mg/dL", 0, 150), ("Sodium", "mmol/L", 135, 145),
+    ("Potassium", "mmol/L", 3.5, 5.1), ("Vitamin D", "ng/mL", 30, 100), ("CRP", "mg/L", 0, 10),
+]
+NOTES = [
+    "Patient reports intermittent fatigue and mild shortness of breath on exertion.",
+    "No known drug allergies. Currently taking metformin 500 mg twice daily.",
+    "Recommend repeat lipid panel in three months and dietary consultation.",
+    "Follow up with endocrinology regarding thyroid function.",
+    "Blood pressure measured at 138/88 mmHg, slightly elevated.",
+    "Advise increased hydration and reduced sodium intake.",
+    "Chest X-ray shows no acute cardiopulmonary abnormality.",
+    "Consider vitamin D supplementation 1000 IU daily.",
+]
+QUESTIONS = [
+    "What is my {test} level?",
+    "Is my {test} normal?",
+    "What does an abnormal {test} mean?",
+    "Which results are outside the reference range?",
+    "What medications am I taking?",
+    "What did the doctor recommend?",
+    "When should I follow up?",
+    "Is my blood pressure high?",
+]
+
+
+def report_pages(n_pages: int, seed: int = 0, lines_per_page: int = 40) -> List[List[str]]:
+    """Lines of a synthetic lab report, page by page (with a repeated header and footer)."""
+    rng = random.Random(seed)
+    pages = []
+    for page in range(n_pages):
+        lines = [f"City General Hospital - Laboratory Report - Patient #{seed:05d}", ""]
+        while len(lines) < lines_per_page - 2:
+            if rng.random() < 0.7:
+                name, unit, low, high = rng.choice(TESTS)
+                value = rng.uniform(low * 0.7, high * 1.3)
+                flag = " H" if value > high else " L" if value < low else ""
+                lines.append(f"{name}: {value:.1f} {unit} (ref {low}-{high}){flag}")
+            else:
+                lines.append(rng.choice(NOTES))
+        lines.append("")
+        lines.append(f"Page {page + 1} of {n_pages} - Confidential")
+        pages.append(lines)
+    return pages
+
+
+def report_text(n_pages: int, seed: int = 0) -> str:
+    return "\n".join("\n".join(lines) for lines in report_pages(n_pages, seed))
+
+
+def questions(n: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [rng.choice(QUESTIONS).format(test=rng.choice(TESTS)[0]) for _ in range(n)]
+
+
+def _pdf_string(line: str) -> bytes:
+    escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return b"(" + escaped.encode("latin-1", "replace") + b")"
+
+
+def make_pdf(path: str, pages: List[List[str]]):
+    """Writes a minimal PDF with one Helvetica text block per page."""
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = len(objects) + 1 + 2 * len(pages)  # Content + page object per page come first
+    page_ids = []
+    for lines in pages:
+        content = b"BT /F1 10 Tf 50 780 Td 12 TL " + b" ".join(_pdf_string(line) + b" '" for line in lines) + b" ET"
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R /Resources << /Font << /F1 %d 0 R >> >> >>"
+            % (pages_id, content_id, font)
+        ))
+    add(b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % p for p in page_ids) + b"] /Count %d >>" % len(page_ids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+
+def make_report_pdf(directory: str, n_pages: int, seed: int = 0) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"report_{n_pages}p_{seed}.pdf")
+    if not os.path.exists(path):
+        make_pdf(path, report_pages(n_pages, seed))
+    return path
+
+
+def make_image(width: int = 1024, height: int = 1024, seed: int = 0, fmt: str = "PNG") -> bytes:
+    """A noisy grayscale 'scan' (random content, so every seed compresses differently)."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = 128 + 60 * np.sin(xx / 37.0 + seed) * np.cos(yy / 53.0)
+    pixels = np.clip(base + rng.normal(0, 20, (height, width)), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="/tmp/bench_pdfs")
+    args = parser.parse_args()
+    for n in args.pages:
+        path = make_report_pdf(args.out, n, args.seed)
+        print(f"{path}: {os.path.getsize(path) / 1024:.1f} KiB")
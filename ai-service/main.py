@@ -1,15 +1,25 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 import os
+import json
+import time
+import hashlib
+import logging
 from dotenv import load_dotenv
-from app.services.text_extractor import PDFTextExtractor
-from app.services.summarizer import GeminiSummarizer
-from app.services.rag_service import RAGService
-from app.services.image_analyzer import MedicalImageAnalyzer
-from app.services.prediction_service import PredictionService
-import requests
+from app.services import metrics
+from app.services.executor import ServiceExecutor
+from app.services import gemini_gateway
+from app.services.gemini_gateway import GeminiBusyError, GeminiGateway
+from app.services.job_queue import DocumentJobQueue, PermanentJobError, QueueFullError
+from app.services.lazy import LazyService
+from app.services.single_flight import SingleFlight
+from typing import Iterator, List, Optional
+import threading
+# Services (and google.generativeai, PIL, pypdf, numpy, sklearn) are imported
+# lazily by their factories below to keep cold start short.
 
 # Load env from backend directory
 env_path = os.path.join(os.path.dirname(__file__), '../backend/.env')
@@ -20,6 +30,89 @@ load_dotenv(env_path)
 API_KEY = os.getenv("GEMINI_API_KEY")
 # print(f"API Key Found: {'Yes' if API_KEY else 'No'}")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:4000/api") # Node.js Backend
+STATE_DIR = os.getenv("AI_STATE_DIR", os.path.join(os.path.dirname(__file__), 'state')) # Local indexes & caches
+DOC_INDEX_MAX_LOADED = int(os.getenv("DOC_INDEX_MAX_LOADED", "64"))
+DOC_INDEX_MAX_DOCUMENTS = int(os.getenv("DOC_INDEX_MAX_DOCUMENTS", "5000"))
+RAG_CHUNK_MAX_CHARS = int(os.getenv("RAG_CHUNK_MAX_CHARS", "1000"))
+# dense | hybrid (dense + BM25) | lexical (BM25 only, no embedding calls) | auto (lexical when keywords suffice)
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+RAG_LEXICAL_WEIGHT = float(os.getenv("RAG_LEXICAL_WEIGHT", "1.0"))
+# Per-patient cross-document index: oldest documents are dropped beyond PATIENT_INDEX_MAX_CHUNKS rows
+PATIENT_INDEX_MAX_CHUNKS = int(os.getenv("PATIENT_INDEX_MAX_CHUNKS", "5000"))
+PATIENT_INDEX_MAX_LOADED = int(os.getenv("PATIENT_INDEX_MAX_LOADED", "32"))
+PATIENT_QA_TOP_K = int(os.getenv("PATIENT_QA_TOP_K", "8"))
+# Cached /qa answers: semantic hits need this cosine similarity and the same retrieved chunks
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000")) # 0 disables the cache
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+RESPONSE_CACHE_PERSIST = os.getenv("RESPONSE_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+# /analyze-image: uploads above IMAGE_MAX_UPLOAD_BYTES get 413; images are downscaled to IMAGE_MAX_SIDE
+# and re-encoded (JPEG, WEBP or PNG) before upload; results are cached by content hash
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1536"))
+IMAGE_ENCODING = os.getenv("IMAGE_ENCODING", "JPEG").upper()
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "1000")) # 0 disables the cache
+IMAGE_CACHE_TTL_SECONDS = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(7 * 86400)))
+IMAGE_CACHE_HASH_DISTANCE = int(os.getenv("IMAGE_CACHE_HASH_DISTANCE", "0")) # >0 also reuses perceptually identical images
+# /predictions/inflow: appointment/admission history aggregated by day and hour
+INFLOW_HISTORY_PATH = os.getenv("INFLOW_HISTORY_PATH", "") # CSV or SQLite export of appointments/admissions
+INFLOW_SQLITE_TABLE = os.getenv("INFLOW_SQLITE_TABLE", "events")
+INFLOW_UTC_OFFSET_MINUTES = int(os.getenv("INFLOW_UTC_OFFSET_MINUTES", "0")) # Hospital time zone, for day boundaries
+INFLOW_HISTORY_WEEKS = int(os.getenv("INFLOW_HISTORY_WEEKS", "8"))
+INFLOW_MAX_DAYS = int(os.getenv("INFLOW_MAX_DAYS", "90"))
+INFLOW_RETENTION_DAYS = int(os.getenv("INFLOW_RETENTION_DAYS", "1100"))
+INFLOW_REFRESH_SECONDS = float(os.getenv("INFLOW_REFRESH_SECONDS", "30"))
+
+# Shared Gemini admission control (see app/services/gemini_gateway.py)
+GEMINI_RATE_LIMITS = os.getenv("GEMINI_RATE_LIMITS", "generate=1000,embed=1500") # Requests/minute per call type or model:call
+GEMINI_INITIAL_CONCURRENCY = int(os.getenv("GEMINI_INITIAL_CONCURRENCY", "8"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+GEMINI_BACKGROUND_SHARE = float(os.getenv("GEMINI_BACKGROUND_SHARE", "0.75")) # Of the concurrency limit usable by document jobs
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "5"))
+GEMINI_INTERACTIVE_MAX_ATTEMPTS = int(os.getenv("GEMINI_INTERACTIVE_MAX_ATTEMPTS", "3"))
+GEMINI_INTERACTIVE_MAX_WAIT = float(os.getenv("GEMINI_INTERACTIVE_MAX_WAIT", "30")) # Seconds before 503
+# Worker processes sharing the quota (set by serve.py); each enforces its share of GEMINI_RATE_LIMITS
+WORKER_COUNT = max(1, int(os.getenv("AI_WORKERS", "1")))
+
+# Blocking SDK calls run on a bounded pool; each service gets its own in-flight cap
+EXECUTOR_THREADS = int(os.getenv("AI_EXECUTOR_THREADS", "32"))
+SERVICE_CONCURRENCY = {
+    "rag": int(os.getenv("RAG_CONCURRENCY", "8")),
+    "image": int(os.getenv("IMAGE_CONCURRENCY", "4")),
+    "prediction": int(os.getenv("PREDICTION_CONCURRENCY", "4")),
+}
+# Document processing queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_BACKLOG = int(os.getenv("JOB_MAX_BACKLOG", "1000"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+# Long reports are summarized section by section (map-reduce) with bounded concurrency
+SUMMARY_SECTION_CHARS = int(os.getenv("SUMMARY_SECTION_CHARS", "12000"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+# PDF extraction: >1 worker fans page ranges out to a process pool; budgets of 0 mean unlimited
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", "0"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "0")) or None
+PDF_MAX_CHARS = int(os.getenv("PDF_MAX_CHARS", "0")) or None
+PREDICTION_MAX_BATCH = int(os.getenv("PREDICTION_MAX_BATCH", "10000"))
+# Status callbacks to the backend; CALLBACK_BATCH_SIZE > 1 sends them through the batch route
+CALLBACK_TIMEOUT = float(os.getenv("CALLBACK_TIMEOUT", "30"))
+CALLBACK_MAX_RETRIES = int(os.getenv("CALLBACK_MAX_RETRIES", "3"))
+CALLBACK_BATCH_SIZE = int(os.getenv("CALLBACK_BATCH_SIZE", "0"))
+EXTRACTED_TEXT_LIMIT = 100000 # Approx 100k chars are stored by the backend and sent back on /qa
+# Upload routes and their body size limits (checked against Content-Length before parsing)
+UPLOAD_LIMITS = {"/analyze-image": IMAGE_MAX_UPLOAD_BYTES, "/analyze-image/stream": IMAGE_MAX_UPLOAD_BYTES}
+# Routes whose requests are measured but not logged (probes and scrapes)
+QUIET_ROUTES = {"/health", "/ready", "/metrics"}
+# Read-only model/index arrays are memory-mapped from here so uvicorn workers share one copy (see serve.py)
+SHARED_ARRAYS = os.getenv("AI_SHARED_ARRAYS", "true").lower() in ("1", "true", "yes")
+SHARED_DIR = os.path.join(STATE_DIR, 'shared')
+# Concurrent identical /qa questions (same document text) and image uploads share one computation
+SINGLE_FLIGHT = os.getenv("AI_SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+# Build every service at startup (in the background) instead of on first request
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("ai-service")
 
 app = FastAPI()
 
@@ -38,113 +131,542 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Dependencies
-extractor = PDFTextExtractor()
-summarizer = GeminiSummarizer(api_key=API_KEY) if API_KEY else None
-rag_service = RAGService(api_key=API_KEY) if API_KEY else None
-image_analyzer = MedicalImageAnalyzer(api_key=API_KEY) if API_KEY else None
-predictor = PredictionService()
+# One gateway for every service's Gemini calls
+gemini_gateway.set_gateway(GeminiGateway(
+    rate_limits={key: rate / WORKER_COUNT for key, rate in gemini_gateway.parse_rate_limits(GEMINI_RATE_LIMITS).items()},
+    initial_concurrency=GEMINI_INITIAL_CONCURRENCY,
+    max_concurrency=GEMINI_MAX_CONCURRENCY,
+    background_share=GEMINI_BACKGROUND_SHARE,
+    max_attempts=GEMINI_MAX_ATTEMPTS,
+    interactive_max_attempts=GEMINI_INTERACTIVE_MAX_ATTEMPTS,
+    interactive_max_wait=GEMINI_INTERACTIVE_MAX_WAIT
+))
+
+# Dependencies (built on first use, see LazyService)
+def _build_extractor():
+    from app.services.text_extractor import PDFTextExtractor
+    return PDFTextExtractor(workers=PDF_EXTRACT_WORKERS)
+
+def _build_summarizer():
+    from app.services.summarizer import GeminiSummarizer
+    return GeminiSummarizer(api_key=API_KEY, section_chars=SUMMARY_SECTION_CHARS, max_concurrency=SUMMARY_CONCURRENCY)
+
+def _build_rag_service():
+    from app.services.rag_service import RAGService
+    from app.services.embedding_index import DocumentEmbeddingIndex
+    from app.services.chunker import StructuredChunker
+    from app.services.patient_index import PatientVectorIndex
+    doc_index = DocumentEmbeddingIndex(
+        os.path.join(STATE_DIR, 'doc_index'),
+        max_loaded=DOC_INDEX_MAX_LOADED,
+        max_documents=DOC_INDEX_MAX_DOCUMENTS
+    )
+    response_cache = None
+    if RESPONSE_CACHE_MAX_ENTRIES > 0:
+        from app.services.response_cache import SemanticResponseCache
+        response_cache = SemanticResponseCache(
+            threshold=RESPONSE_CACHE_THRESHOLD,
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+            persist_path=os.path.join(STATE_DIR, 'response_cache.db') if RESPONSE_CACHE_PERSIST else None
+        )
+    return RAGService(
+        api_key=API_KEY,
+        index=doc_index,
+        response_cache=response_cache,
+        chunker=StructuredChunker(max_chars=RAG_CHUNK_MAX_CHARS),
+        retrieval_mode=RAG_RETRIEVAL_MODE,
+        lexical_weight=RAG_LEXICAL_WEIGHT,
+        lexical_cache_size=DOC_INDEX_MAX_LOADED,
+        patient_index=PatientVectorIndex(
+            os.path.join(STATE_DIR, 'patient_index'),
+            max_chunks=PATIENT_INDEX_MAX_CHUNKS,
+            max_loaded=PATIENT_INDEX_MAX_LOADED
+        )
+    )
+
+def _build_image_analyzer():
+    from app.services.image_analyzer import MedicalImageAnalyzer
+    from app.services.image_preprocessor import ImagePreprocessor
+    from app.services.image_cache import ImageResultCache
+    cache = None
+    if IMAGE_CACHE_MAX_ENTRIES > 0:
+        cache = ImageResultCache(
+            max_entries=IMAGE_CACHE_MAX_ENTRIES,
+            ttl_seconds=IMAGE_CACHE_TTL_SECONDS,
+            hash_distance=IMAGE_CACHE_HASH_DISTANCE
+        )
+    return MedicalImageAnalyzer(
+        api_key=API_KEY,
+        preprocessor=ImagePreprocessor(max_side=IMAGE_MAX_SIDE, encoding=IMAGE_ENCODING),
+        cache=cache
+    )
+
+def _build_predictor():
+    from app.services.prediction_service import PredictionService
+    forecaster = None
+    if INFLOW_HISTORY_PATH:
+        from app.services.inflow_forecaster import InflowForecaster, open_event_source
+        forecaster = InflowForecaster(
+            open_event_source(INFLOW_HISTORY_PATH, INFLOW_SQLITE_TABLE),
+            state_dir=os.path.join(STATE_DIR, 'inflow'),
+            utc_offset_minutes=INFLOW_UTC_OFFSET_MINUTES,
+            history_weeks=INFLOW_HISTORY_WEEKS,
+            max_days=INFLOW_MAX_DAYS,
+            retention_days=INFLOW_RETENTION_DAYS,
+            refresh_seconds=INFLOW_REFRESH_SECONDS
+        )
+    return PredictionService(inflow_forecaster=forecaster, shared_dir=SHARED_DIR if SHARED_ARRAYS else None)
+
+def _build_callback_client():
+    from app.services.callback_client import BackendCallbackClient
+    return BackendCallbackClient(
+        BACKEND_URL,
+        os.path.join(STATE_DIR, 'callback_outbox.db'),
+        read_timeout=CALLBACK_TIMEOUT,
+        max_retries=CALLBACK_MAX_RETRIES,
+        batch_size=CALLBACK_BATCH_SIZE,
+        pool_size=JOB_WORKERS + 2
+    )
+
+extractor = LazyService("extractor", _build_extractor)
+summarizer = LazyService("summarizer", _build_summarizer) if API_KEY else None
+rag_service = LazyService("rag_service", _build_rag_service) if API_KEY else None
+image_analyzer = LazyService("image_analyzer", _build_image_analyzer) if API_KEY else None
+predictor = LazyService("predictor", _build_predictor)
+callback_client = LazyService("callback_client", _build_callback_client)
+services = [s for s in (extractor, summarizer, rag_service, image_analyzer, predictor) if s is not None]
+executor = ServiceExecutor(EXECUTOR_THREADS, SERVICE_CONCURRENCY)
+# In-flight requests by key, per worker process (see app/services/single_flight.py)
+flights = {"/qa": SingleFlight("/qa"), "/analyze-image": SingleFlight("/analyze-image")}
 
 class JobRequest(BaseModel):
     document_id: str
     file_path: str
     mime_type: str
+    patient_id: Optional[str] = None # Adds the document to the patient's cross-document index
 
 class QARequest(BaseModel):
     context: str
     question: str
+    document_id: Optional[str] = None
+
+class PatientQARequest(BaseModel):
+    question: str
+    top_k: Optional[int] = None
 
 class RiskRequest(BaseModel):
     age: int
     gender: str
     appointment_type: str
+    lead_time_days: Optional[float] = None # Days between booking and the appointment
+    prior_appointments: Optional[int] = None
+    prior_no_shows: Optional[int] = None
+
+class RiskBatchItem(RiskRequest):
+    appointment_id: Optional[str] = None # Echoed back with the score
+
+class RiskBatchRequest(BaseModel):
+    appointments: List[RiskBatchItem]
 
 def process_document(job: JobRequest):
     """
-    Background task to process the document
+    Runs extract -> summarize -> callback for one document. Raises on failure
+    so the job queue can retry; PermanentJobError marks failures retrying won't fix.
     """
-    print(f"Processing job for doc: {job.document_id}")
+    timings, token = metrics.start_timings()
+    start = time.perf_counter()
+    outcome = "error"
     try:
-        # 1. Extract Text
-        text = extractor.extract_text(job.file_path, job.mime_type)
-        if not text:
-            raise Exception("Failed to extract text from document")
-
-        # 2. Summarize
-        if not summarizer:
-             raise Exception("Summarizer not configured (Missing API Key)")
-        
-        summary = summarizer.summarize(text)
-
-        # 3. Callback to Backend (Update DB)
-        # Note: In a real system, we'd use a shared secret or internal network
-        payload = {
-            "summary": summary,
-            "status": "COMPLETED",
-            "extractedText": text[:100000] # Increased limit for RAG (Approx 100k chars)
-        }
-        
-        print(f"SUCCESS: Generated summary for {job.document_id}")
-        response = requests.patch(f"{BACKEND_URL}/patient-documents/{job.document_id}/status", json=payload)
-        print(f"Callback Status: {response.status_code}")
+        # Bulk work: its Gemini calls queue behind interactive requests
+        with gemini_gateway.background():
+            _process_document(job)
+        outcome = "completed"
+    finally:
+        metrics.record_stage("document", time.perf_counter() - start)
+        logger.info(json.dumps({"event": "job", "document_id": job.document_id, "outcome": outcome, "stages": timings}))
+        metrics.stop_timings(token)
 
-    except Exception as e:
-        print(f"FAILED: {e}")
+def _process_document(job: JobRequest):
+    logger.info(f"Processing job for doc: {job.document_id}")
+    # 1. Extract Text (download errors propagate and are retried; unparseable or empty PDFs are not)
+    import requests
+    try:
+        with metrics.timed("extract"):
+            text = extractor.get().extract_text(job.file_path, job.mime_type, max_pages=PDF_MAX_PAGES, max_chars=PDF_MAX_CHARS)
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if status is not None and 400 <= status < 500 and status not in (408, 429):
+            raise PermanentJobError(f"Document download failed with {status}") from e
+        raise
+    if not text:
+        raise PermanentJobError("Failed to extract text from document")
+    extracted_text = text[:EXTRACTED_TEXT_LIMIT]
+
+    # 1b. Index chunk embeddings once so /qa only has to embed the question,
+    #     and append them to the patient's cross-document index
+    if rag_service:
+        try:
+            if job.patient_id:
+                rag_service.get().index_patient_document(job.patient_id, job.document_id, extracted_text)
+            else:
+                rag_service.get().index_document(job.document_id, extracted_text)
+        except Exception as e:
+            logger.warning(f"Indexing failed for {job.document_id}, /qa will index on demand: {e}")
+
+    # 2. Summarize
+    if not summarizer:
+        raise PermanentJobError("Summarizer not configured (Missing API Key)")
+
+    with metrics.timed("summarize"):
+        summary = summarizer.get().summarize(text)
+
+    # 3. Callback to Backend (Update DB)
+    # Note: In a real system, we'd use a shared secret or internal network
+    payload = {
+        "summary": summary,
+        "status": "COMPLETED",
+        "extractedText": extracted_text # Must match the indexed text for /qa cache hits
+    }
+
+    logger.info(f"Generated summary for {job.document_id}")
+    # Undelivered updates stay in the callback outbox, so the (expensive) job is not re-run
+    with metrics.timed("callback"):
+        delivered = callback_client.get().send_status(job.document_id, payload)
+    logger.info(f"Callback {'delivered' if delivered else 'queued'} for {job.document_id}")
+
+def report_job_failure(document_id: str, payload: dict, error: str):
+    """Called once a job has exhausted its retries."""
+    logger.error(f"Job for {document_id} FAILED: {error}")
+    callback_client.get().send_status(document_id, {"status": "FAILED", "error": error})
+
+job_queue = DocumentJobQueue(
+    os.path.join(STATE_DIR, 'jobs.db'),
+    handler=lambda payload: process_document(JobRequest(**payload)),
+    on_failure=report_job_failure,
+    workers=JOB_WORKERS,
+    max_backlog=JOB_MAX_BACKLOG,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retry_base_delay=JOB_RETRY_BASE_SECONDS
+)
+
+warmup_done = threading.Event()
+
+def prepare_shared_state():
+    """
+    One-off work done by serve.py before it starts the workers: unpacks the
+    model arrays into SHARED_DIR and builds/refreshes the persisted inflow
+    aggregates, so N workers attach them instead of each repeating it.
+    """
+    start = time.perf_counter()
+    _build_predictor()
+    logger.info(f"Shared state prepared in {time.perf_counter() - start:.2f}s ({SHARED_DIR})")
+
+def warm_up():
+    """Builds every configured service so the first requests don't pay for it."""
+    for service in services:
         try:
-             requests.patch(f"{BACKEND_URL}/patient-documents/{job.document_id}/status", json={"status": "FAILED", "error": str(e)})
-        except:
-             pass
+            service.get()
+        except Exception as e:
+            logger.warning(f"Warm-up of {service.name} failed: {e}")
+    warmup_done.set()
+
+@app.on_event("startup")
+def start_job_queue():
+    callback_client.get().start() # Replays updates left in the outbox by a previous run
+    job_queue.start()
+    if WARMUP_ON_STARTUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    else:
+        warmup_done.set()
+
+@app.on_event("shutdown")
+def shutdown_workers():
+    job_queue.stop()
+    callback_client.get().stop()
+    executor.shutdown()
+    if extractor.loaded:
+        extractor.get().shutdown()
+    if summarizer and summarizer.loaded:
+        summarizer.get().shutdown()
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """413 before the multipart body is parsed and spooled, when the declared size is over the limit."""
+    limit = UPLOAD_LIMITS.get(request.url.path)
+    length = request.headers.get("content-length")
+    if limit and length and length.isdigit() and int(length) > limit:
+        return JSONResponse(status_code=413, content={"detail": f"Upload exceeds {limit} bytes"})
+    return await call_next(request)
+
+@app.middleware("http")
+async def log_request_timings(request: Request, call_next):
+    """Records request latency and logs one structured line with the stage timings."""
+    timings, token = metrics.start_timings()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=path, status=status)
+        if path not in QUIET_ROUTES:
+            logger.info(json.dumps({
+                "event": "request",
+                "method": request.method,
+                "route": path,
+                "status": status,
+                "duration_ms": round(elapsed * 1000, 2),
+                "stages": timings
+            }))
+        metrics.stop_timings(token)
 
 @app.post("/process")
-async def create_job(job: JobRequest, background_tasks: BackgroundTasks):
-    background_tasks.add_task(process_document, job)
-    return {"message": "Job accepted", "document_id": job.document_id}
+async def create_job(job: JobRequest):
+    try:
+        status = job_queue.submit(job.document_id, job.model_dump())
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return {"message": "Job accepted", "document_id": job.document_id, "status": status["status"]}
+
+@app.get("/jobs/{document_id}")
+async def get_job_status(document_id: str):
+    status = job_queue.get(document_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
 
 @app.post("/qa")
 async def answer_question(req: QARequest):
     if not rag_service:
         raise HTTPException(status_code=500, detail="AI Service (RAG) not configured")
-    try:
+    async def compute():
         # Use RAG Pipeline
-        answer = rag_service.answer_question_rag(req.context, req.question)
+        return await executor.run("rag", lambda: rag_service.get().answer_question_rag(req.context, req.question, document_id=req.document_id))
+
+    try:
+        answer = await flights["/qa"].run(qa_flight_key(req), compute) if SINGLE_FLIGHT else await compute()
         return {"answer": answer}
+    except GeminiBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
-        print(f"QA Error: {e}")
+        logger.error(f"QA Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def qa_flight_key(req: QARequest) -> str:
+    """Document text hash + normalized question: the inputs the answer depends on."""
+    from app.services.response_cache import normalize_question
+    text_hash = hashlib.sha256(req.context.encode('utf-8')).hexdigest()  # <= EXTRACTED_TEXT_LIMIT chars
+    return f"{text_hash}:{normalize_question(req.question)}"
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+
+async def open_stream(service: str, make_chunks):
+    """
+    Runs `make_chunks()` (retrieval etc., returns the chunk iterator) and
+    pulls the first chunk on the executor before the response starts, so
+    errors up to then (e.g. Gemini busy) still get a proper status code.
+    """
+    chunks = await executor.run(service, make_chunks)
+    first = await executor.run(service, next, chunks, None)
+    return chunks, first
+
+async def sse_stream(service: str, chunks: Iterator[str], first: Optional[str], route: str, start: float):
+    """
+    Forwards answer chunks as Server-Sent Events: one `data: {"text": ...}`
+    event per chunk, then `event: done` (or `event: error` if generation
+    fails midway). Each chunk is pulled on the executor, as generation blocks.
+    Time to the first chunk is recorded separately from the total.
+    """
+    first_chunk = time.perf_counter() - start
+    metrics.STREAM_FIRST_CHUNK_SECONDS.observe(first_chunk, route=route)
+    sent = 0
+    outcome = "error"
+    try:
+        text = first
+        while text is not None:
+            sent += 1
+            yield sse_event({"text": text})
+            text = await executor.run(service, next, chunks, None)
+        outcome = "ok"
+        yield sse_event({"chunks": sent}, event="done")
+    except Exception as e:
+        logger.error(f"Stream Error on {route}: {e}")
+        yield sse_event({"detail": str(e)}, event="error")
+    finally:
+        # Client gone or stream over: end the generation and free its Gemini slot
+        try:
+            chunks.close()
+        except (AttributeError, ValueError):
+            pass
+        elapsed = time.perf_counter() - start
+        metrics.STREAM_SECONDS.observe(elapsed, route=route, outcome=outcome)
+        logger.info(json.dumps({
+            "event": "stream",
+            "route": route,
+            "outcome": outcome,
+            "chunks": sent,
+            "first_chunk_ms": round(first_chunk * 1000, 2),
+            "duration_ms": round(elapsed * 1000, 2)
+        }))
+
+def sse_response(service: str, chunks: Iterator[str], first: Optional[str], route: str, start: float) -> StreamingResponse:
+    return StreamingResponse(
+        sse_stream(service, chunks, first, route, start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # No proxy buffering
+    )
+
+@app.post("/qa/stream")
+async def answer_question_stream(req: QARequest):
+    """/qa as Server-Sent Events: retrieval first, then the answer as Gemini generates it."""
+    if not rag_service:
+        raise HTTPException(status_code=500, detail="AI Service (RAG) not configured")
+    start = time.perf_counter()
+    try:
+        chunks, first = await open_stream("rag", lambda: rag_service.get().answer_question_rag_stream(req.context, req.question, document_id=req.document_id))
+    except GeminiBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        logger.error(f"QA Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return sse_response("rag", chunks, first, "/qa/stream", start)
+
+@app.post("/patients/{patient_id}/qa")
+async def answer_patient_question(patient_id: str, req: PatientQARequest):
+    """Q&A across all processed documents of a patient, with the source of every excerpt."""
+    if not rag_service:
+        raise HTTPException(status_code=500, detail="AI Service (RAG) not configured")
+    top_k = max(1, min(req.top_k or PATIENT_QA_TOP_K, 20))
+    try:
+        return await executor.run("rag", lambda: rag_service.get().answer_patient_question(patient_id, req.question, top_k=top_k))
+    except GeminiBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        logger.error(f"Patient QA Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/patients/{patient_id}/documents/{document_id}")
+async def remove_patient_document(patient_id: str, document_id: str):
+    """
+    Drops a deleted document from the patient's cross-document index, and its
+    reference to the per-document embedding entry (deleted once unused).
+    """
+    if not rag_service:
+        raise HTTPException(status_code=500, detail="AI Service (RAG) not configured")
+    rag = rag_service.get()
+
+    def remove():
+        removed = rag.patient_index.remove_document(patient_id, document_id)
+        if rag.index is not None:
+            rag.index.remove_document(document_id)
+        return removed
+
+    removed = await executor.run("rag", remove)
+    return {"removed": removed}
+
 @app.post("/analyze-image")
 async def analyze_image(file: UploadFile = File(...)):
-    print(f"Received image analysis request: {file.filename}, {file.content_type}")
+    logger.info(f"Received image analysis request: {file.filename}, {file.content_type}")
     if not image_analyzer:
-        print("Error: Image Analyzer not configured")
+        logger.error("Image Analyzer not configured")
         raise HTTPException(status_code=500, detail="Image Analyzer not configured (Missing API Key)")
     
+    # Uploads without a Content-Length are checked once spooled (memory up to 1 MB, then disk)
+    if file.size is not None and file.size > IMAGE_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {IMAGE_MAX_UPLOAD_BYTES} bytes")
+
     try:
-        content = await file.read()
-        print(f"Read {len(content)} bytes from file")
-        analysis = image_analyzer.analyze_image(content, file.content_type)
-        print("Analysis generated successfully")
+        if not SINGLE_FLIGHT:
+            # The spooled file is passed on as-is instead of being read into memory
+            analysis = await executor.run("image", lambda: image_analyzer.get().analyze_image(file.file, file.content_type))
+            return {"analysis": analysis}
+
+        # Coalesced requests share the computation, so it must not depend on the
+        # leader's upload (closed if that client goes away): read it once (size
+        # already capped by IMAGE_MAX_UPLOAD_BYTES) and key and analyze the bytes
+        def read_upload():
+            data = file.file.read()
+            return data, hashlib.sha256(data).hexdigest()
+
+        data, content_hash = await executor.run("image", read_upload)
+
+        async def compute():
+            return await executor.run("image", lambda: image_analyzer.get().analyze_image(data, file.content_type, content_hash=content_hash))
+
+        analysis = await flights["/analyze-image"].run(content_hash, compute)
         return {"analysis": analysis}
+    except GeminiBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     except Exception as e:
-        print(f"Analysis Failed with Exception: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Analysis Failed with Exception: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/analyze-image/stream")
+async def analyze_image_stream(file: UploadFile = File(...)):
+    """/analyze-image as Server-Sent Events: the analysis is forwarded as Gemini generates it."""
+    if not image_analyzer:
+        raise HTTPException(status_code=500, detail="Image Analyzer not configured (Missing API Key)")
+    if file.size is not None and file.size > IMAGE_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {IMAGE_MAX_UPLOAD_BYTES} bytes")
+
+    start = time.perf_counter()
+    try:
+        chunks, first = await open_stream("image", lambda: image_analyzer.get().analyze_image_stream(file.file, file.content_type))
+    except GeminiBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except Exception as e:
+        logger.exception(f"Analysis Failed with Exception: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    return sse_response("image", chunks, first, "/analyze-image/stream", start)
 
 # --- Prediction Ednpoints ---
 @app.get("/predictions/inflow")
-async def get_inflow_prediction():
+async def get_inflow_prediction(days: int = 7, department: Optional[str] = None, hourly: bool = False):
+    if not 1 <= days <= INFLOW_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {INFLOW_MAX_DAYS}")
     try:
-        data = predictor.predict_inflow()
+        data = await executor.run("prediction", lambda: predictor.get().predict_inflow(days, department=department, hourly=hourly))
         return data
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No inflow history for department {department}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def risk_level(score: int) -> str:
+    return "High" if score > 70 else "Medium" if score > 30 else "Low"
+
 @app.post("/predictions/risk")
 async def predict_risk(req: RiskRequest):
     try:
-        score = predictor.predict_no_show(req.age, req.gender, req.appointment_type)
-        return {"risk_score": score, "level": "High" if score > 70 else "Medium" if score > 30 else "Low"}
+        score = await executor.run("prediction", lambda: predictor.get().predict_no_show(
+            req.age, req.gender, req.appointment_type, req.lead_time_days, req.prior_appointments, req.prior_no_shows
+        ))
+        return {"risk_score": score, "level": risk_level(score)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/predictions/risk/batch")
+async def predict_risk_batch(req: RiskBatchRequest):
+    """Scores a whole roster (e.g. tomorrow's schedule) in one call."""
+    if len(req.appointments) > PREDICTION_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {PREDICTION_MAX_BATCH} rows)")
+    rows = req.appointments
+    columns = {
+        name: [getattr(row, name) for row in rows]
+        for name in ("age", "gender", "appointment_type", "lead_time_days", "prior_appointments", "prior_no_shows")
+    }
+    try:
+        scores = await executor.run("prediction", lambda: predictor.get().predict_no_show_batch(columns).tolist())
+        return {"predictions": [
+            {"appointment_id": row.appointment_id, "risk_score": score, "level": risk_level(score)}
+            for row, score in zip(rows, scores)
+        ]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -154,16 +676,68 @@ class DiseasePredictionRequest(BaseModel):
 @app.post("/predictions/disease-custom")
 async def predict_disease_custom(req: DiseasePredictionRequest):
     try:
-        result = predictor.predict_disease_ml(req.symptoms)
+        result = await executor.run("prediction", lambda: predictor.get().predict_disease_ml(req.symptoms))
         return result
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+class DiseaseBatchPredictionRequest(BaseModel):
+    symptoms: List[str]
+    top_k: int = 1
+
+@app.post("/predictions/disease-custom/batch")
+async def predict_disease_custom_batch(req: DiseaseBatchPredictionRequest):
+    if len(req.symptoms) > PREDICTION_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {PREDICTION_MAX_BATCH} rows)")
+    try:
+        results = await executor.run("prediction", lambda: predictor.get().predict_disease_batch(req.symptoms, top_k=req.top_k))
+        return {"predictions": results}
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    for status, count in job_queue.stats().items():
+        metrics.JOBS.set(count, status=status)
+    for lane, stats in gemini_gateway.get_gateway().stats().items():
+        metrics.GEMINI_CONCURRENCY_LIMIT.set(stats["limit"], lane=lane)
+    # Each worker reports its own memory (labelled by pid)
+    for kind, value in metrics.process_memory().items():
+        metrics.PROCESS_MEMORY_BYTES.set(value, pid=os.getpid(), kind=kind)
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 def health_check():
     return {"status": "ok", "python_version": "3.x"}
 
+@app.get("/ready")
+def readiness_check():
+    """503 until start-up (and warm-up, if enabled) has finished."""
+    body = {
+        "ready": warmup_done.is_set(),
+        "warmup": WARMUP_ON_STARTUP,
+        "services": {service.name: service.status() for service in services}
+    }
+    rag = rag_service.peek() if rag_service else None
+    if rag and rag.response_cache:
+        body["response_cache"] = rag.response_cache.stats()
+    analyzer = image_analyzer.peek() if image_analyzer else None
+    if analyzer and analyzer.cache:
+        body["image_cache"] = analyzer.cache.stats()
+    body["gemini"] = gemini_gateway.get_gateway().stats()
+    body["single_flight"] = {route: flight.stats() for route, flight in flights.items()}
+    body["process"] = {"pid": os.getpid(), **{f"{kind}_mb": round(value / 1e6, 1) for kind, value in metrics.process_memory().items()}}
+    prediction = predictor.peek()
+    if prediction and prediction.inflow_forecaster:
+        body["inflow"] = prediction.inflow_forecaster.stats()
+    if not body["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,97 @@
+"""
+Multi-worker entrypoint for the AI service.
+
+    python serve.py --workers 4 --port 8000
+
+1. Shared state is prepared once, in this process: model arrays are unpacked
+   into AI_STATE_DIR/shared and the inflow aggregates are built (see
+   main.prepare_shared_state).
+2. uvicorn starts N worker processes. Each imports main and memory-maps the
+   prepared arrays read-only, so model and index memory is shared through
+   the page cache instead of being copied N times; work that cannot be
+   prepared up front (the MedRag snapshot sync, patient index appends) is
+   serialized between workers with lock files.
+3. Every --memory-report seconds the resident memory of each worker is
+   logged (rss / private / shared); workers also report their own in
+   /ready and as ai_process_memory_bytes on /metrics.
+
+Per-worker state that is not shared: response and image caches (in-memory
+LRUs), BM25 indexes and the Gemini gateway; each worker's gateway enforces
+GEMINI_RATE_LIMITS divided by the worker count (AI_WORKERS).
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+import uvicorn
+
+AI_SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("ai-service")
+
+
+def worker_pids(parent: int):
+    """Child processes of `parent` (the uvicorn workers), from /proc."""
+    pids = []
+    try:
+        for tid in os.listdir(f"/proc/{parent}/task"):
+            with open(f"/proc/{parent}/task/{tid}/children", "r") as f:
+                pids.extend(int(pid) for pid in f.read().split())
+    except OSError:
+        pass
+    return sorted(pid for pid in set(pids) if not _is_resource_tracker(pid))
+
+
+def _is_resource_tracker(pid: int) -> bool:
+    """multiprocessing's resource tracker is also a child of the supervisor."""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return b"resource_tracker" in f.read()
+    except OSError:
+        return False
+
+
+def report_memory(interval: float):
+    from app.services.metrics import process_memory
+    supervisor = os.getpid()
+    while True:
+        time.sleep(interval)
+        workers = {pid: process_memory(pid) for pid in worker_pids(supervisor)}
+        workers = {pid: memory for pid, memory in workers.items() if memory}
+        if not workers:
+            continue
+        logger.info(json.dumps({
+            "event": "worker_memory",
+            "workers": {str(pid): {f"{kind}_mb": round(value / 1e6, 1) for kind, value in memory.items()} for pid, memory in workers.items()},
+            "private_total_mb": round(sum(memory.get("private", 0) for memory in workers.values()) / 1e6, 1),
+        }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("AI_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("AI_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("AI_WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+    parser.add_argument("--memory-report", type=float, default=float(os.getenv("AI_MEMORY_REPORT_SECONDS", "60")), help="Seconds between worker memory log lines (0 disables)")
+    args = parser.parse_args()
+
+    os.chdir(AI_SERVICE_DIR)
+    os.environ["AI_WORKERS"] = str(args.workers)  # Read by main (rate limit share) in every worker
+    # 1. Prepare shared state once
+    import main as service
+    service.prepare_shared_state()
+
+    # 2. Workers (each imports main afresh and attaches the shared arrays)
+    if args.memory_report > 0 and args.workers > 1:
+        threading.Thread(target=report_memory, args=(args.memory_report,), name="memory-report", daemon=True).start()
+    if args.workers > 1:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, app_dir=AI_SERVICE_DIR)
+    else:
+        uvicorn.run(service.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,8 @@ const app = express();
 import mongoose from "mongoose";
 //connectDB();
 app.use(cors());
-app.use(express.json());
+// Raised from the 100kb default: AI callbacks carry up to 100k chars of extracted text (batched)
+app.use(express.json({ limit: process.env.JSON_BODY_LIMIT || "10mb" }));
 //app.use('/api', require('./routes/auth'));
 mongoose
   .connect(process.env.MONGODB_URL)
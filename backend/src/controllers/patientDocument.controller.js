@@ -1,4 +1,5 @@
 import { PatientDocument } from "../models/patientDocument.model.js";
+import mongoose from "mongoose";
 import { aiJobService } from "../services/AIJobService.js";
 
 // Upload a new document
@@ -30,7 +31,7 @@ export const uploadDocument = async (req, res) => {
 
         // 3. Async Dispatch to AI Microservice
         // We pass the URL (fileUrl) instead of a local path
-        aiJobService.dispatchJob(newDoc._id, fileUrl, req.file.mimetype);
+        aiJobService.dispatchJob(newDoc._id, fileUrl, req.file.mimetype, patientId);
 
         res.status(201).json(newDoc);
 
@@ -81,6 +82,7 @@ export const deleteDocument = async (req, res) => {
         }
 
         await PatientDocument.findByIdAndDelete(id);
+        aiJobService.removePatientDocument(doc.patientId, doc._id);
         res.json({ message: "Document deleted successfully" });
 
     } catch (error) {
@@ -89,15 +91,19 @@ export const deleteDocument = async (req, res) => {
     }
 };
 // Update Document Status (Callback for AI Service)
+const buildStatusUpdate = ({ status, summary, error, extractedText }) => {
+    const updateData = { status };
+    if (summary) updateData.summary = summary;
+    if (error) updateData.processingError = error;
+    if (extractedText) updateData.extractedText = extractedText;
+    return updateData;
+};
+
 export const updateDocumentStatus = async (req, res) => {
     try {
         const { id } = req.params;
-        const { status, summary, error, extractedText } = req.body;
-
-        const updateData = { status };
-        if (summary) updateData.summary = summary;
-        if (error) updateData.processingError = error;
-        if (extractedText) updateData.extractedText = extractedText;
+        const { status } = req.body;
+        const updateData = buildStatusUpdate(req.body);
 
         const doc = await PatientDocument.findByIdAndUpdate(
             id,
@@ -117,6 +123,35 @@ export const updateDocumentStatus = async (req, res) => {
     }
 };
 
+// Batched variant of the status callback: { updates: [{ id, status, summary, error, extractedText }] }
+export const updateDocumentStatusBatch = async (req, res) => {
+    try {
+        const { updates } = req.body;
+        if (!Array.isArray(updates) || updates.length === 0) {
+            return res.status(400).json({ message: "updates must be a non-empty array" });
+        }
+
+        const operations = updates
+            .filter(update => mongoose.Types.ObjectId.isValid(update.id))
+            .map(update => ({
+                updateOne: {
+                    filter: { _id: update.id },
+                    update: { $set: buildStatusUpdate(update) }
+                }
+            }));
+
+        const result = operations.length
+            ? await PatientDocument.bulkWrite(operations, { ordered: false })
+            : { matchedCount: 0, modifiedCount: 0 };
+
+        console.log(`[Callback] Batch updated ${result.matchedCount}/${updates.length} documents`);
+        res.json({ received: updates.length, matched: result.matchedCount, modified: result.modifiedCount });
+    } catch (err) {
+        console.error("Error updating document statuses:", err);
+        res.status(500).json({ message: "Server error updating statuses" });
+    }
+};
+
 // Ask a question about a document
 export const askQuestion = async (req, res) => {
     try {
@@ -132,7 +167,7 @@ export const askQuestion = async (req, res) => {
             return res.status(400).json({ message: "Document text not available for Q&A. Please wait for analysis to complete." });
         }
 
-        const answer = await aiJobService.askQuestion(doc.extractedText, question);
+        const answer = await aiJobService.askQuestion(doc.extractedText, question, doc._id);
 
         // Persist Chat History
         if (!doc.chatHistory) {
@@ -151,3 +186,26 @@ export const askQuestion = async (req, res) => {
         res.status(500).json({ message: errorMessage });
     }
 };
+
+// Ask a question across all of a patient's documents (own documents, or any patient for doctors/admins)
+export const askPatientQuestion = async (req, res) => {
+    try {
+        const { patientId } = req.params;
+        const { question } = req.body;
+
+        if (!question) {
+            return res.status(400).json({ message: "question is required" });
+        }
+        if (patientId !== req.user.id && !['doctor', 'admin'].includes(req.user.role)) {
+            return res.status(403).json({ message: "Not authorized to query this patient's documents" });
+        }
+
+        const result = await aiJobService.askPatientQuestion(patientId, question);
+        res.json({ answer: result.answer, sources: result.sources });
+
+    } catch (error) {
+        console.error("Error asking patient question:", error);
+        const errorMessage = error.response?.data?.detail || error.message || "Failed to get answer from AI";
+        res.status(500).json({ message: errorMessage });
+    }
+};
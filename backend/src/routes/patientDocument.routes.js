@@ -7,7 +7,9 @@ import {
     getDocumentsByPatientId,
     deleteDocument,
     updateDocumentStatus,
-    askQuestion
+    updateDocumentStatusBatch,
+    askQuestion,
+    askPatientQuestion
 } from '../controllers/patientDocument.controller.js';
 
 const router = express.Router();
@@ -16,9 +18,11 @@ const router = express.Router();
 router.post('/upload', verifyToken, upload.single('file'), uploadDocument);
 router.get('/my-documents', verifyToken, getMyDocuments);
 router.get('/patient/:patientId', verifyToken, isDoctorOrAdmin, getDocumentsByPatientId);
+router.post('/patient/:patientId/ask', verifyToken, askPatientQuestion);
 router.delete('/:id', verifyToken, deleteDocument);
 router.post('/:id/ask', verifyToken, askQuestion);
 // Callback route for AI Service (No auth for internal demo, add API key in prod)
+router.patch('/status/batch', updateDocumentStatusBatch);
 router.patch('/:id/status', updateDocumentStatus);
 
 export default router;
@@ -17,8 +17,9 @@ class AIJobService {
      * @param {string} documentId - The ID of the document record
      * @param {string} filePath - Absolute path to the file
      * @param {string} mimeType - File MIME type
+     * @param {string} [patientId] - Adds the document to the patient's cross-document index
      */
-    async dispatchJob(documentId, filePath, mimeType) {
+    async dispatchJob(documentId, filePath, mimeType, patientId) {
         try {
             console.log(`[AIJobService] Dispatching job for doc ${documentId} to ${this.aiServiceUrl}/process`);
 
@@ -27,7 +28,8 @@ class AIJobService {
             await axios.post(`${this.aiServiceUrl}/process`, {
                 document_id: documentId,
                 file_path: filePath,
-                mime_type: mimeType
+                mime_type: mimeType,
+                patient_id: patientId ? String(patientId) : undefined
             });
 
             return true;
@@ -43,13 +45,15 @@ class AIJobService {
      * Sends a question and context to the AI service.
      * @param {string} context - The full text of the document
      * @param {string} question - The user's question
+     * @param {string} [documentId] - Lets the AI service reuse the document's chunk index
      */
-    async askQuestion(context, question) {
+    async askQuestion(context, question, documentId) {
         try {
             console.log(`[AIJobService] Asking question to ${this.aiServiceUrl}/qa`);
             const response = await axios.post(`${this.aiServiceUrl}/qa`, {
                 context,
-                question
+                question,
+                document_id: documentId ? String(documentId) : undefined
             });
             return response.data;
         } catch (error) {
@@ -58,6 +62,40 @@ class AIJobService {
         }
     }
 
+    /**
+     * askPatientQuestion
+     * Asks a question across all processed documents of a patient.
+     * @param {string} patientId - The patient whose documents are searched
+     * @param {string} question - The user's question
+     * @returns {Promise<{answer: string, sources: Array}>} Answer plus the document and chunk of every excerpt used
+     */
+    async askPatientQuestion(patientId, question) {
+        try {
+            console.log(`[AIJobService] Asking patient question to ${this.aiServiceUrl}/patients/${patientId}/qa`);
+            const response = await axios.post(`${this.aiServiceUrl}/patients/${encodeURIComponent(String(patientId))}/qa`, {
+                question
+            });
+            return response.data;
+        } catch (error) {
+            console.error(`[AIJobService] Patient question failed:`, error.message);
+            throw error;
+        }
+    }
+
+    /**
+     * removePatientDocument
+     * Drops a deleted document from the patient's cross-document index.
+     */
+    async removePatientDocument(patientId, documentId) {
+        try {
+            await axios.delete(`${this.aiServiceUrl}/patients/${encodeURIComponent(String(patientId))}/documents/${encodeURIComponent(String(documentId))}`);
+            return true;
+        } catch (error) {
+            console.error(`[AIJobService] Failed to remove document from patient index:`, error.message);
+            return false;
+        }
+    }
+
     /**
      * predictDiseaseML
      * Calls the Custom ML Endpoint